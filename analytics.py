@@ -0,0 +1,214 @@
+"""Attendance analytics for a date range, computed column-wise with NumPy.
+
+The range is pulled with COPY ... (FORMAT binary). No column is ever NULL,
+so every tuple has the same width and the COPY buffer is viewed directly as
+a NumPy structured array – no per-row Python at all.
+Leave ranges are painted onto a dense employee × day grid (diff + cumsum)
+and every metric is a vectorized mask or bincount over those columns:
+
+    present   punched in and not marked absent
+    late      present with time_in after SHIFT_START
+    hours     time_out - time_in (a punch-out past midnight wraps)
+    overtime  hours beyond WORKDAY_HOURS on a day
+    absent    marked absent on a day not covered by leave
+    expected  Mon–Fri days up to today, minus leave days
+    attendance_pct = present / expected
+
+Per-department figures are sums over the employees' columns.
+"""
+import io
+import os
+from datetime import date
+
+import numpy as np
+
+from db import db_conn
+from rollups import SHIFT_START
+
+WORKDAY_HOURS = float(os.getenv("WORKDAY_HOURS", "8"))
+
+_PG_EPOCH = date(2000, 1, 1)
+_NO_TIME = 86_400_000_000        # time '24:00' (one day in µs) stands in for NULL
+
+# raw columns: in binary COPY a date is int4 days since 2000-01-01 and a time
+# int8 µs since midnight, so Postgres does no conversion work
+_COPY_SQL = """
+    COPY (
+        SELECT emp_id, date,
+               COALESCE(time_in, time '24:00'), COALESCE(time_out, time '24:00'),
+               absent
+          FROM attendance_range(%(first)s, %(last)s)
+    ) TO STDOUT WITH (FORMAT binary)
+"""
+
+# per tuple: int16 field count, then an int32 length before every value
+_TUPLE = np.dtype([
+    ("nfields", ">i2"),
+    ("len_emp", ">i4"), ("emp_id", ">i4"),
+    ("len_date", ">i4"), ("date", ">i4"),
+    ("len_in", ">i4"), ("t_in", ">i8"),
+    ("len_out", ">i4"), ("t_out", ">i8"),
+    ("len_absent", ">i4"), ("absent", "u1"),
+])
+_SIGNATURE = b"PGCOPY\n\xff\r\n\x00"
+
+
+def _parse_copy(buf, first):
+    """Binary COPY output → emp_id, day offset, µs in/out (-1: none), absent."""
+    if bytes(buf[:11]) != _SIGNATURE:
+        raise ValueError("not a binary COPY stream")
+    start = 19 + int.from_bytes(bytes(buf[15:19]), "big")     # header + extension area
+    count = (len(buf) - start - 2) // _TUPLE.itemsize  # 2: the -1 trailer
+    rows = np.frombuffer(buf, _TUPLE, count, start)
+    t_in, t_out = rows["t_in"], rows["t_out"]
+    return {
+        "emp_id": rows["emp_id"].astype(np.int32),
+        "day": rows["date"].astype(np.int32) - (first - _PG_EPOCH).days,
+        "t_in": np.where(t_in == _NO_TIME, -1, t_in),
+        "t_out": np.where(t_out == _NO_TIME, -1, t_out),
+        "absent": rows["absent"].astype(bool),
+    }
+
+
+def _load(first, last):
+    with db_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT id, name, emp_code, COALESCE(NULLIF(department, ''), 'Unassigned')
+              FROM employee
+             ORDER BY id
+        """)
+        employees = cur.fetchall()
+        cur.execute("""
+            SELECT emp_id, GREATEST(from_date, %(first)s) - %(first)s,
+                           LEAST(to_date, %(last)s) - %(first)s
+              FROM leaves
+             WHERE from_date <= %(last)s AND to_date >= %(first)s
+        """, {"first": first, "last": last})
+        leave_ranges = cur.fetchall()
+        sink = io.BytesIO()       # psycopg2 writes once per row: keep that in C
+        cur.copy_expert(cur.mogrify(_COPY_SQL, {"first": first, "last": last}).decode(), sink)
+        conn.commit()
+    return employees, leave_ranges, _parse_copy(sink.getbuffer(), first)
+
+
+def _micros(hhmm):
+    h, m = hhmm.split(":")[:2]
+    return (int(h) * 3600 + int(m) * 60) * 1_000_000
+
+
+def summary(first, last, today):
+    """Per-employee, per-department and overall metrics for [first, last]."""
+    employees, leave_ranges, cols = _load(first, last)
+    n_days = (last - first).days + 1
+    emp_ids = np.array([e[0] for e in employees], dtype=np.int32)
+    n_emp = len(emp_ids)
+
+    # rows → employee index (rows of deleted employees are dropped)
+    idx = np.searchsorted(emp_ids, cols["emp_id"])
+    known = idx < n_emp
+    known[known] = emp_ids[idx[known]] == cols["emp_id"][known]
+    idx, day = idx[known], cols["day"][known]
+    t_in, t_out, absent = cols["t_in"][known], cols["t_out"][known], cols["absent"][known]
+
+    # leave grid: +1 at each range start, -1 after its end, running sum per row
+    on_leave = np.zeros((n_emp, n_days + 1), dtype=np.int16)
+    if leave_ranges and n_emp:
+        lr = np.array(leave_ranges, dtype=np.int32)
+        li = np.searchsorted(emp_ids, lr[:, 0])
+        ok = li < n_emp
+        ok[ok] = emp_ids[li[ok]] == lr[ok, 0]
+        np.add.at(on_leave, (li[ok], lr[ok, 1]), 1)
+        np.add.at(on_leave, (li[ok], lr[ok, 2] + 1), -1)
+    on_leave = np.cumsum(on_leave, axis=1)[:, :n_days] > 0
+
+    present = ~absent & (t_in >= 0)
+    late = present & (t_in > _micros(SHIFT_START))
+    closed = present & (t_out >= 0)
+    worked = np.where(closed, (t_out - t_in) % _NO_TIME, 0) / 3.6e9
+    overtime = np.maximum(worked - WORKDAY_HOURS, 0.0)
+    leave_row = absent & on_leave[idx, day] if n_emp else absent
+    absent_only = absent & ~leave_row
+
+    def per_emp(values):
+        return np.bincount(idx, weights=values, minlength=n_emp)
+
+    # working days that have already happened, per employee, less leave
+    dates = np.arange(n_days)
+    first_weekday = first.weekday()
+    elapsed = min(n_days, max(0, (today - first).days + 1))
+    workday = ((dates + first_weekday) % 7 < 5) & (dates < elapsed)
+    leave_days = (on_leave & workday).sum(axis=1)
+    expected = workday.sum() - leave_days
+
+    m = {
+        "present_days": per_emp(present),
+        "absent_days": per_emp(absent_only),
+        "leave_days": leave_days.astype(np.float64),
+        "late": per_emp(late),
+        "hours": per_emp(worked),
+        "overtime_hours": per_emp(overtime),
+        "expected_days": expected.astype(np.float64),
+        "closed_days": per_emp(closed),
+    }
+
+    departments, dept_idx = np.unique(np.array([e[3] for e in employees], dtype=object),
+                                      return_inverse=True)
+    dept = {k: np.bincount(dept_idx, weights=v, minlength=len(departments))
+            for k, v in m.items()}
+    dept["employees"] = np.bincount(dept_idx, minlength=len(departments)).astype(np.float64)
+
+    return {
+        "from": first.isoformat(),
+        "to": last.isoformat(),
+        "shift_start": SHIFT_START,
+        "workday_hours": WORKDAY_HOURS,
+        "working_days": int(workday.sum()),
+        "totals": _figures({k: v.sum() for k, v in m.items()}, employees=n_emp),
+        "departments": [
+            _figures({k: v[i] for k, v in dept.items() if k != "employees"},
+                     department=name, employees=int(dept["employees"][i]))
+            for i, name in enumerate(departments.tolist())
+        ],
+        "employees": _employee_rows(employees, m),
+    }
+
+
+def _figures(m, **head):
+    expected = m["expected_days"]
+    closed = m["closed_days"]
+    return {
+        **head,
+        "present_days": int(m["present_days"]),
+        "absent_days": int(m["absent_days"]),
+        "leave_days": int(m["leave_days"]),
+        "late": int(m["late"]),
+        "hours": round(float(m["hours"]), 2),
+        "avg_hours": round(float(m["hours"] / closed), 2) if closed else 0.0,
+        "overtime_hours": round(float(m["overtime_hours"]), 2),
+        "attendance_pct": (round(float(100.0 * m["present_days"] / expected), 1)
+                           if expected > 0 else None),
+    }
+
+
+def _employee_rows(employees, m):
+    # one bulk conversion per column, then plain Python for the dicts
+    present = m["present_days"].astype(np.int64).tolist()
+    absent = m["absent_days"].astype(np.int64).tolist()
+    leave = m["leave_days"].astype(np.int64).tolist()
+    late = m["late"].astype(np.int64).tolist()
+    hours = np.round(m["hours"], 2).tolist()
+    closed = m["closed_days"]
+    avg = np.round(np.divide(m["hours"], closed, out=np.zeros_like(closed),
+                             where=closed > 0), 2).tolist()
+    overtime = np.round(m["overtime_hours"], 2).tolist()
+    expected = m["expected_days"]
+    pct = np.round(np.divide(100.0 * m["present_days"], expected,
+                             out=np.full_like(expected, np.nan), where=expected > 0), 1)
+    pct = [None if p != p else p for p in pct.tolist()]
+    return [{
+        "id": e[0], "name": e[1], "emp_code": e[2], "department": e[3],
+        "present_days": present[i], "absent_days": absent[i], "leave_days": leave[i],
+        "late": late[i], "hours": hours[i], "avg_hours": avg[i],
+        "overtime_hours": overtime[i], "attendance_pct": pct[i],
+    } for i, e in enumerate(employees)]
@@ -1,21 +1,53 @@
 from datetime import datetime, timedelta, time
 from functools import wraps
-import random
-import geocoder
+import json
+import logging
 import pytz
 import os
+from time import perf_counter
 
 from flask import (
-    Flask, flash, jsonify, redirect, render_template,
-    request, session, url_for
+    Flask, Response, flash, g, get_template_attribute, jsonify, make_response,
+    redirect, render_template,
+    request, session, stream_with_context, url_for
 )
+from markupsafe import Markup
 from flask_cors import CORS
-from werkzeug.security import check_password_hash
-from db import connect_db
+from werkzeug.middleware.proxy_fix import ProxyFix
+import analytics
+import credentials
+import applog
+from db import db_conn, db_cursor, pool_stats, reset_query_stats
+from employee_search import employees as employee_index
+from identity_cache import TTLCache, identity
+from location import LocationError, parse_gps, punch_location
+import db
+import exports
+import fragments
+import history
+import leaves
+import metrics
+import migrations
+import onboarding
+import partitions
+import punch_batch
+import ratelimit
+import rollups
+import roster_feed
+import tokens
+from punch_batch import PUNCH_IN_SQL, PUNCH_OUT_SQL
+from punch_queue import PUNCH_QUEUE, queue as punch_queue
+
+migrations.auto_migrate()
 
 app = Flask(__name__)
-app.secret_key = "super-secret-change-me"
+applog.setup()
+log = logging.getLogger("app")
+app.secret_key = tokens.secret_key()
 app.config["SESSION_COOKIE_SAMESITE"] = "Lax"
+if ratelimit.TRUST_PROXY:
+    # request.remote_addr is the client, not the proxy (same rule as ratelimit.client_ip)
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=ratelimit.TRUST_PROXY)
 CORS(app, resources={r"/*": {"origins": "*"}}, supports_credentials=True)
 
 # ============ ADD THIS SECTION ============
@@ -44,11 +76,32 @@ def protect(key):
     return deco
 
 
-def safe_match(stored: str, raw: str) -> bool:
-    """Handle both plain text & werkzeug‑hashed passwords."""
-    if stored and stored.startswith(("pbkdf2:", "sha", "bcrypt")):
-        return check_password_hash(stored, raw)
-    return stored == raw
+def rate_limited(token_exempt=False):
+    """429 before the handler runs (no DB work) when the client is over a limit.
+
+    token_exempt: the route ignores the PIN when a bearer token is sent, so
+    such requests skip the wrong-PIN lockout.
+    """
+    def deco(fn):
+        @wraps(fn)
+        def inner(*a, **kw):
+            if request.method != "OPTIONS":
+                pins = not (token_exempt and request.headers.get("Authorization"))
+                retry = ratelimit.limiter.check(request.remote_addr,
+                                                request.headers.get(ratelimit.DEVICE_HEADER),
+                                                pins=pins)
+                if retry:
+                    return (jsonify(success=False, msg="too many attempts, try later"), 429,
+                            {"Retry-After": str(retry)})
+            return fn(*a, **kw)
+        return inner
+    return deco
+
+
+def pin_failed(n=1):
+    """Count wrong PINs against this client's brute-force limit."""
+    ratelimit.limiter.failed(request.remote_addr,
+                             request.headers.get(ratelimit.DEVICE_HEADER), n)
 
 
 def fmt_time(t):
@@ -74,59 +127,123 @@ def fmt_time(t):
 
 
 def get_emp_by_pin(pin):
-    db = connect_db()
-    cur = db.cursor()
-    cur.execute("SELECT id, name, emp_code FROM employee WHERE pin=%s", (pin,))
-    row = cur.fetchone()
-    cur.close()
-    db.close()
-    return row
+    return identity.employee_by_pin(pin)
+
+
+def bearer_employee():
+    """(id, name, emp_code) from an employee access token, None when the
+    request carries none; tokens.TokenError for a bad or expired one."""
+    return tokens.employee_claims(request.headers.get("Authorization"))
 
 
 # ───────────────────── dashboards (HTML) ───────────────────
 def dashboard_stats(cur):
     # 7‑day graph - ONLY count actual punch-ins (exclude absences)
-    cur.execute("""
-        SELECT date, COUNT(*) FROM attendance
-        WHERE absent = false AND time_in IS NOT NULL
-        GROUP BY date ORDER BY date DESC LIMIT 7
-    """)
-    rows = cur.fetchall()
-    labels = [r[0].strftime("%b %d") for r in rows[::-1]]
-    counts = [r[1] for r in rows[::-1]]
+    rows = rollups.last_days(cur, 7)
+    labels = [r[0].strftime("%b %d") for r in rows]
+    counts = [r[1] for r in rows]
+
+    # today's roster with separate locations; times formatted by Postgres
+    cur.execute(roster_feed.ROSTER_SELECT + " ORDER BY e.name")
+    today_rows = cur.fetchall()
 
-    # today's roster with separate locations
-    cur.execute("""
-        SELECT e.id, e.name, e.emp_code, e.pin,
-               a.time_in, a.time_out,
-               a.location_in, a.location_out,
-               a.absent, a.reason
-          FROM employee e
-     LEFT JOIN attendance a
-            ON a.emp_id = e.id AND a.date = CURRENT_DATE
-      ORDER BY e.name
-    """)
-    rows = cur.fetchall()
-    
-    # Format times for template display
-    today_rows = []
-    for r in rows:
-        today_rows.append((
-            r[0],  # id
-            r[1],  # name
-            r[2],  # emp_code
-            r[3],  # pin
-            fmt_time(r[4]) if r[4] else None,  # time_in formatted
-            fmt_time(r[5]) if r[5] else None,  # time_out formatted
-            r[6],  # location_in
-            r[7],  # location_out
-            r[8],  # absent
-            r[9]   # reason
-        ))
-    
     return labels, counts, today_rows
 
 
+# ─────────────────────── instrumentation ───────────────────────
+# REQUEST_METRICS=1 times every request and keeps per-endpoint totals for
+# /metrics; DB_TRIPS_HEADER=1 reports each response's database round trips
+# in X-DB-Round-Trips (loadtest.py reads it). Both are off by default.
+DB_TRIPS_HEADER = os.getenv("DB_TRIPS_HEADER", "0") == "1"
+
+
+@app.before_request
+def _start_request():
+    partitions.maintainer.start()       # once per worker
+    rollups.refresher.start()
+    applog.start_request()
+    g.qstats = reset_query_stats()
+    g.started = perf_counter()
+    g.profiler = None
+    if metrics.profile_requested(request.headers.get("X-Profile")):
+        g.profiler = metrics.start_profile()
+
+
+@app.after_request
+def _finish_request(resp):
+    elapsed = perf_counter() - g.started
+    endpoint = request.endpoint or "unmatched"
+    qstats = g.qstats
+    if g.profiler is not None:
+        resp.headers["X-Profile-File"] = metrics.dump_profile(g.profiler, endpoint)
+        g.profiler = None
+    applog.log_access(resp.status_code, elapsed, qstats,
+                      slow=elapsed * 1000 >= metrics.SLOW_REQUEST_MS)
+    resp.headers["X-Request-ID"] = g.request_id
+    if metrics.REQUEST_METRICS:
+        metrics.observe_request(endpoint, request.method, resp.status_code, elapsed, qstats)
+        resp.headers["Server-Timing"] = (f"app;dur={elapsed * 1000:.1f}, "
+                                         f"db;dur={qstats.sql_time * 1000:.1f}")
+    if DB_TRIPS_HEADER and not resp.is_streamed:
+        resp.headers["X-DB-Round-Trips"] = str(qstats.trips)
+    return resp
+
+
+@app.teardown_request
+def _stop_profile(exc):
+    profiler = g.pop("profiler", None)
+    if profiler is not None:        # after_request never ran
+        profiler.disable()
+
+
+@app.route("/admin/log_levels", methods=["GET", "POST"])
+@protect("admin")
+def admin_log_levels():
+    """Per-endpoint verbosity without a restart:
+    {"levels": {"apply_leave": "DEBUG"}, "sample": {"punch_mobile": 1.0}};
+    null drops an override. Reaches every worker on this box within a second."""
+    if request.method == "POST":
+        data = request.get_json(force=True, silent=True) or {}
+        levels = data.get("levels") or {}
+        sample = data.get("sample") or {}
+        for name, level in levels.items():
+            if level is not None and not isinstance(
+                    logging.getLevelName(str(level).upper()), int):
+                return jsonify(success=False, message=f"unknown level {level!r}"), 400
+        for name, rate in sample.items():
+            if rate is not None and not (isinstance(rate, (int, float)) and 0 <= rate <= 1):
+                return jsonify(success=False, message="sample rates must be 0..1"), 400
+        applog.overrides.update(levels, sample)
+    return jsonify(success=True, **applog.stats())
+
+
+@app.get("/metrics")
+def prometheus_metrics():
+    if not metrics.REQUEST_METRICS:
+        return "request metrics are disabled (REQUEST_METRICS=1)\n", 404
+    pool = pool_stats()
+    ident = identity.stats()
+    gauges = [
+        ("attendance_db_pool_size", "Open pooled connections.", pool["size"]),
+        ("attendance_db_pool_in_use", "Pooled connections checked out.", pool["in_use"]),
+        ("attendance_db_pool_waits_total", "Checkouts that had to wait.", pool["waits"]),
+        ("attendance_db_pool_timeouts_total", "Checkouts that timed out.", pool["timeouts"]),
+        ("attendance_db_slow_queries_total", "Statements over SLOW_QUERY_MS.", db.slow_queries),
+        ("attendance_identity_cache_hits_total", "PIN cache hits.", ident["pin_hits"]),
+        ("attendance_identity_cache_misses_total", "PIN cache misses.", ident["pin_misses"]),
+        ("attendance_rate_limited_total", "Requests refused with 429.",
+         ratelimit.limiter.rejected),
+    ]
+    if PUNCH_QUEUE:
+        q = punch_queue.stats()
+        gauges += [
+            ("attendance_punch_queue_depth", "Punches waiting to be written.", q["depth"]),
+            ("attendance_punch_queue_lag_seconds", "Age of the oldest queued punch.",
+             q["lag_seconds"]),
+        ]
+    return Response(metrics.render(gauges), mimetype="text/plain; version=0.0.4")
+
+
 # ─────────────────────── health ping ───────────────────────
 @app.get("/ping")
 def ping():
@@ -138,6 +255,19 @@ def ping_json():
     return jsonify(pong=True, time=datetime.utcnow().isoformat())
 
 
+@app.get("/ping_db")
+def ping_db():
+    return jsonify(pool_stats())
+
+
+@app.get("/ping_cache")
+def ping_cache():
+    return jsonify({**identity.stats(), "search": employee_index.stats(),
+                    "fragments": fragments.stats(), "roster_feed": roster_feed.feed.stats(),
+                    "rate_limit": ratelimit.limiter.stats(),
+                    "password_checks": credentials.pool.stats()})
+
+
 # ────────────────────── HTML login form ────────────────────
 @app.route("/")
 @app.route("/login")
@@ -151,26 +281,29 @@ def login_credentials():
     user = request.form.get("username")
     pwd = request.form.get("password")
 
-    db = connect_db()
-    cur = db.cursor()
-    try:
-        if role == "admin":
+    table = "admin" if role == "admin" else "employee"
+    with db_cursor() as cur:
+        if table == "admin":
             cur.execute("SELECT id, password FROM admin WHERE username=%s", (user,))
-            row = cur.fetchone()
-            if row and safe_match(row[1], pwd):
-                session.clear()
-                session["admin"] = row[0]
-                return redirect("/admin")
         else:
             cur.execute("SELECT id, password FROM employee WHERE emp_code=%s", (user,))
-            row = cur.fetchone()
-            if row and safe_match(row[1], pwd):
-                session.clear()
-                session["emp_id"] = row[0]
-                return redirect("/employee")
-    finally:
-        cur.close()
-        db.close()
+        row = cur.fetchone()
+
+    # the connection is back in the pool before the (slow) hash check
+    user_id, stored = row if row else (None, None)
+    try:
+        ok = credentials.verify(table, user_id, stored, pwd)
+    except credentials.CredentialsBusy:
+        flash("Too many sign-ins right now, please try again in a moment", "warning")
+        return redirect("/login")
+
+    if ok:
+        session.clear()
+        if table == "admin":
+            session["admin"] = user_id
+            return redirect("/admin")
+        session["emp_id"] = user_id
+        return redirect("/employee")
 
     flash("Invalid credentials", "danger")
     return redirect("/login")
@@ -178,27 +311,29 @@ def login_credentials():
 
 # ───────── PIN‑based JSON login (mobile & web) ─────────
 @app.route("/login_pin", methods=["POST", "OPTIONS"])
+@rate_limited()
 def login_pin():
     if request.method == "OPTIONS":
         return "", 200, {
             "Access-Control-Allow-Origin": "*",
-            "Access-Control-Allow-Headers": "Content-Type",
+            "Access-Control-Allow-Headers": "Content-Type, Authorization",
             "Access-Control-Allow-Methods": "POST, OPTIONS",
         }
 
     data = request.get_json(force=True, silent=True) or {}
     pin = str(data.get("pin", "")).strip()
 
-    db = connect_db()
-    cur = db.cursor()
+    # employee and admin PINs resolve in one cached lookup
+    hit = identity.lookup_pin(pin)
+    role, row = hit if hit else (None, None)
+    if role:
+        # mobile clients authenticate later calls with these, not the PIN
+        with db_cursor(commit=True) as cur:
+            pair = tokens.issue(cur, role, row)
 
     # ───────── EMPLOYEE LOGIN ─────────
-    cur.execute("SELECT id, name, emp_code FROM employee WHERE pin=%s", (pin,))
-    row = cur.fetchone()
-
-    if row:
-        cur.close()
-        db.close()
+    if role == "employee":
+        g.emp_id = row[0]
         return jsonify(
             success=True,
             role="employee",
@@ -206,110 +341,289 @@ def login_pin():
                 "id": row[0],
                 "name": row[1],
                 "emp_code": row[2]
-            }
+            },
+            **pair
         )
 
     # ───────── ADMIN LOGIN ─────────
-    cur.execute("SELECT id, username FROM admin WHERE pin=%s", (pin,))
-    row = cur.fetchone()
-    cur.close()
-    db.close()
-
-    if row:
+    if role == "admin":
         return jsonify(
             success=True,
             role="admin",
             user={
                 "id": row[0],
                 "name": row[1]
-            }
+            },
+            **pair
         )
 
+    pin_failed()
     return jsonify(success=False), 401
 
 
+@app.post("/auth/refresh")
+def auth_refresh():
+    """{"refresh_token"} → a fresh access token and a rotated refresh token."""
+    data = request.get_json(force=True, silent=True) or {}
+    if not data.get("refresh_token"):
+        return jsonify(success=False, message="refresh_token required"), 400
+    try:
+        with db_cursor(commit=True) as cur:
+            pair = tokens.refresh(cur, data["refresh_token"])
+    except tokens.TokenError as e:
+        return jsonify(success=False, message=str(e)), 401
+    return jsonify(success=True, **pair)
+
+
+@app.post("/auth/logout")
+def auth_logout():
+    """{"refresh_token"} → the session ends; its access token lapses on its own."""
+    data = request.get_json(force=True, silent=True) or {}
+    with db_cursor(commit=True) as cur:
+        revoked = tokens.revoke(cur, data.get("refresh_token") or "")
+    return jsonify(success=revoked)
+
+
 # ───────────────────── Admin dashboard ────────────────────
-@app.route("/admin")
-@protect("admin")
-def admin_dashboard():
-    db = connect_db()
-    cur = db.cursor()
+# ─────────────── dashboard data service ───────────────
+ABSENT_PAGE_SIZE = 25
+LEAVE_PANEL_SIZE = 10
+# live roster: 1 / 0, or auto = only where a held-open request does not pin a
+# whole worker (threaded WSGI, ASGI); pages without it poll every N seconds
+ADMIN_STREAM = os.getenv("ADMIN_STREAM", "auto")
+DASHBOARD_POLL_SECONDS = int(os.getenv("DASHBOARD_POLL_SECONDS", "30"))
+
+SEARCH_PAGE_SIZE = 50
+
+# shared by every admin in this worker, keyed by data version (fragments.py);
+# the TTL only bounds how long superseded versions linger
+_dashboard_cache = TTLCache(maxsize=64, ttl=600)
 
+
+def _absent_cursor(value):
+    """'YYYY-MM-DD:<attendance id>' → (date, id); None/garbage → None."""
     try:
-        labels, counts, today_rows = dashboard_stats(cur)
-        cur.execute("SELECT id, name, emp_code FROM employee ORDER BY name")
-        employees = cur.fetchall()
-    finally:
-        cur.close()
-        db.close()
-
-    # --------- ABSENT HISTORY ---------
-    db1 = connect_db()
-    cur1 = db1.cursor()
-
-    cur1.execute("""
-        SELECT e.name, a.date, a.reason
+        d, i = (value or "").split(":")
+        return datetime.strptime(d, "%Y-%m-%d").date(), int(i)
+    except ValueError:
+        return None
+
+
+def _absent_page(cur, cursor=None, limit=ABSENT_PAGE_SIZE):
+    """One keyset page of absences, newest first: (rows, next_cursor)."""
+    after = _absent_cursor(cursor)
+    cur.execute("""
+        SELECT e.name, a.date, a.reason, a.id
         FROM attendance a
         JOIN employee e ON e.id = a.emp_id
         WHERE a.absent = true
-        ORDER BY a.date DESC
-    """)
-    absent_history = cur1.fetchall()
-    cur1.close()
-    db1.close()
-
-    # --------- LEAVE REQUESTS ---------
-    db2 = connect_db()
-    cur2 = db2.cursor()
-
-    cur2.execute("""
-        SELECT 
-            l.emp_id,
-            e.name,
-            l.from_date,
-            l.to_date,
-            l.reason,
-            l.id
-        FROM leaves l
-        JOIN employee e ON e.id = l.emp_id
-        ORDER BY l.id DESC
-        LIMIT 10
-    """)
-    leave_rows = cur2.fetchall()
-
-    cur2.close()
-    db2.close()
-
-    return render_template(
-        "admin_dashboard.html",
-        labels=labels,
-        counts=counts,
-        attendance=today_rows,
-        employees=employees,
-        absent_history=absent_history,
-        leave_requests=leave_rows
+          AND (%s::date IS NULL OR (a.date, a.id) < (%s::date, %s::int))
+        ORDER BY a.date DESC, a.id DESC
+        LIMIT %s
+    """, (after and after[0], after and after[0], after and after[1], limit + 1))
+    rows = cur.fetchall()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = f"{rows[-1][1]:%Y-%m-%d}:{rows[-1][3]}"
+    return rows, next_cursor
+
+
+def data_version():
+    """The committed data version (fragments.py), read once per request."""
+    if "data_version" not in g:
+        g.data_version = fragments.versions.current()
+    return g.data_version
+
+
+def dashboard_version():
+    """Today's date plus the data version."""
+    return (datetime.today().date(), data_version())
+
+
+def load_dashboard(absent_cursor=None, version=None):
+    """Everything /admin shows, gathered on one pooled connection."""
+    key = (absent_cursor, version or dashboard_version())
+    data = _dashboard_cache.get(key, None)
+    if data is not None:
+        return data
+
+    with db_cursor() as cur:
+        labels, counts, today_rows = dashboard_stats(cur)
+
+        # --------- ABSENT HISTORY (bounded) ---------
+        absent_history, absent_next = _absent_page(cur, absent_cursor)
+
+        # --------- LEAVE REQUESTS ---------
+        cur.execute("""
+            SELECT 
+                l.emp_id,
+                e.name,
+                l.from_date,
+                l.to_date,
+                l.reason,
+                l.id
+            FROM leaves l
+            JOIN employee e ON e.id = l.emp_id
+            ORDER BY l.id DESC
+            LIMIT %s
+        """, (LEAVE_PANEL_SIZE,))
+        leave_rows = cur.fetchall()
+
+    data = {
+        "labels": labels,
+        "counts": counts,
+        "attendance": today_rows,
+        # the roster already lists every employee, ordered by name
+        "employees": [(r[0], r[1], r[2]) for r in today_rows],
+        "absent_history": absent_history,
+        "absent_next": absent_next,
+        "leave_requests": leave_rows,
+    }
+    _dashboard_cache.set(key, data)
+    return data
+
+
+def stream_supported():
+    if ADMIN_STREAM != "auto":
+        return ADMIN_STREAM == "1"
+    return bool(request.environ.get("wsgi.multithread"))
+
+
+def dashboard_page(version):
+    """Template context for /admin and /search with the tables pre-rendered."""
+    live = stream_supported()
+    if live:
+        roster_feed.feed.start()    # be listening before the page opens its stream
+    data = load_dashboard(version=version)
+    return dict(
+        data,
+        live_stream=live,
+        poll_seconds=DASHBOARD_POLL_SECONDS,
+        # what /admin/dashboard.json?panel=chart answers while nothing changed
+        data_tag=fragments.etag("json", version, "chart", None),
+        roster_rows=fragments.cached("roster", version, lambda: render_template(
+            "_roster_rows.html", attendance=data["attendance"])),
+        absent_rows=fragments.cached("absent", version, lambda: render_template(
+            "_absent_rows.html", absent_history=data["absent_history"])),
+        leave_rows=fragments.cached("leaves", version, lambda: render_template(
+            "_leave_rows.html", leave_requests=data["leave_requests"])),
+        employee_rows=fragments.cached("employees", version, lambda: render_template(
+            "_employee_rows.html", employees=data["employees"])),
+        employee_total=len(data["employees"]),
     )
 
 
+def conditional(tag, build):
+    """304 when the client already holds `tag`, before any work; else build()."""
+    if "_flashes" in session:
+        return build()          # one-shot messages: never let this page be reused
+    if request.if_none_match.contains_weak(tag):
+        resp = make_response("", 304)
+    else:
+        resp = make_response(build())
+    resp.set_etag(tag)
+    resp.headers["Cache-Control"] = "private, no-cache"
+    return resp
+
+
+@app.route("/admin")
+@protect("admin")
+def admin_dashboard():
+    version = dashboard_version()
+    return conditional(
+        fragments.etag("admin", version, session.get("admin")),
+        lambda: render_template("admin_dashboard.html", **dashboard_page(version)))
+
+
+@app.get("/admin/dashboard.json")
+@protect("admin")
+def admin_dashboard_json():
+    """Panels for lazy loading: ?panel=chart|roster|absent|leaves (default all),
+    &cursor=<absent_next> pages the absent history."""
+    version = dashboard_version()
+    panel = request.args.get("panel")
+    cursor = request.args.get("cursor") or None
+    return conditional(fragments.etag("json", version, panel, cursor),
+                       lambda: _dashboard_json(panel, cursor, version))
+
+
+def _dashboard_json(panel, cursor, version):
+    data = load_dashboard(cursor, version)
+    out = {}
+    if panel in (None, "chart"):
+        out["chart"] = {"labels": data["labels"], "counts": data["counts"]}
+    if panel in (None, "roster"):
+        out["roster"] = [roster_feed.roster_json(r) for r in data["attendance"]]
+    if panel in (None, "absent"):
+        out["absent"] = {
+            "rows": [{"name": r[0], "date": r[1].isoformat(), "reason": r[2]}
+                     for r in data["absent_history"]],
+            "next_cursor": data["absent_next"],
+        }
+    if panel in (None, "leaves"):
+        out["leaves"] = [{
+            "emp_id": r[0], "name": r[1],
+            "from_date": r[2].isoformat(), "to_date": r[3].isoformat(),
+            "reason": r[4], "id": r[5],
+        } for r in data["leave_requests"]]
+    if not out:
+        return jsonify(success=False, message="unknown panel"), 400
+    return jsonify(out)
+
+
+def _render_roster_rows(rows):
+    # runs on the feed thread: no request, so push an app context
+    with app.app_context():
+        roster_row = get_template_attribute("_roster_row.html", "roster_row")
+        return [str(roster_row(r, "")) for r in rows]
+
+
+roster_feed.feed.render_rows = _render_roster_rows
+
+
+@app.get("/admin/stream")
+@protect("admin")
+def admin_stream():
+    """Server-Sent Events with roster changes as they commit.
+
+    Holds a thread for as long as the page is open: run threaded workers
+    (gunicorn -k gthread) or the ASGI entry point, which serves this route
+    natively on the event loop. Elsewhere it answers 204, which tells an
+    EventSource not to reconnect.
+    """
+    if not stream_supported():
+        return "", 204
+    return Response(roster_feed.feed.stream(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
 @app.get("/search")
 @protect("admin")
 def search_employee():
     q = request.args.get("query", "")
-    like = f"%{q}%"
-    db = connect_db()
-    cur = db.cursor()
+    version = dashboard_version()
+
+    def build():
+        page = dashboard_page(version)
+        page["employees"], page["employee_total"] = employee_index.find(
+            q, limit=SEARCH_PAGE_SIZE)
+        page["employee_rows"] = Markup(render_template(
+            "_employee_rows.html", employees=page["employees"]))
+        return render_template("admin_dashboard.html", query=q, **page)
+    return conditional(fragments.etag("search", version, session.get("admin"), q), build)
+
+
+@app.get("/api/employees/search")
+@protect("admin")
+def api_employee_search():
+    """Typeahead: ?q=<text>&limit=<n>, ranked code → name prefix → substring."""
     try:
-        labels, counts, today_rows = dashboard_stats(cur)
-        cur.execute("SELECT id, name, emp_code FROM employee "
-                    "WHERE name ILIKE %s OR emp_code ILIKE %s", (like, like))
-        employees = cur.fetchall()
-    finally:
-        cur.close()
-        db.close()
-    return render_template("admin_dashboard.html",
-                           labels=labels, counts=counts,
-                           attendance=today_rows, employees=employees,
-                           query=q)
+        limit = int(request.args.get("limit", 10))
+    except ValueError:
+        return jsonify(success=False, message="limit must be an integer"), 400
+    rows = employee_index.search(request.args.get("q", ""), limit=limit)
+    return jsonify(results=[{"id": r[0], "name": r[1], "emp_code": r[2]} for r in rows])
 
 
 # ─────────────── add / delete employee ───────────────
@@ -318,41 +632,31 @@ def search_employee():
 def add_employee():
     name = request.form["name"]
     emp_code = request.form["emp_code"]
-    raw_pass = request.form["password"]
-    pin = f"{random.randint(0, 9999):04}"
+    password = credentials.hash_password(request.form["password"])
 
-    db = connect_db()
-    cur = db.cursor()
     try:
-        cur.execute("""INSERT INTO employee(name, emp_code, password, pin)
-                       VALUES(%s, %s, %s, %s)""",
-                    (name, emp_code, raw_pass, pin))
-        db.commit()
+        with db_cursor(commit=True) as cur:
+            pin, = onboarding.PinPool(cur).draw(1)
+            cur.execute("""INSERT INTO employee(name, emp_code, password, pin)
+                           VALUES(%s, %s, %s, %s)""",
+                        (name, emp_code, password, pin))
+        identity.invalidate()
         flash(f"Employee added! Quick PIN = {pin}", "success")
     except Exception as e:
-        db.rollback()
         flash(str(e), "danger")
-    finally:
-        cur.close()
-        db.close()
     return redirect("/admin")
 
 
 @app.post("/delete_employee/<int:emp_id>")
 @protect("admin")
 def delete_employee(emp_id):
-    db = connect_db()
-    cur = db.cursor()
     try:
-        cur.execute("DELETE FROM employee WHERE id=%s", (emp_id,))
-        db.commit()
+        with db_cursor(commit=True) as cur:
+            cur.execute("DELETE FROM employee WHERE id=%s", (emp_id,))
+        identity.invalidate()
         flash("Employee deleted", "success")
     except Exception as e:
-        db.rollback()
         flash(f"Error: {e}", "danger")
-    finally:
-        cur.close()
-        db.close()
     return redirect("/admin")
 
 
@@ -364,20 +668,17 @@ def mark_absent():
     today = datetime.today().date()
     reason = request.form.get("reason", "").strip() or "No reason given"
 
-    db = connect_db()
-    cur = db.cursor()
-    cur.execute("""
-        INSERT INTO attendance (emp_id, date, absent, reason)
-        VALUES (%s, %s, true, %s)
-        ON CONFLICT (emp_id, date) DO UPDATE SET
-          absent = true,
-          reason = EXCLUDED.reason,
-          time_in = NULL,
-          time_out = NULL
-    """, (emp_id, today, reason))
-    db.commit()
-    cur.close()
-    db.close()
+    with db_cursor(commit=True) as cur:
+        cur.execute("""
+            INSERT INTO attendance (emp_id, date, absent, reason)
+            VALUES (%s, %s, true, %s)
+            ON CONFLICT (emp_id, date) DO UPDATE SET
+              absent = true,
+              reason = EXCLUDED.reason,
+              time_in = NULL,
+              time_out = NULL
+        """, (emp_id, today, reason))
+    roster_feed.feed.touch(emp_id)
     flash("Absent recorded.", "warning")
     return redirect("/employee")
 
@@ -388,20 +689,17 @@ def admin_mark_absent(emp_id):
     today = datetime.today().date()
     reason = request.form.get("reason", "").strip() or "Not specified"
 
-    db = connect_db()
-    cur = db.cursor()
-    cur.execute("""
-        INSERT INTO attendance (emp_id, date, absent, reason)
-        VALUES (%s, %s, true, %s)
-        ON CONFLICT (emp_id, date) DO UPDATE SET
-          absent = true,
-          reason = EXCLUDED.reason,
-          time_in = NULL,
-          time_out = NULL
-    """, (emp_id, today, reason))
-    db.commit()
-    cur.close()
-    db.close()
+    with db_cursor(commit=True) as cur:
+        cur.execute("""
+            INSERT INTO attendance (emp_id, date, absent, reason)
+            VALUES (%s, %s, true, %s)
+            ON CONFLICT (emp_id, date) DO UPDATE SET
+              absent = true,
+              reason = EXCLUDED.reason,
+              time_in = NULL,
+              time_out = NULL
+        """, (emp_id, today, reason))
+    roster_feed.feed.touch(emp_id)
     flash("Employee marked absent.", "info")
     return redirect("/admin")
 
@@ -410,9 +708,9 @@ def admin_mark_absent(emp_id):
 def apply_leave():
     data = request.get_json(force=True, silent=True) or {}
 
-    print("📌 Incoming Leave Request:", data)
-
     emp_id = data.get("emp_id")
+    g.emp_id = emp_id
+    log.debug("leave request", extra={"payload": data})
     leave_type = data.get("type")
     reason = data.get("reason")
 
@@ -425,31 +723,16 @@ def apply_leave():
     if leave_type not in ("quick", "custom"):
         return jsonify({"success": False, "message": "type must be quick or custom"}), 400
 
-    db = connect_db()
-    cur = db.cursor()
-
     # ----- QUICK LEAVE (today only) -----
     if leave_type == "quick":
         today = datetime.today().date()
 
-        cur.execute("""
-            INSERT INTO attendance (emp_id, date, absent, reason)
-            VALUES (%s, %s, true, %s)
-            ON CONFLICT (emp_id, date) DO UPDATE SET
-              absent = true,
-              reason = EXCLUDED.reason,
-              time_in = NULL,
-              time_out = NULL
-        """, (emp_id, today, reason or "No reason"))
+        with db_cursor(commit=True) as cur:
+            _, _, applied = leaves.apply_leaves(cur, [(emp_id, today, today,
+                                                       reason or "No reason")])
+        if not applied[0]:
+            return jsonify({"success": False, "message": "No such employee"}), 404
 
-        cur.execute("""
-            INSERT INTO leaves (emp_id, from_date, to_date, reason)
-            VALUES (%s, %s, %s, %s)
-        """, (emp_id, today, today, reason or "No reason"))
-
-        db.commit()
-        cur.close()
-        db.close()
         return jsonify({"success": True, "message": "Quick leave applied"})
 
     # ----- CUSTOM LEAVE -----
@@ -460,49 +743,125 @@ def apply_leave():
                 "message": "from_date, to_date and reason required"
             }), 400
 
-        cur.execute("""
-            INSERT INTO leaves (emp_id, from_date, to_date, reason)
-            VALUES (%s, %s, %s, %s)
-        """, (emp_id, from_date, to_date, reason))
+        try:
+            from_dt, to_dt = leaves.validate_range(from_date, to_date)
+        except leaves.LeaveError as e:
+            return jsonify({"success": False, "message": str(e)}), 400
 
+        holidays = leaves.configured_holidays() if data.get("skip_holidays") else ()
         try:
-            from_dt = datetime.strptime(from_date, "%Y-%m-%d").date()
-            to_dt = datetime.strptime(to_date, "%Y-%m-%d").date()
-
-            current = from_dt
-            while current <= to_dt:
-                cur.execute("""
-                    INSERT INTO attendance (emp_id, date, absent, reason)
-                    VALUES (%s, %s, true, %s)
-                    ON CONFLICT (emp_id, date) DO UPDATE SET
-                      absent = true,
-                      reason = EXCLUDED.reason,
-                      time_in = NULL,
-                      time_out = NULL
-                """, (emp_id, current, reason))
-                current += timedelta(days=1)
+            with db_cursor(commit=True) as cur:
+                _, _, applied = leaves.apply_leaves(
+                    cur, [(emp_id, from_dt, to_dt, reason)],
+                    skip_weekends=bool(data.get("skip_weekends")),
+                    holidays=holidays)
 
         except Exception as e:
-            db.rollback()
-            cur.close()
-            db.close()
             return jsonify({"success": False, "message": f"Error: {str(e)}"}), 500
+        if not applied[0]:
+            return jsonify({"success": False, "message": "No such employee"}), 404
 
-        db.commit()
-        cur.close()
-        db.close()
         return jsonify({"success": True, "message": "Custom leave applied"})
 
 
+@app.post("/api/leave/bulk")
+@protect("admin")
+def apply_leave_bulk():
+    """HR import: {"entries": [{emp_id | "all", from_date, to_date, reason}],
+    "skip_weekends": bool, "skip_holidays": bool, "holidays": [dates]}."""
+    data = request.get_json(force=True, silent=True) or {}
+    raw_entries = data.get("entries")
+    if not isinstance(raw_entries, list) or not raw_entries:
+        return jsonify({"success": False, "message": "entries required"}), 400
+
+    entries, results, pending = [], [], []
+    for idx, e in enumerate(raw_entries):
+        e = e if isinstance(e, dict) else {}
+        emp_id = e.get("emp_id")
+        try:
+            if emp_id != "all" and not isinstance(emp_id, int):
+                raise leaves.LeaveError("emp_id must be an integer or \"all\"")
+            if not e.get("reason"):
+                raise leaves.LeaveError("reason required")
+            from_dt, to_dt = leaves.validate_range(e.get("from_date"), e.get("to_date"))
+        except leaves.LeaveError as err:
+            results.append({"index": idx, "success": False, "message": str(err)})
+            continue
+        entries.append((None if emp_id == "all" else emp_id, from_dt, to_dt, e["reason"]))
+        results.append(None)
+        pending.append(idx)
+
+    try:
+        holidays = {leaves.parse_date(d) for d in data.get("holidays") or ()}
+    except leaves.LeaveError as err:
+        return jsonify({"success": False, "message": str(err)}), 400
+    if data.get("skip_holidays"):
+        holidays |= leaves.configured_holidays()
+
+    with db_cursor(commit=True) as cur:
+        leave_rows, absent_days, applied = leaves.apply_leaves(
+            cur, entries,
+            skip_weekends=bool(data.get("skip_weekends")),
+            holidays=holidays,
+        )
+    # what each entry actually wrote, not what it asked for
+    for idx, emp_ids in zip(pending, applied):
+        results[idx] = ({"index": idx, "success": True, "message": "Applied",
+                         "emp_ids": emp_ids} if emp_ids else
+                        {"index": idx, "success": False, "message": "No such employee"})
+
+    return jsonify({
+        "success": all(r["success"] for r in results),
+        "leave_rows": leave_rows,
+        "absent_days": absent_days,
+        "results": results,
+    })
+
+
+@app.post("/api/employees/import")
+@protect("admin")
+def import_employees():
+    """Bulk onboarding: {"employees": [{name, emp_code, password?, pin?, email?,
+    phone?, department?, designation?}]} or a CSV upload (`file`) with those
+    columns. ?format=csv answers with the per-row results as CSV."""
+    upload = request.files.get("file")
+    try:
+        if upload:
+            rows = onboarding.parse_csv(upload.read().decode("utf-8", "replace"))
+        elif request.mimetype == "text/csv":
+            rows = onboarding.parse_csv(request.get_data(as_text=True))
+        else:
+            rows = onboarding.parse_json(request.get_json(force=True, silent=True))
+        if not rows:
+            raise onboarding.OnboardingError("no employees to import")
+        checked = onboarding.check_rows(rows)
+        onboarding.hash_passwords(checked)  # before the transaction: hashing is slow
+        with db_cursor(commit=True) as cur:
+            results = onboarding.import_employees(cur, checked)
+    except onboarding.OnboardingError as err:
+        return jsonify({"success": False, "message": str(err)}), 400
+
+    created = sum(r["success"] for r in results)
+    if created:
+        identity.invalidate()
+    if (request.args.get("format") or request.form.get("format")) == "csv":
+        return Response(onboarding.results_csv(results), mimetype="text/csv", headers={
+            "Content-Disposition": "attachment; filename=import_results.csv"})
+    return jsonify({
+        "success": created == len(results),
+        "created": created,
+        "failed": len(results) - created,
+        "results": results,
+    })
+
+
 # ─────────────── employee dashboard (HTML) ───────────────
 @app.route("/employee")
 @protect("emp_id")
 def employee_dashboard():
     emp_id = session["emp_id"]
     today = datetime.today().date()
-    db = connect_db()
-    cur = db.cursor()
-    try:
+    with db_cursor() as cur:
         cur.execute("SELECT time_in, time_out FROM attendance "
                     "WHERE emp_id=%s AND date=%s", (emp_id, today))
         result = cur.fetchone()
@@ -519,72 +878,49 @@ def employee_dashboard():
 
         cur.execute("SELECT name FROM employee WHERE id=%s", (emp_id,))
         emp_name = cur.fetchone()[0]
-    finally:
-        cur.close()
-        db.close()
+
+        month_present, month_absent, month_late, month_leave = \
+            rollups.employee_month(cur, emp_id, today)
 
     return render_template("employee_dashboard.html",
                            name=emp_name,
                            time_in=time_in, time_out=time_out,
-                           p_labels=p_labels, p_counts=p_counts)
+                           p_labels=p_labels, p_counts=p_counts,
+                           month_present=month_present, month_absent=month_absent,
+                           month_late=month_late, month_leave=month_leave)
 
 
 # ───────────────────── punch helper ─────────────────────
-def _record_punch(emp_id: int, punch_type: str, gps_location: dict = None):
+# PUNCH_IN_SQL / PUNCH_OUT_SQL (punch_batch.py) are shared with the async
+# mobile routes (mobile_asgi.py) and EXPLAINed by `migrations.py check`.
+PUNCH_FAILURE = {
+    "in": "Already punched in",
+    "out": "Not punched in yet / already out",
+}
+
+
+def punch_params(emp_id, punch_type, now, location, auth_method=None):
+    if punch_type == "in":
+        return PUNCH_IN_SQL, (emp_id, now.date(), now.time(), location, auth_method)
+    return PUNCH_OUT_SQL, (now.time(), location, auth_method, emp_id, now.date())
+
+
+def _record_punch(emp_id: int, punch_type: str, gps_location: dict = None,
+                  client_ip: str = None, auth_method: str = None):
     now = get_ist_now()  # NEW - IST timezone
-    date = now.date()
-    t = now.time()
-
-    if gps_location:
-        city = gps_location.get('city', 'Unknown')
-        lat = gps_location.get('latitude', 0.0)
-        lng = gps_location.get('longitude', 0.0)
-        address = gps_location.get('address', 'Unknown')
-        location = f"{address}|{lat:.6f}|{lng:.6f}"
-    else:
-        geo = geocoder.ip("me")
-        city = geo.city or "Unknown"
-        lat, lng = (geo.latlng or [0.0, 0.0])
-        location = f"{city}|{lat:.4f}|{lng:.4f}"
+
+    location = punch_location(gps_location, client_ip)
 
     nice_time = now.strftime("%I:%M %p")
 
-    db = connect_db()
-    cur = db.cursor()
-    ok, message = False, ""
-    try:
-        cur.execute("""
-            SELECT id, time_in, time_out
-              FROM attendance
-             WHERE emp_id=%s AND date=%s
-        """, (emp_id, date))
+    with db_cursor(commit=True) as cur:
+        cur.execute(*punch_params(emp_id, punch_type, now, location, auth_method))
         row = cur.fetchone()
 
-        if punch_type == "in":
-            if row:
-                raise ValueError("Already punched in")
-            cur.execute("""
-                INSERT INTO attendance (emp_id, date, time_in, location_in)
-                VALUES (%s, %s, %s, %s)
-            """, (emp_id, date, t, location))
-        else:
-            if not row or row[2]:
-                raise ValueError("Not punched in yet / already out")
-            cur.execute("""
-                UPDATE attendance 
-                SET time_out=%s, location_out=%s 
-                WHERE id=%s
-            """, (t, location, row[0]))
-        db.commit()
-        ok, message = True, "Saved"
-    except ValueError as e:
-        db.rollback()
-        message = str(e)
-    finally:
-        cur.close()
-        db.close()
-
-    return ok, message, nice_time, location
+    if not row:
+        return False, PUNCH_FAILURE["in" if punch_type == "in" else "out"], nice_time, location
+    roster_feed.feed.touch(emp_id)
+    return True, "Saved", nice_time, location
 
 
 def get_today_leave(cur, emp_id):
@@ -603,81 +939,201 @@ def get_today_leave(cur, emp_id):
 @app.post("/punch")
 @protect("emp_id")
 def punch_web():
-    ok, msg, _, _ = _record_punch(session["emp_id"], request.form.get("type"))
+    ok, msg, _, _ = _record_punch(session["emp_id"], request.form.get("type"),
+                                  client_ip=request.remote_addr)
     flash(msg, "success" if ok else "danger")
     return redirect("/employee")
 
 
 # ─────────────── mobile punch (JSON) ───────────────
 @app.post("/mobile/punch")
+@rate_limited(token_exempt=True)
 def punch_mobile():
     data = request.get_json(force=True) or {}
     pin = str(data.get("pin", "")).strip()
     ptype = data.get("type", "").lower()
 
-    gps_location = data.get("location")
-
     if ptype not in ("in", "out"):
         return jsonify(success=False, msg="type?"), 400
+    try:
+        gps_location = parse_gps(data.get("location"))
+    except LocationError as e:
+        return jsonify(success=False, msg=str(e)), 400
 
-    emp = get_emp_by_pin(pin)
+    try:
+        emp = bearer_employee() or get_emp_by_pin(pin)
+    except tokens.TokenError as e:
+        return jsonify(success=False, msg=str(e)), 401
     if not emp:
+        pin_failed()
         return jsonify(success=False, msg="bad pin"), 400
+    g.emp_id = emp[0]
+
+    if PUNCH_QUEUE:
+        # write-behind: acknowledge now, result lands in the ticket's receipt
+        now = get_ist_now()
+        ticket = punch_queue.enqueue(emp[0], ptype, now, gps_location,
+                                     request.remote_addr)
+        return jsonify(success=True, msg="Queued", queued=True, ticket=ticket,
+                       time=now.strftime("%I:%M %p")), 202
 
     ok, msg, nice_time, loc = _record_punch(
         emp_id=emp[0],
         punch_type=ptype,
-        gps_location=gps_location
+        gps_location=gps_location,
+        client_ip=request.remote_addr
     )
     return jsonify(success=ok, msg=msg, time=nice_time, location=loc), (200 if ok else 400)
 
 
+@app.get("/mobile/punch/status/<ticket>")
+def punch_mobile_status(ticket):
+    """Outcome of a queued punch: pending until the writer has applied it."""
+    state, receipt = punch_queue.status(ticket)
+    if state is None:
+        return jsonify(success=False, msg="unknown ticket"), 404
+    if state == "pending":
+        return jsonify(success=True, pending=True)
+    ok, msg, punched_at = receipt
+    return jsonify(success=ok, pending=False, msg=msg,
+                   time=punched_at.astimezone(IST).strftime("%I:%M %p"))
+
+
+@app.get("/mobile/punch/queue")
+def punch_queue_stats():
+    """Write-behind queue depth and lag (seconds since the oldest queued punch)."""
+    if not PUNCH_QUEUE:
+        return jsonify(enabled=False)
+    punch_queue.start()     # resume draining after a restart with a backlog
+    return jsonify(punch_queue.stats())
+
+
+@app.post("/mobile/punch/batch")
+@rate_limited()
+def punch_mobile_batch():
+    """Sync punches queued offline: {"punches": [{pin, type, timestamp,
+    idempotency_key, location?}, ...]} → one result per item, in order."""
+    data = request.get_json(force=True, silent=True)
+    try:
+        emp = bearer_employee()
+        items = punch_batch.parse_items(data or {}, get_ist_now())
+    except tokens.TokenError as e:
+        return jsonify(success=False, msg=str(e)), 401
+    except punch_batch.BatchError as e:
+        return jsonify(success=False, msg=str(e)), 400
+    if emp:
+        for item in items:
+            if not item["pin"]:
+                item["emp_id"] = emp[0]     # the token stands in for the PIN
+
+    budget = ratelimit.limiter.failure_budget(request.remote_addr,
+                                              request.headers.get(ratelimit.DEVICE_HEADER))
+    with db_cursor(commit=True) as cur:
+        results = punch_batch.sync_punches(cur, items, client_ip=request.remote_addr,
+                                           max_bad_pins=budget)
+    bad = {i["pin"] for i, r in zip(items, results) if r["msg"] == "bad pin"}
+    if bad:
+        pin_failed(len(bad))
+
+    return jsonify(success=all(r["success"] for r in results), results=results)
+
+
 # ─────────────── mobile helpers (history, whoami) ───────────────
+def _history_attendance(r):
+    return {
+        "date": r[0].strftime("%Y-%m-%d"),
+        "time_in": fmt_time(r[1]),
+        "time_out": fmt_time(r[2]),
+        "absent": bool(r[3]),
+        "reason": r[4]
+    }
+
+
+def _history_leave(r):
+    return {
+        "from_date": str(r[0]),
+        "to_date": str(r[1]),
+        "reason": r[2]
+    }
+
+
 @app.get("/mobile/history/<int:emp_id>")
 def mobile_history(emp_id):
-    db = connect_db()
-    cur = db.cursor()
+    """?limit=&before=YYYY-MM-DD (keyset cursor) &since=&until=
+    &changed_since=<watermark> (incremental sync) &stream=1 (NDJSON export).
 
-    cur.execute("""
-        SELECT date, time_in, time_out, absent, reason
-        FROM attendance
-        WHERE emp_id=%s
-        ORDER BY date DESC
-    """, (emp_id,))
-    attendance = cur.fetchall()
+    A page holds `limit` days (HISTORY_DEFAULT_LIMIT without one): has_more
+    / next_cursor lead to the rest; stream=1 returns everything at once."""
+    g.emp_id = emp_id
+    try:
+        emp = bearer_employee()
+    except tokens.TokenError as e:
+        return jsonify(success=False, message=str(e)), 401
+    if emp and emp[0] != emp_id:
+        return jsonify(success=False, message="not your history"), 403
+    try:
+        opts = history.parse_args(request.args)
+    except history.HistoryError as e:
+        return jsonify(success=False, message=str(e)), 400
 
-    cur.execute("""
-        SELECT from_date, to_date, reason
-        FROM leaves
-        WHERE emp_id=%s
-        ORDER BY id DESC
-    """, (emp_id,))
-    leave = cur.fetchall()
+    if request.args.get("stream") == "1":
+        return Response(stream_with_context(_stream_history(emp_id, opts)),
+                        mimetype="application/x-ndjson")
 
-    cur.close()
-    db.close()
+    with db_cursor() as cur:
+        attendance, leave, next_cursor, leave_more, watermark = \
+            history.fetch_page(cur, emp_id, opts)
 
     return jsonify({
-        "attendance": [{
-            "date": r[0].strftime("%Y-%m-%d"),
-            "time_in": fmt_time(r[1]),
-            "time_out": fmt_time(r[2]),
-            "absent": bool(r[3]),
-            "reason": r[4]
-        } for r in attendance],
-
-        "leave": [{
-            "from_date": str(r[0]),
-            "to_date": str(r[1]),
-            "reason": r[2]
-        } for r in leave]
+        "attendance": [_history_attendance(r) for r in attendance],
+        "leave": [_history_leave(r) for r in leave],
+        "has_more": next_cursor is not None,
+        "next_cursor": history.cursor_str(next_cursor),
+        "leave_has_more": leave_more,
+        "watermark": history.cursor_str(watermark),
     })
 
 
+def _stream_history(emp_id, opts):
+    """One JSON object per line, pulled through a server-side cursor."""
+    with db_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT now()")
+            watermark = cur.fetchone()[0]
+
+        cur = conn.cursor(name=f"history_{emp_id}")
+        try:
+            cur.execute(*history.attendance_query(emp_id, opts, paginate=False))
+            while True:
+                rows = cur.fetchmany(history.STREAM_CHUNK)
+                if not rows:
+                    break
+                yield "".join(
+                    json.dumps({"type": "attendance", **_history_attendance(r)}) + "\n"
+                    for r in rows
+                )
+        finally:
+            cur.close()
+
+        with conn.cursor() as cur:
+            cur.execute(*history.leave_query(emp_id, opts, limit=None))
+            for r in cur:
+                yield json.dumps({"type": "leave", **_history_leave(r)}) + "\n"
+
+    yield json.dumps({"type": "end", "watermark": history.cursor_str(watermark)}) + "\n"
+
+
+@app.get("/mobile/whoami")
 @app.get("/mobile/whoami/<pin>")
-def mobile_whoami(pin):
-    emp = get_emp_by_pin(pin)
+@rate_limited(token_exempt=True)
+def mobile_whoami(pin=None):
+    try:
+        emp = bearer_employee() or (get_emp_by_pin(pin) if pin else None)
+    except tokens.TokenError:
+        return jsonify(success=False), 401
     if not emp:
+        if pin:
+            pin_failed()
         return jsonify(success=False), 404
 
     return jsonify(
@@ -690,6 +1146,7 @@ def mobile_whoami(pin):
 
 # ─────────────── Profile endpoint for mobile ───────────────
 @app.route("/profile", methods=["POST", "OPTIONS"])
+@rate_limited()
 def get_profile():
     if request.method == "OPTIONS":
         return "", 200, {
@@ -704,17 +1161,8 @@ def get_profile():
     if not emp_code:
         return jsonify({"success": False, "message": "emp_code required"}), 400
 
-    db = connect_db()
-    cur = db.cursor()
-
     try:
-        cur.execute("""
-            SELECT id, name, emp_code, email, phone, department, designation
-            FROM employee
-            WHERE emp_code = %s
-        """, (emp_code,))
-
-        row = cur.fetchone()
+        row = identity.profile_by_code(emp_code)
 
         if not row:
             return jsonify({"success": False, "message": "Employee not found"}), 404
@@ -733,71 +1181,48 @@ def get_profile():
         })
 
     except Exception as e:
-        print(f"🔥 Profile error: {e}")
+        log.exception("profile lookup failed", extra={"emp_code": emp_code})
         return jsonify({"success": False, "message": str(e)}), 500
 
-    finally:
-        cur.close()
-        db.close()
-
 
 # ───────────────────── reports & monthly report (HTML) ─────────────────────
 @app.route("/reports")
 @protect("admin")
 def reports():
-    db = connect_db()
-    cur = db.cursor()
-    try:
-        cur.execute("SELECT date, COUNT(*) FROM attendance "
-                    "GROUP BY date ORDER BY date DESC LIMIT 7")
-        rows = cur.fetchall()
-        labels = [r[0].strftime("%b %d") for r in rows[::-1]]
-        counts = [r[1] for r in rows[::-1]]
+    with db_cursor() as cur:
+        rows = rollups.last_days(cur, 7)
+        labels = [r[0].strftime("%b %d") for r in rows]
+        counts = [r[1] for r in rows]
 
         cur.execute("SELECT COUNT(*) FROM employee")
         total = cur.fetchone()[0]
-        cur.execute("SELECT COUNT(DISTINCT emp_id) FROM attendance "
-                    "WHERE date = CURRENT_DATE AND absent = false")
-        present = cur.fetchone()[0]
+        present = rollups.day(cur, get_ist_today())[0]
         absent = total - present
 
-        return render_template("reports.html",
-                               labels=labels, counts=counts,
-                               present=present, absent=absent)
-    finally:
-        cur.close()
-        db.close()
+    return render_template("reports.html",
+                           labels=labels, counts=counts,
+                           present=present, absent=absent)
 
 
 # ───────────────────── monthly report ─────────────────────
 @app.route("/monthly_report")
 @protect("admin")
 def monthly_report():
-    today = datetime.today()
-    first_day = today.replace(day=1).date()
-    
-    # PostgreSQL way to get last day of month
-    db = connect_db()
-    cur = db.cursor()
-    cur.execute("""
-        SELECT (DATE_TRUNC('month', %s::date) + INTERVAL '1 month - 1 day')::date
-    """, (today,))
-    last_day = cur.fetchone()[0]
-
-    cur.execute("""
-        SELECT e.id, e.name,
-               a.date, a.time_in, a.time_out,
-               a.location_in, a.location_out,
-               a.absent, a.reason
-          FROM employee e
-     LEFT JOIN attendance a
-            ON e.id = a.emp_id
-           AND a.date BETWEEN %s AND %s
-      ORDER BY e.id, a.date
-    """, (first_day, last_day))
-    rows = cur.fetchall()
-    cur.close()
-    db.close()
+    """?month=YYYY-MM or ?from=&to= up to REPORT_PAGE_DAYS; longer ranges go
+    to the CSV export."""
+    try:
+        first_day, last_day = exports.parse_range(request.args, get_ist_today())
+    except exports.ExportError as e:
+        flash(str(e), "danger")
+        return redirect("/monthly_report")
+    if (last_day - first_day).days >= exports.REPORT_PAGE_DAYS:
+        # a page holds one month; anything longer streams as a download
+        query = request.query_string.decode()
+        return redirect("/monthly_report/export?format=csv" + (f"&{query}" if query else ""))
+
+    with db_cursor() as cur:
+        cur.execute(exports.REPORT_SQL, (first_day, last_day))
+        rows = cur.fetchall()
 
     records = [{
         "emp_id": r[0],
@@ -811,9 +1236,62 @@ def monthly_report():
         "reason": r[8] or "—",
     } for r in rows]
 
+    if first_day.day == 1 and last_day.month == first_day.month:
+        month = first_day.strftime("%B %Y")
+    else:
+        month = f"{first_day:%d %b %Y} – {last_day:%d %b %Y}"
+
     return render_template("monthly_report.html",
                            records=records,
-                           month=first_day.strftime("%B %Y"))
+                           month=month,
+                           query=request.query_string.decode())
+
+
+# ─────────────── analytics summary (JSON) ───────────────
+_summary_cache = TTLCache(maxsize=32, ttl=600)
+
+
+@app.get("/api/reports/summary")
+@protect("admin")
+def report_summary():
+    """Worked hours, lateness, overtime and attendance % per employee and
+    department; ?month=YYYY-MM or ?from=&to= like the exports."""
+    today = get_ist_today()
+    try:
+        first_day, last_day = exports.parse_range(request.args, today)
+    except exports.ExportError as e:
+        return jsonify(success=False, message=str(e)), 400
+    key = (first_day, last_day, today, data_version())
+
+    def build():
+        data = _summary_cache.get(key, None)
+        if data is None:
+            data = analytics.summary(first_day, last_day, today)
+            _summary_cache.set(key, data)
+        return jsonify(data)
+    return conditional(fragments.etag("summary", key), build)
+
+
+@app.get("/monthly_report/export")
+@protect("admin")
+def monthly_report_export():
+    """?format=csv|xlsx with ?month=YYYY-MM or ?from=&to= – streamed."""
+    fmt = request.args.get("format", "csv")
+    if fmt not in exports.FORMATS:
+        return jsonify(success=False, message="format must be csv or xlsx"), 400
+    try:
+        first_day, last_day = exports.parse_range(request.args, get_ist_today())
+    except exports.ExportError as e:
+        return jsonify(success=False, message=str(e)), 400
+
+    encode, mimetype = exports.FORMATS[fmt]
+    body = encode(exports.report_chunks(first_day, last_day))
+    return Response(
+        stream_with_context(body),
+        mimetype=mimetype,
+        headers={"Content-Disposition":
+                 f'attachment; filename="{exports.filename(first_day, last_day, fmt)}"'},
+    )
 
 
 # ───────────────────── BIOMETRIC ─────────────────────
@@ -822,20 +1300,12 @@ def punch_biometric():
     data = request.get_json(force=True, silent=True) or {}
     emp_id = data.get("emp_id")
     punch_type = data.get("type")
+    g.emp_id = emp_id
 
-    ok, msg, nice_time, loc = _record_punch(emp_id=emp_id, punch_type=punch_type)
-
-    # Log biometric usage
-    db = connect_db()
-    cur = db.cursor()
-    cur.execute("""
-        UPDATE attendance 
-        SET auth_method = 'biometric'
-        WHERE emp_id = %s AND date = CURRENT_DATE
-    """, (emp_id,))
-    db.commit()
-    cur.close()
-    db.close()
+    # biometric usage is tagged by the punch statement itself
+    ok, msg, nice_time, loc = _record_punch(emp_id=emp_id, punch_type=punch_type,
+                                            client_ip=request.remote_addr,
+                                            auth_method="biometric")
 
     return jsonify(success=ok, msg=msg, time=nice_time, location=loc)
 
@@ -0,0 +1,278 @@
+"""Structured, non-blocking logging.
+
+Records are formatted as one JSON object per line and carry the request ID,
+endpoint and emp_id of the request that produced them. Handlers only put
+records on a bounded in-memory queue; a listener thread per process does
+the actual write, so a slow stdout never stalls a request. When the queue
+is full records are dropped and counted rather than blocking.
+
+Each request gets one access record (method, path, status, latency, DB
+numbers). High-volume endpoints are sampled (LOG_SAMPLE, e.g.
+"punch_mobile=0.05,login_pin=0.1"); errors and slow requests are always
+kept. Levels and sample rates can be changed per endpoint at runtime through
+/admin/log_levels, which applies them locally and writes LOG_LEVELS_FILE so
+the other workers on the box pick them up within a second. The file lives in
+the app's instance/ directory (created 0700) unless LOG_LEVELS_FILE says
+otherwise – keep it somewhere only the app's user can write. Entries in it
+that are not a known level or a rate in 0..1 are logged and skipped.
+"""
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+from flask import g, has_request_context, request, session
+
+LOG_LEVEL = logging.getLevelName(os.getenv("LOG_LEVEL", "INFO").upper())
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_LEVELS_FILE = os.getenv("LOG_LEVELS_FILE", os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "instance", "log-levels.json"))
+DEFAULT_SAMPLE = {"punch_mobile": 0.1, "login_pin": 0.1, "mobile_whoami": 0.1}
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+access_log = logging.getLogger("access")
+log = logging.getLogger("applog")
+
+
+def _parse_sample(raw):
+    out = {}
+    for part in filter(None, (p.strip() for p in (raw or "").split(","))):
+        name, _, rate = part.partition("=")
+        out[name.strip()] = float(rate)
+    return out
+
+
+# ─────────────── runtime overrides ───────────────
+class Overrides:
+    """Per-endpoint levels and sample rates, shared through LOG_LEVELS_FILE."""
+
+    def __init__(self):
+        self.levels = {}
+        self.sample = dict(DEFAULT_SAMPLE, **_parse_sample(os.getenv("LOG_SAMPLE")))
+        self._base_sample = dict(self.sample)
+        self._mtime = None
+        self._checked = 0.0
+
+    def refresh(self):
+        now = time.monotonic()
+        if now - self._checked < 1.0:
+            return
+        self._checked = now
+        try:
+            mtime = os.stat(LOG_LEVELS_FILE).st_mtime
+        except OSError:
+            return
+        if mtime == self._mtime:
+            return
+        try:
+            with open(LOG_LEVELS_FILE) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        self._mtime = mtime
+        self._apply(data)
+
+    @staticmethod
+    def _entries(data, key):
+        entries = data.get(key) or {}
+        if not isinstance(entries, dict):
+            log.warning("%s: %s must be an object, ignored", LOG_LEVELS_FILE, key)
+            return {}
+        return entries
+
+    def _apply(self, data):
+        if not isinstance(data, dict):
+            log.warning("%s is not a JSON object, ignored", LOG_LEVELS_FILE)
+            data = {}
+        levels, sample = {}, {}
+        for name, value in self._entries(data, "levels").items():
+            level = logging.getLevelName(str(value).upper())
+            if isinstance(level, int):
+                levels[name] = level
+            else:
+                log.warning("%s: unknown level %r for %s, ignored", LOG_LEVELS_FILE, value, name)
+        for name, rate in self._entries(data, "sample").items():
+            if isinstance(rate, (int, float)) and not isinstance(rate, bool) and 0 <= rate <= 1:
+                sample[name] = rate
+            else:
+                log.warning("%s: sample rate %r for %s is not 0..1, ignored",
+                            LOG_LEVELS_FILE, rate, name)
+        self.levels = levels
+        self.sample = dict(self._base_sample, **sample)
+        # loggers must let the most verbose override through to the filter
+        floor = min([LOG_LEVEL, *self.levels.values()])
+        logging.getLogger().setLevel(floor)
+
+    def update(self, levels=None, sample=None):
+        """Merge new overrides, apply them here and publish them to the file."""
+        data = {
+            "levels": {k: logging.getLevelName(v) for k, v in self.levels.items()},
+            "sample": {k: v for k, v in self.sample.items()
+                       if self._base_sample.get(k) != v},
+        }
+        for name, level in (levels or {}).items():
+            if level is None:
+                data["levels"].pop(name, None)
+            else:
+                data["levels"][name] = str(level).upper()
+        for name, rate in (sample or {}).items():
+            if rate is None:
+                data["sample"].pop(name, None)
+            else:
+                data["sample"][name] = float(rate)
+        self._apply(data)
+        os.makedirs(os.path.dirname(LOG_LEVELS_FILE), mode=0o700, exist_ok=True)
+        tmp = f"{LOG_LEVELS_FILE}.{os.getpid()}"
+        with open(tmp, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp, LOG_LEVELS_FILE)
+        self._mtime = os.stat(LOG_LEVELS_FILE).st_mtime
+        return self.snapshot()
+
+    def level_for(self, endpoint):
+        return self.levels.get(endpoint, LOG_LEVEL)
+
+    def sample_for(self, endpoint):
+        if self.levels.get(endpoint, LOG_LEVEL) <= logging.DEBUG:
+            return 1.0          # turned up for debugging: keep everything
+        return self.sample.get(endpoint, 1.0)
+
+    def snapshot(self):
+        return {
+            "default": logging.getLevelName(LOG_LEVEL),
+            "levels": {k: logging.getLevelName(v) for k, v in self.levels.items()},
+            "sample": self.sample,
+        }
+
+
+overrides = Overrides()
+
+
+# ─────────────── record context & format ───────────────
+class RequestContextFilter(logging.Filter):
+    """Stamp request fields on the record and apply the endpoint's level."""
+
+    def filter(self, record):
+        endpoint = None
+        if has_request_context():
+            endpoint = request.endpoint
+            record.request_id = g.get("request_id")
+            record.endpoint = endpoint
+            emp_id = g.get("emp_id")
+            if emp_id is None and "emp_id" in session:
+                emp_id = session.get("emp_id")
+            record.emp_id = emp_id
+        if record.name == "access":
+            return True             # sampled at the source
+        return record.levelno >= overrides.level_for(endpoint)
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        out = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RESERVED and value is not None and not key.startswith("_"):
+                out[key] = value
+        if record.exc_text:
+            out["exc"] = record.exc_text
+        return json.dumps(out, default=str)
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops instead of blocking, with a per-pid listener."""
+
+    def __init__(self, target):
+        super().__init__(queue.Queue(LOG_QUEUE_SIZE))
+        self.target = target
+        self.dropped = 0
+        self._listener_pid = None
+        self._lock = threading.Lock()
+
+    def prepare(self, record):
+        # resolve args and tracebacks here; the listener only serialises
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        self._ensure_listener()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _ensure_listener(self):
+        if self._listener_pid == os.getpid():
+            return
+        with self._lock:
+            if self._listener_pid != os.getpid():
+                # a forked worker inherits the queue object but not the thread
+                self.queue = queue.Queue(LOG_QUEUE_SIZE)
+                listener = logging.handlers.QueueListener(self.queue, self.target)
+                listener.start()
+                self._listener_pid = os.getpid()
+
+
+handler = None
+
+
+def setup():
+    """Route every logger through the JSON queue handler (idempotent)."""
+    global handler
+    if handler is not None:
+        return handler
+    target = logging.StreamHandler(sys.stderr)
+    target.setFormatter(JSONFormatter())
+    handler = NonBlockingQueueHandler(target)
+    handler.addFilter(RequestContextFilter())
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(LOG_LEVEL)
+    return handler
+
+
+# ─────────────── per-request helpers ───────────────
+def start_request():
+    g.request_id = (request.headers.get("X-Request-ID") or uuid.uuid4().hex)[:64]
+    overrides.refresh()
+
+
+def log_access(status, latency, qstats, slow=False):
+    endpoint = request.endpoint or "unmatched"
+    rate = overrides.sample_for(endpoint)
+    if status < 500 and not slow and rate < 1.0 and random.random() >= rate:
+        return
+    access_log.info("%s %s %s", request.method, request.path, status, extra={
+        "method": request.method,
+        "path": request.path,
+        "status": status,
+        "latency_ms": round(latency * 1000, 2),
+        "db_queries": qstats.queries,
+        "db_ms": round(qstats.sql_time * 1000, 2),
+        "sample_rate": rate,
+    })
+
+
+def stats():
+    return {
+        "queued": handler.queue.qsize() if handler else 0,
+        "dropped": handler.dropped if handler else 0,
+        **overrides.snapshot(),
+    }
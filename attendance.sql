@@ -0,0 +1,474 @@
+-- Generated by `python migrations.py sql`; edit migrations.py instead.
+
+-- 001 base tables
+CREATE TABLE IF NOT EXISTS employee (
+    id          SERIAL PRIMARY KEY,
+    name        TEXT NOT NULL,
+    emp_code    TEXT NOT NULL,
+    password    TEXT,
+    pin         TEXT,
+    email       TEXT,
+    phone       TEXT,
+    department  TEXT,
+    designation TEXT
+);
+CREATE TABLE IF NOT EXISTS admin (
+    id          SERIAL PRIMARY KEY,
+    username    TEXT NOT NULL UNIQUE,
+    password    TEXT,
+    pin         TEXT
+);
+CREATE TABLE IF NOT EXISTS attendance (
+    id           SERIAL PRIMARY KEY,
+    emp_id       INTEGER NOT NULL REFERENCES employee(id) ON DELETE CASCADE,
+    date         DATE NOT NULL,
+    time_in      TIME,
+    time_out     TIME,
+    location_in  TEXT,
+    location_out TEXT,
+    absent       BOOLEAN NOT NULL DEFAULT false,
+    reason       TEXT,
+    auth_method  TEXT
+);
+CREATE TABLE IF NOT EXISTS leaves (
+    id          SERIAL PRIMARY KEY,
+    emp_id      INTEGER NOT NULL REFERENCES employee(id) ON DELETE CASCADE,
+    from_date   DATE NOT NULL,
+    to_date     DATE NOT NULL,
+    reason      TEXT
+);
+
+-- 002 hot-path indexes
+-- ON CONFLICT (emp_id, date) in every attendance writer; per-employee history
+CREATE UNIQUE INDEX IF NOT EXISTS attendance_emp_date_key
+    ON attendance (emp_id, date);
+-- today's roster / rollup refresh: attendance for one date across employees
+CREATE INDEX IF NOT EXISTS attendance_date_idx
+    ON attendance (date);
+-- absent history panel: WHERE absent ORDER BY date DESC, id DESC
+CREATE INDEX IF NOT EXISTS attendance_absent_idx
+    ON attendance (date DESC, id DESC) WHERE absent;
+
+-- get_today_leave / rollup leave classification / history leave panel
+CREATE INDEX IF NOT EXISTS leaves_emp_range_idx
+    ON leaves (emp_id, from_date, to_date);
+
+-- PIN login, /mobile/punch, /profile, password login. emp_code was never
+-- checked for repeats, and it is the employees' login name, so repeats
+-- are listed for an admin to resolve rather than renamed here
+CREATE INDEX IF NOT EXISTS employee_pin_idx ON employee (pin);
+DO $$
+DECLARE
+    repeats TEXT;
+BEGIN
+    SELECT string_agg(format('%s (ids %s)', emp_code, ids), '; ' ORDER BY emp_code)
+      INTO repeats
+      FROM (SELECT emp_code, string_agg(id::text, ', ' ORDER BY id) AS ids
+              FROM employee GROUP BY emp_code HAVING count(*) > 1) d;
+    IF repeats IS NOT NULL THEN
+        RAISE EXCEPTION 'employee.emp_code repeats: %', repeats
+            USING HINT = 'emp_code is the login name: give each of these '
+                         'employees a distinct code, then run the upgrade again';
+    END IF;
+END $$;
+CREATE UNIQUE INDEX IF NOT EXISTS employee_emp_code_key ON employee (emp_code);
+CREATE INDEX IF NOT EXISTS admin_pin_idx ON admin (pin);
+
+-- /search: name ILIKE '%q%' OR emp_code ILIKE '%q%' (needs pg_trgm; `check`
+-- reports the search query if the server doesn't ship the extension)
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm') THEN
+        CREATE EXTENSION IF NOT EXISTS pg_trgm;
+        CREATE INDEX IF NOT EXISTS employee_name_trgm
+            ON employee USING gin (name gin_trgm_ops);
+        CREATE INDEX IF NOT EXISTS employee_emp_code_trgm
+            ON employee USING gin (emp_code gin_trgm_ops);
+    END IF;
+END $$;
+
+-- 003 punch receipts
+CREATE TABLE IF NOT EXISTS punch_receipts (
+    idempotency_key TEXT PRIMARY KEY,
+    emp_id          INTEGER NOT NULL,
+    punch_type      TEXT NOT NULL,
+    ok              BOOLEAN NOT NULL,
+    message         TEXT,
+    punched_at      TIMESTAMPTZ,
+    received_at     TIMESTAMPTZ NOT NULL DEFAULT now()
+)
+
+-- 004 history updated_at
+ALTER TABLE attendance ADD COLUMN IF NOT EXISTS
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now();
+ALTER TABLE leaves ADD COLUMN IF NOT EXISTS
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now();
+CREATE INDEX IF NOT EXISTS attendance_emp_updated_idx
+    ON attendance (emp_id, updated_at);
+CREATE OR REPLACE FUNCTION touch_updated_at() RETURNS trigger AS $$
+BEGIN
+    NEW.updated_at := now();
+    RETURN NEW;
+END $$ LANGUAGE plpgsql;
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'attendance_touch') THEN
+        CREATE TRIGGER attendance_touch BEFORE UPDATE ON attendance
+            FOR EACH ROW EXECUTE FUNCTION touch_updated_at();
+    END IF;
+    IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'leaves_touch') THEN
+        CREATE TRIGGER leaves_touch BEFORE UPDATE ON leaves
+            FOR EACH ROW EXECUTE FUNCTION touch_updated_at();
+    END IF;
+END $$;
+
+-- 005 daily rollups
+CREATE TABLE IF NOT EXISTS attendance_daily (
+    date      DATE PRIMARY KEY,
+    present   INTEGER NOT NULL DEFAULT 0,
+    absent    INTEGER NOT NULL DEFAULT 0,
+    late      INTEGER NOT NULL DEFAULT 0,
+    on_leave  INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS attendance_emp_monthly (
+    emp_id    INTEGER NOT NULL,
+    month     DATE NOT NULL,
+    present   INTEGER NOT NULL DEFAULT 0,
+    absent    INTEGER NOT NULL DEFAULT 0,
+    late      INTEGER NOT NULL DEFAULT 0,
+    on_leave  INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (emp_id, month)
+);
+CREATE TABLE IF NOT EXISTS attendance_rollup_dirty (
+    date      DATE NOT NULL,
+    emp_id    INTEGER NOT NULL,
+    version   BIGINT NOT NULL DEFAULT 1,
+    PRIMARY KEY (date, emp_id)
+);
+CREATE OR REPLACE FUNCTION attendance_mark_dirty() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        INSERT INTO attendance_rollup_dirty (date, emp_id) VALUES (OLD.date, OLD.emp_id)
+        ON CONFLICT (date, emp_id) DO UPDATE
+            SET version = attendance_rollup_dirty.version + 1;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO attendance_rollup_dirty (date, emp_id) VALUES (NEW.date, NEW.emp_id)
+        ON CONFLICT (date, emp_id) DO UPDATE
+            SET version = attendance_rollup_dirty.version + 1;
+    END IF;
+    RETURN NULL;
+END $$ LANGUAGE plpgsql;
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'attendance_rollup') THEN
+        CREATE TRIGGER attendance_rollup
+            AFTER INSERT OR UPDATE OR DELETE ON attendance
+            FOR EACH ROW EXECUTE FUNCTION attendance_mark_dirty();
+        -- first install: backfill everything that already exists
+        INSERT INTO attendance_rollup_dirty (date, emp_id)
+        SELECT date, emp_id FROM attendance
+        ON CONFLICT DO NOTHING;
+    END IF;
+END $$;
+
+-- 006 data_changed notify
+CREATE OR REPLACE FUNCTION notify_data_changed() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('data_changed', TG_TABLE_NAME);
+    RETURN NULL;
+END $$ LANGUAGE plpgsql;
+DO $$
+DECLARE t TEXT;
+BEGIN
+    FOREACH t IN ARRAY ARRAY['attendance', 'leaves', 'employee'] LOOP
+        IF NOT EXISTS (SELECT 1 FROM pg_trigger
+                        WHERE tgname = t || '_data_changed') THEN
+            EXECUTE format('CREATE TRIGGER %I AFTER INSERT OR UPDATE OR DELETE
+                            ON %I FOR EACH STATEMENT
+                            EXECUTE FUNCTION notify_data_changed()',
+                           t || '_data_changed', t);
+        END IF;
+    END LOOP;
+END $$;
+
+-- 007 roster_changed notify
+CREATE OR REPLACE FUNCTION notify_roster_changed() RETURNS trigger AS $$
+DECLARE ids TEXT;
+BEGIN
+    IF TG_TABLE_NAME = 'attendance' AND TG_OP = 'DELETE' THEN
+        SELECT string_agg(DISTINCT emp_id::text, ',') INTO ids
+          FROM old_rows WHERE date = CURRENT_DATE;
+    ELSIF TG_TABLE_NAME = 'attendance' THEN
+        SELECT string_agg(DISTINCT emp_id::text, ',') INTO ids
+          FROM new_rows WHERE date = CURRENT_DATE;
+    ELSIF TG_OP = 'DELETE' THEN
+        SELECT string_agg(id::text, ',') INTO ids FROM old_rows;
+    ELSE
+        SELECT string_agg(id::text, ',') INTO ids FROM new_rows;
+    END IF;
+    IF ids IS NOT NULL THEN
+        PERFORM pg_notify('roster_changed',
+                          CASE WHEN length(ids) > 7000 THEN '*' ELSE ids END);
+    END IF;
+    RETURN NULL;
+END $$ LANGUAGE plpgsql;
+DO $$
+DECLARE t TEXT; op TEXT;
+BEGIN
+    FOREACH t IN ARRAY ARRAY['attendance', 'employee'] LOOP
+        FOREACH op IN ARRAY ARRAY['INSERT', 'UPDATE', 'DELETE'] LOOP
+            IF NOT EXISTS (SELECT 1 FROM pg_trigger
+                            WHERE tgname = t || '_roster_' || lower(op)) THEN
+                EXECUTE format('CREATE TRIGGER %I AFTER %s ON %I
+                                REFERENCING %s TABLE AS %I
+                                FOR EACH STATEMENT
+                                EXECUTE FUNCTION notify_roster_changed()',
+                               t || '_roster_' || lower(op), op, t,
+                               CASE op WHEN 'DELETE' THEN 'OLD' ELSE 'NEW' END,
+                               CASE op WHEN 'DELETE' THEN 'old_rows' ELSE 'new_rows' END);
+            END IF;
+        END LOOP;
+    END LOOP;
+END $$;
+
+-- 008 monthly attendance partitions
+CREATE TABLE IF NOT EXISTS attendance_archive (
+    emp_block     INTEGER NOT NULL,     -- emp_id / 32
+    month         DATE NOT NULL,
+    last_updated  TIMESTAMPTZ NOT NULL,
+    archived_at   TIMESTAMPTZ NOT NULL DEFAULT now(),
+    id            INTEGER[] NOT NULL,
+    emp_id        INTEGER[] NOT NULL,
+    date          DATE[] NOT NULL,
+    time_in       TIME[] NOT NULL,
+    time_out      TIME[] NOT NULL,
+    location_in   TEXT[] NOT NULL,
+    location_out  TEXT[] NOT NULL,
+    absent        BOOLEAN[] NOT NULL,
+    reason        TEXT[] NOT NULL,
+    auth_method   TEXT[] NOT NULL,
+    updated_at    TIMESTAMPTZ[] NOT NULL,
+    PRIMARY KEY (emp_block, month)
+);
+CREATE INDEX IF NOT EXISTS attendance_archive_month_idx ON attendance_archive (month);
+
+CREATE OR REPLACE FUNCTION attendance_add_partition(for_month DATE) RETURNS boolean AS $$
+DECLARE
+    lo   DATE := date_trunc('month', for_month)::date;
+    hi   DATE := (date_trunc('month', for_month) + INTERVAL '1 month')::date;
+    part TEXT := 'attendance_p' || to_char(for_month, 'YYYYMM');
+BEGIN
+    IF to_regclass(part) IS NOT NULL THEN
+        RETURN false;
+    END IF;
+    -- build it detached: ATTACH only needs SHARE UPDATE EXCLUSIVE on
+    -- attendance, and the CHECK spares it a validation scan
+    EXECUTE format('CREATE TABLE %I (LIKE attendance INCLUDING DEFAULTS)', part);
+    EXECUTE format('ALTER TABLE %I ADD CONSTRAINT %I CHECK (date >= %L AND date < %L)',
+                   part, part || '_bound', lo, hi);
+    IF to_regclass('attendance_pdefault') IS NOT NULL THEN
+        EXECUTE format('WITH moved AS (DELETE FROM attendance_pdefault
+                                        WHERE date >= %L AND date < %L
+                                    RETURNING id, emp_id, date, time_in, time_out, location_in, location_out, absent, reason, auth_method, updated_at)
+                        INSERT INTO %I (id, emp_id, date, time_in, time_out, location_in, location_out, absent, reason, auth_method, updated_at) SELECT * FROM moved', lo, hi, part);
+    END IF;
+    EXECUTE format('ALTER TABLE attendance ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                   part, lo, hi);
+    EXECUTE format('ALTER TABLE %I DROP CONSTRAINT %I', part, part || '_bound');
+    RETURN true;
+END $$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION attendance_archive_month(for_month DATE) RETURNS integer AS $$
+DECLARE
+    lo   DATE := date_trunc('month', for_month)::date;
+    hi   DATE := (date_trunc('month', for_month) + INTERVAL '1 month')::date;
+    part TEXT := 'attendance_p' || to_char(for_month, 'YYYYMM');
+    n    INTEGER;
+BEGIN
+    SELECT count(*) INTO n FROM attendance WHERE date >= lo AND date < hi;
+    IF n > 0 THEN
+        WITH live AS (
+            SELECT id, emp_id, date, time_in, time_out, location_in, location_out, absent, reason, auth_method, updated_at FROM attendance WHERE date >= lo AND date < hi
+        ), merged AS (
+            SELECT * FROM live
+            UNION ALL
+            SELECT u.* FROM attendance_archive ar, unnest(ar.id, ar.emp_id, ar.date, ar.time_in, ar.time_out, ar.location_in, ar.location_out, ar.absent, ar.reason, ar.auth_method, ar.updated_at) AS u(id, emp_id, date, time_in, time_out, location_in, location_out, absent, reason, auth_method, updated_at)
+             WHERE ar.month = lo
+               AND ar.emp_block IN (SELECT emp_id / 32 FROM live)
+               AND NOT EXISTS (SELECT 1 FROM live l
+                                WHERE l.emp_id = u.emp_id AND l.date = u.date)
+        )
+        INSERT INTO attendance_archive (emp_block, month, last_updated, id, emp_id, date, time_in, time_out, location_in, location_out, absent, reason, auth_method, updated_at)
+        SELECT emp_id / 32, lo, max(updated_at),
+               array_agg(id ORDER BY emp_id, date), array_agg(emp_id ORDER BY emp_id, date), array_agg(date ORDER BY emp_id, date), array_agg(time_in ORDER BY emp_id, date), array_agg(time_out ORDER BY emp_id, date), array_agg(location_in ORDER BY emp_id, date), array_agg(location_out ORDER BY emp_id, date), array_agg(absent ORDER BY emp_id, date), array_agg(reason ORDER BY emp_id, date), array_agg(auth_method ORDER BY emp_id, date), array_agg(updated_at ORDER BY emp_id, date)
+          FROM merged
+         GROUP BY emp_id / 32
+        ON CONFLICT (emp_block, month) DO UPDATE SET
+            last_updated = EXCLUDED.last_updated, archived_at = now(),
+            id = EXCLUDED.id, emp_id = EXCLUDED.emp_id, date = EXCLUDED.date, time_in = EXCLUDED.time_in, time_out = EXCLUDED.time_out, location_in = EXCLUDED.location_in, location_out = EXCLUDED.location_out, absent = EXCLUDED.absent, reason = EXCLUDED.reason, auth_method = EXCLUDED.auth_method, updated_at = EXCLUDED.updated_at;
+    END IF;
+    IF to_regclass(part) IS NOT NULL THEN
+        EXECUTE format('ALTER TABLE attendance DETACH PARTITION %I', part);
+        EXECUTE format('DROP TABLE %I', part);
+    END IF;
+    DELETE FROM attendance_pdefault WHERE date >= lo AND date < hi;
+    RETURN n;
+END $$ LANGUAGE plpgsql;
+
+DO $$
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = 'attendance'::regclass) = 'r' THEN
+        ALTER TABLE attendance RENAME TO attendance_unpartitioned;
+        ALTER SEQUENCE attendance_id_seq OWNED BY NONE;
+        ALTER TABLE attendance_unpartitioned DROP CONSTRAINT IF EXISTS attendance_pkey;
+        DROP INDEX IF EXISTS attendance_emp_date_key, attendance_date_idx,
+                             attendance_absent_idx, attendance_emp_updated_idx;
+
+        -- the primary key has to include the partition key
+        CREATE TABLE attendance (
+            id           INTEGER NOT NULL DEFAULT nextval('attendance_id_seq'),
+            emp_id       INTEGER NOT NULL REFERENCES employee(id) ON DELETE CASCADE,
+            date         DATE NOT NULL,
+            time_in      TIME,
+            time_out     TIME,
+            location_in  TEXT,
+            location_out TEXT,
+            absent       BOOLEAN NOT NULL DEFAULT false,
+            reason       TEXT,
+            auth_method  TEXT,
+            updated_at   TIMESTAMPTZ NOT NULL DEFAULT now(),
+            PRIMARY KEY (id, date)
+        ) PARTITION BY RANGE (date);
+        ALTER SEQUENCE attendance_id_seq OWNED BY attendance.id;
+        CREATE TABLE attendance_pdefault PARTITION OF attendance DEFAULT;
+        PERFORM attendance_add_partition(m)
+           FROM (SELECT DISTINCT date_trunc('month', date)::date AS m
+                   FROM attendance_unpartitioned
+                 UNION
+                 SELECT generate_series(date_trunc('month', CURRENT_DATE),
+                                        date_trunc('month', CURRENT_DATE) + INTERVAL '3 months',
+                                        INTERVAL '1 month')::date) months;
+        INSERT INTO attendance (id, emp_id, date, time_in, time_out, location_in, location_out, absent, reason, auth_method, updated_at)
+        SELECT id, emp_id, date, time_in, time_out, location_in, location_out, absent, reason, auth_method, updated_at FROM attendance_unpartitioned;
+        DROP TABLE attendance_unpartitioned;
+
+        CREATE UNIQUE INDEX attendance_emp_date_key ON attendance (emp_id, date);
+        CREATE INDEX attendance_date_idx ON attendance (date);
+        CREATE INDEX attendance_absent_idx ON attendance (date DESC, id DESC) WHERE absent;
+        CREATE INDEX attendance_emp_updated_idx ON attendance (emp_id, updated_at);
+
+        -- the triggers went with the old table; the rollups are current
+        CREATE TRIGGER attendance_touch BEFORE UPDATE ON attendance
+            FOR EACH ROW EXECUTE FUNCTION touch_updated_at();
+        CREATE TRIGGER attendance_rollup
+            AFTER INSERT OR UPDATE OR DELETE ON attendance
+            FOR EACH ROW EXECUTE FUNCTION attendance_mark_dirty();
+        CREATE TRIGGER attendance_data_changed
+            AFTER INSERT OR UPDATE OR DELETE ON attendance
+            FOR EACH STATEMENT EXECUTE FUNCTION notify_data_changed();
+        CREATE TRIGGER attendance_roster_insert AFTER INSERT ON attendance
+            REFERENCING NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION notify_roster_changed();
+        CREATE TRIGGER attendance_roster_update AFTER UPDATE ON attendance
+            REFERENCING NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION notify_roster_changed();
+        CREATE TRIGGER attendance_roster_delete AFTER DELETE ON attendance
+            REFERENCING OLD TABLE AS old_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION notify_roster_changed();
+    END IF;
+END $$;
+
+-- both tiers for [first_day, last_day]; inlined into the caller's query,
+-- so its filters reach the partition indexes and archive months outside
+-- the range are never read. Archived rows of deleted employees are
+-- skipped, as ON DELETE CASCADE would have removed them.
+CREATE OR REPLACE FUNCTION attendance_range(first_day DATE, last_day DATE)
+RETURNS TABLE (id INTEGER, emp_id INTEGER, date DATE, time_in TIME, time_out TIME, location_in TEXT, location_out TEXT, absent BOOLEAN, reason TEXT, auth_method TEXT, updated_at TIMESTAMPTZ)
+LANGUAGE sql STABLE AS $$
+    SELECT id, emp_id, date, time_in, time_out, location_in, location_out, absent, reason, auth_method, updated_at FROM attendance
+     WHERE date BETWEEN first_day AND last_day
+    UNION ALL
+    SELECT u.* FROM attendance_archive ar, unnest(ar.id, ar.emp_id, ar.date, ar.time_in, ar.time_out, ar.location_in, ar.location_out, ar.absent, ar.reason, ar.auth_method, ar.updated_at) AS u(id, emp_id, date, time_in, time_out, location_in, location_out, absent, reason, auth_method, updated_at)
+     WHERE ar.month BETWEEN date_trunc('month', first_day)::date AND last_day
+       AND u.date BETWEEN first_day AND last_day
+       AND EXISTS (SELECT 1 FROM employee e WHERE e.id = u.emp_id)
+$$;
+
+-- 009 unique employee pins
+-- '' is no PIN at all (an empty /login_pin would match it)
+UPDATE employee SET pin = NULL WHERE pin = '';
+-- a PIN is a credential: employees sharing one are listed (ids only, the
+-- PINs stay out of logs) for an admin to re-issue, not reassigned here
+DO $$
+DECLARE
+    repeats TEXT;
+BEGIN
+    SELECT string_agg(ids, '; ' ORDER BY ids) INTO repeats
+      FROM (SELECT string_agg(id::text, ', ' ORDER BY id) AS ids
+              FROM employee WHERE pin IS NOT NULL
+             GROUP BY pin HAVING count(*) > 1) d;
+    IF repeats IS NOT NULL THEN
+        RAISE EXCEPTION 'employees sharing a PIN (ids): %', repeats
+            USING HINT = 'give all but one employee of each group a new PIN '
+                         'and tell them, then run the upgrade again';
+    END IF;
+END $$;
+CREATE UNIQUE INDEX IF NOT EXISTS employee_pin_key ON employee (pin);
+DROP INDEX IF EXISTS employee_pin_idx;      -- the unique index serves PIN login
+
+-- 010 auth sessions
+CREATE TABLE IF NOT EXISTS auth_secret (
+    id     SMALLINT PRIMARY KEY CHECK (id = 1),
+    secret BYTEA NOT NULL
+);
+CREATE TABLE IF NOT EXISTS auth_session (
+    token_hash BYTEA PRIMARY KEY,          -- sha256 of the refresh token
+    role       TEXT NOT NULL,
+    user_id    INTEGER NOT NULL,
+    expires_at TIMESTAMPTZ NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+CREATE INDEX IF NOT EXISTS auth_session_expires_idx ON auth_session (expires_at);
+
+-- 011 data version
+CREATE TABLE IF NOT EXISTS data_version (
+    id      SMALLINT PRIMARY KEY CHECK (id = 1),
+    version BIGINT NOT NULL
+);
+INSERT INTO data_version (id, version) VALUES (1, 0) ON CONFLICT (id) DO NOTHING;
+CREATE OR REPLACE FUNCTION notify_data_changed() RETURNS trigger AS $$
+BEGIN
+    UPDATE data_version SET version = version + 1 WHERE id = 1;
+    PERFORM pg_notify('data_changed', TG_TABLE_NAME);
+    RETURN NULL;
+END $$ LANGUAGE plpgsql;
+
+-- 012 data version stripes
+ALTER TABLE data_version DROP CONSTRAINT IF EXISTS data_version_id_check;
+INSERT INTO data_version (id, version)
+SELECT s, 0 FROM generate_series(1, 64) s
+ON CONFLICT (id) DO NOTHING;
+CREATE OR REPLACE FUNCTION bump_data_version() RETURNS void AS $$
+DECLARE
+    own INTEGER := 1 + pg_backend_pid() % 64;
+BEGIN
+    -- this backend's row, else any row no open transaction holds
+    UPDATE data_version SET version = version + 1
+     WHERE id = (SELECT id FROM data_version WHERE id = own
+                   FOR UPDATE SKIP LOCKED);
+    IF NOT FOUND THEN
+        UPDATE data_version SET version = version + 1
+         WHERE id = (SELECT id FROM data_version
+                      LIMIT 1 FOR UPDATE SKIP LOCKED);
+    END IF;
+    IF NOT FOUND THEN      -- more open writers than rows: wait for ours
+        UPDATE data_version SET version = version + 1 WHERE id = own;
+    END IF;
+END $$ LANGUAGE plpgsql;
+CREATE OR REPLACE FUNCTION notify_data_changed() RETURNS trigger AS $$
+BEGIN
+    PERFORM bump_data_version();
+    PERFORM pg_notify('data_changed', TG_TABLE_NAME);
+    RETURN NULL;
+END $$ LANGUAGE plpgsql;
@@ -0,0 +1,159 @@
+"""Closed-loop HTTP benchmark for the mobile JSON routes.
+
+    python bench_mobile.py --url http://127.0.0.1:8000 --concurrency 500 --duration 20
+
+Each of --concurrency clients sends the next request from the route mix as
+soon as the previous answer arrives (keep-alive when the server allows it),
+then prints requests/second and latency percentiles. Stdlib only, so it runs
+against sync gunicorn and the ASGI app alike:
+
+    RATE_LIMIT_BACKEND=off gunicorn -w 8 -b :8000 app:app
+    RATE_LIMIT_BACKEND=off uvicorn mobile_asgi:asgi --workers 2 --port 8000 --no-access-log
+
+These are the PIN routes and every client shares one address, so without
+RATE_LIMIT_BACKEND=off (or RATE_REQUESTS_IP / RATE_REQUESTS_DEVICE far above
+the offered load) most answers are 429s. 4xx answers are counted under
+errors ("4xx", of which "429") rather than as requests, and the run exits 1
+when they are more than --max-rejected of the answers.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import sys
+import time
+from urllib.parse import urlsplit
+
+
+def default_mix(pin, emp_code, emp_id):
+    return [
+        ("GET", f"/mobile/whoami/{pin}", None),
+        ("POST", "/login_pin", {"pin": pin}),
+        ("GET", f"/mobile/history/{emp_id}?limit=30", None),
+        ("POST", "/profile", {"emp_code": emp_code}),
+    ]
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    k = min(len(sorted_values) - 1, max(0, round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[k]
+
+
+async def _read_response(reader):
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("server closed the connection")
+    status = int(status_line.split()[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length", 0))
+    close = headers.get("connection", "").lower() == "close"
+    if "chunked" in headers.get("transfer-encoding", "").lower():
+        while True:
+            size = int((await reader.readline()).split(b";")[0], 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    elif length:
+        await reader.readexactly(length)
+    return status, headers, close
+
+
+async def client(host, port, mix, measure_from, deadline, latencies, errors):
+    reader = writer = None
+    for method, path, body in mix:
+        if time.monotonic() >= deadline:
+            break
+        payload = json.dumps(body).encode() if body is not None else b""
+        request = (f"{method} {path} HTTP/1.1\r\nHost: {host}\r\n"
+                   f"Content-Type: application/json\r\n"
+                   f"Content-Length: {len(payload)}\r\n\r\n").encode() + payload
+        started = time.perf_counter()
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection(host, port)
+            writer.write(request)
+            await writer.drain()
+            status, _, close = await _read_response(reader)
+        except (OSError, ConnectionError, asyncio.IncompleteReadError, ValueError):
+            errors["io"] += 1
+            if writer is not None:
+                writer.close()
+            reader = writer = None
+            continue
+        if time.monotonic() >= measure_from:
+            if 400 <= status < 500:
+                # answered without doing the work: not a fast success
+                errors["4xx"] += 1
+                if status == 429:
+                    errors["429"] += 1
+            else:
+                latencies.append(time.perf_counter() - started)
+        if status >= 500:
+            errors["5xx"] += 1
+        if close:
+            writer.close()
+            reader = writer = None
+    if writer is not None:
+        writer.close()
+
+
+async def run(url, concurrency, duration, mix, warmup=0.0):
+    parts = urlsplit(url)
+    host, port = parts.hostname, parts.port or 80
+    latencies, errors = [], {"io": 0, "4xx": 0, "429": 0, "5xx": 0}
+    measure_from = time.monotonic() + warmup      # connect storm, cold caches
+    deadline = measure_from + duration
+    clients = []
+    for n in range(concurrency):
+        # stagger each client's position in the mix
+        shifted = mix[n % len(mix):] + mix[:n % len(mix)]
+        clients.append(client(host, port, itertools.cycle(shifted), measure_from,
+                              deadline, latencies, errors))
+    await asyncio.gather(*clients)
+    elapsed = time.monotonic() - measure_from
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "max_ms": round((latencies[-1] if latencies else 0) * 1000, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--duration", type=float, default=15)
+    parser.add_argument("--warmup", type=float, default=3)
+    parser.add_argument("--pin", default="1111")
+    parser.add_argument("--emp-code", default="E001")
+    parser.add_argument("--emp-id", type=int, default=1)
+    parser.add_argument("--max-rejected", type=float, default=0.5,
+                        help="exit 1 when more than this share of answers are 4xx")
+    args = parser.parse_args()
+    mix = default_mix(args.pin, args.emp_code, args.emp_id)
+    result = asyncio.run(run(args.url, args.concurrency, args.duration, mix, args.warmup))
+    print(json.dumps(result))
+    answered = result["requests"] + result["errors"]["4xx"]
+    if answered and result["errors"]["4xx"] > answered * args.max_rejected:
+        print(f"{result['errors']['4xx']} of {answered} answers were 4xx "
+              f"({result['errors']['429']} rate limited); is the server rate limiting "
+              f"(RATE_LIMIT_BACKEND=off)?", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
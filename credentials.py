@@ -0,0 +1,152 @@
+"""Password hashing and verification, kept off the DB connection.
+
+    PASSWORD_HASH   werkzeug method and cost for new hashes
+                    (default scrypt:32768:8:1, ~130 ms; pbkdf2:sha256:<n> works too)
+    HASH_WORKERS    threads that run hash checks (default: CPU count)
+    HASH_QUEUE      checks allowed to wait for a thread; past that, verify()
+                    raises CredentialsBusy straight away
+
+Callers fetch the stored hash, give the connection back, then call verify().
+The check runs in the bounded pool – hashlib releases the GIL, so they use
+every core – and a login storm queues there instead of holding pool
+connections. Past HASH_QUEUE the login is refused fast rather than left to
+wait, which keeps the p99 of the logins that are admitted flat. An unknown
+user, or one whose row still holds a plain-text password, is checked against
+a dummy hash as well, so every login takes as long as a real check.
+
+A successful login with a plain-text password (rows from before hashing)
+or a hash made with an older PASSWORD_HASH is rehashed in the background.
+The UPDATE only applies if the stored value is unchanged, so it never
+overwrites a password that was changed in the meantime.
+"""
+import hmac
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from db import db_cursor
+
+PASSWORD_HASH = os.getenv("PASSWORD_HASH", "scrypt:32768:8:1")
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", str(os.cpu_count() or 2)))
+HASH_QUEUE = int(os.getenv("HASH_QUEUE", str(HASH_WORKERS * 8)))
+
+_HASHED = ("pbkdf2:", "scrypt:", "sha", "bcrypt")
+_TABLES = {"employee", "admin"}
+
+log = logging.getLogger("credentials")
+
+
+class CredentialsBusy(RuntimeError):
+    """More password checks are waiting than HASH_QUEUE allows."""
+
+
+def hash_password(raw):
+    return generate_password_hash(raw, method=PASSWORD_HASH)
+
+
+def is_hashed(stored):
+    return bool(stored) and stored.startswith(_HASHED) and "$" in stored
+
+
+@lru_cache(maxsize=None)
+def _dummy():
+    return hash_password("not-a-password")
+
+
+def _current_method():
+    return _dummy().split("$", 1)[0]     # PASSWORD_HASH as werkzeug spells it
+
+
+def _check(stored, raw):
+    if not is_hashed(stored):
+        return stored is not None and hmac.compare_digest(stored.encode(), raw.encode())
+    try:
+        return check_password_hash(stored, raw)
+    except ValueError:                  # a method this werkzeug no longer knows
+        return False
+
+
+# ─────────────── bounded pool ───────────────
+class HashPool:
+    def __init__(self, workers=HASH_WORKERS, queue=HASH_QUEUE):
+        self.workers = workers
+        self._slots = threading.BoundedSemaphore(workers + queue)
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.busy = 0
+
+    def _pool(self):
+        if self._pid != os.getpid():           # a fork does not inherit threads
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(self.workers,
+                                                        thread_name_prefix="hash")
+                    self._executor.submit(_dummy)     # warm, off the first request
+                    self._pid = os.getpid()
+        return self._executor
+
+    def submit(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            self.busy += 1
+            raise CredentialsBusy("too many logins in progress")
+        try:
+            future = self._pool().submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def stats(self):
+        return {"workers": self.workers, "refused": self.busy}
+
+
+pool = HashPool()
+
+
+# ─────────────── API ───────────────
+def verify(table, user_id, stored, raw):
+    """Check `raw` against a stored password; call with no connection held.
+
+    user_id None (no such user) still costs one hash check.
+    """
+    if table not in _TABLES:
+        raise ValueError(f"unknown credentials table {table!r}")
+    raw = raw or ""
+    if user_id is None or stored is None:
+        pool.submit(_check, _dummy(), raw).result()
+        return False
+    if is_hashed(stored):
+        ok = pool.submit(_check, stored, raw).result()
+    else:
+        # a plain-text row costs a hash check too, or the time would tell
+        # which accounts are still unhashed
+        pool.submit(_check, _dummy(), raw).result()
+        ok = _check(stored, raw)
+    if ok and not stored.startswith(_current_method() + "$"):
+        try:
+            pool.submit(_rehash, table, user_id, stored, raw)
+        except CredentialsBusy:
+            pass                         # next login will do it
+    return ok
+
+
+def _rehash(table, user_id, stored, raw):
+    try:
+        new = hash_password(raw)
+        with db_cursor(commit=True) as cur:
+            cur.execute(f"UPDATE {table} SET password = %s WHERE id = %s AND password = %s",
+                        (new, user_id, stored))
+    except Exception:
+        log.exception("rehash of %s %s failed", table, user_id)
+
+
+def hash_many(raws):
+    """Hash a batch (bulk import) on a few threads, leaving the login pool alone."""
+    with ThreadPoolExecutor(max(1, HASH_WORKERS // 2), thread_name_prefix="hash-bulk") as ex:
+        return list(ex.map(hash_password, raws))
@@ -1,8 +1,370 @@
+import logging
 import os
+import threading
+import time
+from contextlib import contextmanager
+
 import psycopg2
+from psycopg2 import extensions
+
+# Pool sizing is per process: with gunicorn every worker owns its own pool,
+# so the effective server-side ceiling is workers × DB_POOL_MAX.
+POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))             # seconds to wait for a free slot
+POOL_MAX_LIFETIME = float(os.getenv("DB_POOL_MAX_LIFETIME", "1800"))  # recycle after N seconds
+POOL_HEALTH_IDLE = float(os.getenv("DB_POOL_HEALTH_IDLE", "30"))      # ping if idle longer than N
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection frees up within POOL_TIMEOUT."""
+
+
+# ───────────── per-request query accounting (per thread) ─────────────
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))    # 0 disables the log
+SLOW_QUERY_PARAMS_MAX = 500                                 # chars of params logged
+
+log = logging.getLogger("db")
+_stats = threading.local()
+
+
+class QueryStats:
+    __slots__ = ("queries", "rows", "sql_time", "trips")
+
+    def __init__(self):
+        self.queries = 0      # execute / executemany calls
+        self.rows = 0         # rows handed back by fetch* and iteration
+        self.sql_time = 0.0   # seconds spent waiting on the server
+        self.trips = 0        # queries + named-cursor fetches + commits/rollbacks
+
+
+slow_queries = 0
+
+
+def reset_query_stats():
+    """Start a fresh tally for this thread (one request) and return it."""
+    _stats.current = QueryStats()
+    return _stats.current
+
+
+def query_stats():
+    stats = getattr(_stats, "current", None)
+    return stats if stats is not None else reset_query_stats()
+
+
+def round_trips():
+    return query_stats().trips
+
+
+def _slow(query, params, seconds):
+    global slow_queries
+    slow_queries += 1
+    if isinstance(query, bytes):
+        query = query.decode("utf-8", "replace")
+    log.warning("slow query %.1f ms: %s params=%s", seconds * 1000,
+                " ".join(str(query).split()), repr(params)[:SLOW_QUERY_PARAMS_MAX])
+
+
+class CountingCursor(extensions.cursor):
+    """Cursor that feeds the per-request QueryStats and the slow-query log."""
+
+    def _timed(self, fn, query, params):
+        started = time.perf_counter()
+        try:
+            return fn(query, params)
+        finally:
+            elapsed = time.perf_counter() - started
+            stats = query_stats()
+            stats.queries += 1
+            stats.trips += 1
+            stats.sql_time += elapsed
+            if SLOW_QUERY_MS and elapsed * 1000 >= SLOW_QUERY_MS:
+                _slow(query, params, elapsed)
+
+    def execute(self, query, vars=None):
+        return self._timed(super().execute, query, vars)
+
+    def executemany(self, query, vars_list):
+        return self._timed(super().executemany, query, vars_list)
+
+    # a named (server-side) cursor goes back to the server for every fetch
+    def _fetched(self, started, rows):
+        stats = query_stats()
+        stats.rows += rows
+        if self.name:
+            stats.trips += 1
+            stats.sql_time += time.perf_counter() - started
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(started, row is not None)
+        return row
+
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        rows = super().fetchmany(size) if size is not None else super().fetchmany()
+        self._fetched(started, len(rows))
+        return rows
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(started, len(rows))
+        return rows
+
+    def __next__(self):
+        row = super().__next__()
+        query_stats().rows += 1
+        return row
+
+
+class CountingConnection(extensions.connection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cursor_factory = CountingCursor
 
-def connect_db():
+    def commit(self):
+        if self.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+            query_stats().trips += 1
+        return super().commit()
+
+    def rollback(self):
+        if self.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+            query_stats().trips += 1
+        return super().rollback()
+
+
+def open_connection():
+    """Open a brand-new, unpooled connection (LISTEN loops, migrations)."""
     return psycopg2.connect(
         os.getenv("DATABASE_URL"),
-        sslmode="require"
+        sslmode=os.getenv("DB_SSLMODE", "require"),
+        connection_factory=CountingConnection,
     )
+
+
+class ConnectionPool:
+    """Bounded, thread-safe psycopg2 pool with health checks and recycling."""
+
+    def __init__(self, factory=open_connection, minconn=POOL_MIN,
+                 maxconn=POOL_MAX, timeout=POOL_TIMEOUT,
+                 max_lifetime=POOL_MAX_LIFETIME, health_idle=POOL_HEALTH_IDLE):
+        self.factory = factory
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.health_idle = health_idle
+
+        self._cond = threading.Condition()
+        self._idle = []        # [(conn, last_used)] – LIFO keeps hot conns hot
+        self._born = {}        # id(conn) -> creation time
+        self._size = 0         # idle + in use + being opened
+        self._in_use = 0
+        self._stats = {
+            "checkouts": 0, "waits": 0, "timeouts": 0,
+            "wait_time_total": 0.0, "wait_time_max": 0.0,
+            "created": 0, "recycled": 0, "discarded": 0,
+        }
+
+    # ─────────── checkout / return ───────────
+    def getconn(self):
+        start = time.monotonic()
+        deadline = start + self.timeout
+        waited = False
+        while True:
+            conn = None
+            with self._cond:
+                while True:
+                    if self._idle:
+                        conn, last_used = self._idle.pop()
+                        break
+                    if self._size < self.maxconn:
+                        self._size += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats["timeouts"] += 1
+                        raise PoolTimeout(
+                            f"no connection available after {self.timeout:.1f}s"
+                        )
+                    waited = True
+                    self._cond.wait(remaining)
+
+            if conn is None:
+                conn = self._create()
+            elif not self._healthy(conn, last_used):
+                self._drop(conn, "discarded")
+                continue
+
+            elapsed = time.monotonic() - start
+            with self._cond:
+                self._in_use += 1
+                self._stats["checkouts"] += 1
+                self._stats["wait_time_total"] += elapsed
+                self._stats["wait_time_max"] = max(self._stats["wait_time_max"], elapsed)
+                if waited:
+                    self._stats["waits"] += 1
+            return conn
+
+    def putconn(self, conn, discard=False):
+        with self._cond:
+            self._in_use -= 1
+
+        if discard or conn.closed:
+            self._drop(conn, "discarded")
+            return
+
+        # never hand a half-finished transaction to the next request
+        if conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                self._drop(conn, "discarded")
+                return
+
+        if self._expired(conn):
+            self._drop(conn, "recycled")
+            return
+
+        with self._cond:
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    # ─────────── internals ───────────
+    def _create(self):
+        try:
+            conn = self.factory()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._born[id(conn)] = time.monotonic()
+            self._stats["created"] += 1
+        return conn
+
+    def _expired(self, conn):
+        born = self._born.get(id(conn), 0.0)
+        return self.max_lifetime > 0 and time.monotonic() - born > self.max_lifetime
+
+    def _healthy(self, conn, last_used):
+        if conn.closed or self._expired(conn):
+            return False
+        if time.monotonic() - last_used < self.health_idle:
+            return True
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT 1")
+            cur.close()
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _drop(self, conn, reason):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+        with self._cond:
+            self._born.pop(id(conn), None)
+            self._size -= 1
+            self._stats[reason] += 1
+            self._cond.notify()
+
+    # ─────────── maintenance ───────────
+    def prefill(self):
+        """Open up to minconn idle connections ahead of the first request."""
+        while True:
+            with self._cond:
+                if self._size >= self.minconn:
+                    return
+                self._size += 1
+            conn = self._create()
+            with self._cond:
+                self._idle.append((conn, time.monotonic()))
+                self._cond.notify()
+
+    def closeall(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._drop(conn, "discarded")
+
+    def stats(self):
+        with self._cond:
+            out = dict(self._stats)
+            out.update(
+                size=self._size,
+                idle=len(self._idle),
+                in_use=self._in_use,
+                max=self.maxconn,
+            )
+        out["wait_time_avg"] = (
+            out["wait_time_total"] / out["checkouts"] if out["checkouts"] else 0.0
+        )
+        return out
+
+
+# ───────────── per-process pool (fork-safe for gunicorn) ─────────────
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool, _pool_pid
+    pid = os.getpid()
+    if _pool is None or _pool_pid != pid:
+        with _pool_lock:
+            if _pool is None or _pool_pid != pid:
+                # sockets inherited from a pre-fork parent must not be reused
+                pool = ConnectionPool()
+                try:
+                    pool.prefill()          # DB_POOL_MIN warm connections
+                except psycopg2.Error as e:
+                    log.warning("could not open %d pooled connections yet: %s",
+                                pool.minconn, e)
+                _pool, _pool_pid = pool, pid
+    return _pool
+
+
+@contextmanager
+def db_conn():
+    """Borrow a pooled connection; rolls back on error, always returns it."""
+    pool = get_pool()
+    conn = pool.getconn()
+    broken = False
+    try:
+        yield conn
+    except psycopg2.OperationalError:
+        broken = True
+        raise
+    except Exception:
+        try:
+            conn.rollback()
+        except psycopg2.Error:
+            broken = True
+        raise
+    finally:
+        pool.putconn(conn, discard=broken)
+
+
+@contextmanager
+def db_cursor(commit=False):
+    """Pooled cursor; commits on success when commit=True."""
+    with db_conn() as conn:
+        cur = conn.cursor()
+        try:
+            yield cur
+            if commit:
+                conn.commit()
+        finally:
+            cur.close()
+
+
+def pool_stats():
+    return get_pool().stats()
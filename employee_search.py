@@ -0,0 +1,193 @@
+"""In-memory employee index for the admin typeahead and /search.
+
+The whole employee list (id, name, emp_code) is small enough to hold in every
+worker. Typeahead queries of three or more characters are answered from a
+trigram posting map (substring match, like the old ILIKE '%q%'); shorter ones
+from a sorted list of word prefixes. find(), behind the /search page, keeps
+the old ILIKE's answer for every query: substring matches at any length (a
+scan of the keys below three characters) and every employee for an empty
+query, with the total so the page can say when it shows only the first few.
+Results are ranked and cached per normalised query. The index is rebuilt lazily on the first query after invalidate(),
+which runs on every data_changed 'employee' NOTIFY (any write to employee,
+from any worker or script), and at once when this worker's identity cache
+is cleared. As a backstop for missed notifications – the listener is down or
+reconnecting – an index older than SEARCH_INDEX_TTL seconds is rebuilt too.
+"""
+import os
+import threading
+import time
+from bisect import bisect_left
+
+from db import db_cursor
+from events import bus
+from fragments import CHANNEL as DATA_CHANNEL
+from identity_cache import TTLCache, identity
+
+SEARCH_LIMIT = 10
+SEARCH_MAX_LIMIT = 50
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", "60"))
+SEARCH_INDEX_TTL = float(os.getenv("SEARCH_INDEX_TTL", "300"))
+
+
+def _norm(text):
+    return " ".join((text or "").lower().split())
+
+
+def _trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class EmployeeIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stale = True
+        self._built_at = 0.0
+        self._subscribed = False
+        # (rows, keys, grams, words), swapped as one so readers never mix builds:
+        #   rows  id -> (id, name, emp_code)
+        #   keys  id -> (name_lc, code_lc)
+        #   grams trigram -> set(id)
+        #   words sorted [(word, id)] over name words and the code
+        self._snap = ({}, {}, {}, [])
+        self.cache = TTLCache(maxsize=2000, ttl=SEARCH_CACHE_TTL)
+        self.rebuilds = 0
+
+    # ─────────── build ───────────
+    def _build(self):
+        with db_cursor() as cur:
+            cur.execute("SELECT id, name, emp_code FROM employee")
+            rows = cur.fetchall()
+        keys, grams, words = {}, {}, []
+        for emp_id, name, code in rows:
+            name_lc, code_lc = _norm(name), _norm(code)
+            keys[emp_id] = (name_lc, code_lc)
+            for text in (name_lc, code_lc):
+                for g in _trigrams(text):
+                    grams.setdefault(g, set()).add(emp_id)
+            for word in set(name_lc.split()) | {code_lc}:
+                words.append((word, emp_id))
+        words.sort()
+        self._snap = ({r[0]: r for r in rows}, keys, grams, words)
+        self.rebuilds += 1
+
+    def _expired(self):
+        return self._stale or time.monotonic() - self._built_at > SEARCH_INDEX_TTL
+
+    def _ensure(self):
+        if not self._expired():
+            return
+        with self._lock:
+            if self._expired():
+                # clear first: an invalidate() during the load re-marks stale
+                self._stale = False
+                self._built_at = time.monotonic()
+                try:
+                    self._build()
+                except Exception:
+                    self._stale = True
+                    raise
+                self.cache.clear()
+
+    def invalidate(self):
+        self._stale = True
+        self.cache.clear()
+
+    def _on_notify(self, payload):
+        # None: (re)connected, so employees may have changed meanwhile
+        if payload in ("employee", None):
+            self.invalidate()
+
+    def start(self):
+        if not self._subscribed:
+            self._subscribed = True
+            bus.subscribe(DATA_CHANNEL, self._on_notify)
+        bus.start()
+
+    # ─────────── query ───────────
+    @staticmethod
+    def _candidates(snap, q):
+        _, keys, grams, words = snap
+        if len(q) >= 3:
+            ids = None
+            for g in _trigrams(q):
+                posting = grams.get(g)
+                if not posting:
+                    return set()
+                ids = set(posting) if ids is None else ids & posting
+            # trigrams can match out of order; confirm the substring
+            return {i for i in ids if q in keys[i][0] or q in keys[i][1]}
+        ids = set()
+        for word, emp_id in words[bisect_left(words, (q,)):]:
+            if not word.startswith(q):
+                break
+            ids.add(emp_id)
+        return ids
+
+    @staticmethod
+    def _rank(keys, emp_id, q):
+        name, code = keys[emp_id]
+        if code == q:
+            score = 0
+        elif code.startswith(q):
+            score = 1
+        elif name.startswith(q):
+            score = 2
+        elif any(w.startswith(q) for w in name.split()):
+            score = 3
+        else:
+            score = 4
+        return (score, name, emp_id)
+
+    def search(self, query, limit=SEARCH_LIMIT):
+        """Ranked [(id, name, emp_code)]: code match, name prefix, substring."""
+        q = _norm(query)
+        if not q:
+            return []
+        limit = max(1, min(limit, SEARCH_MAX_LIMIT))
+        self.start()
+        self._ensure()
+        key = (q, limit)
+        hit = self.cache.get(key, None)
+        if hit is not None:
+            return hit
+        snap = self._snap
+        rows, keys = snap[0], snap[1]
+        ranked = sorted(self._candidates(snap, q), key=lambda i: self._rank(keys, i, q))
+        result = [rows[i] for i in ranked[:limit]]
+        self.cache.set(key, result)
+        return result
+
+    def find(self, query, limit=SEARCH_MAX_LIMIT):
+        """/search: (first `limit` ranked rows, total) of the employees whose
+        name or code contains the query; every employee for an empty one."""
+        q = _norm(query)
+        self.start()
+        self._ensure()
+        key = ("find", q, limit)
+        hit = self.cache.get(key, None)
+        if hit is not None:
+            return hit
+        snap = self._snap
+        rows, keys = snap[0], snap[1]
+        if len(q) >= 3:
+            ids = self._candidates(snap, q)
+        else:
+            ids = [i for i, (name, code) in keys.items() if q in name or q in code]
+        ranked = sorted(ids, key=lambda i: self._rank(keys, i, q))
+        result = ([rows[i] for i in ranked[:limit]], len(ranked))
+        self.cache.set(key, result)
+        return result
+
+    def stats(self):
+        return {
+            "employees": len(self._snap[0]),
+            "rebuilds": self.rebuilds,
+            "cache_hits": self.cache.hits,
+            "cache_misses": self.cache.misses,
+            "cache_entries": len(self.cache),
+        }
+
+
+employees = EmployeeIndex()
+# this worker's own employee writes: no need to wait for the NOTIFY
+identity.on_clear(employees.invalidate)
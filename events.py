@@ -0,0 +1,93 @@
+"""One Postgres LISTEN connection per worker, fanned out to in-process handlers.
+
+subscribe(channel, fn) registers fn(payload) for NOTIFYs on channel. After a
+(re)connect every handler is called with payload None, meaning "anything
+may have changed while we were not listening". Handlers run on the listener
+thread and must be quick.
+"""
+import logging
+import os
+import select
+import threading
+import time
+
+from db import open_connection
+
+log = logging.getLogger("events")
+
+
+class EventBus:
+    def __init__(self):
+        self._handlers = {}          # channel -> [fn]
+        self._lock = threading.Lock()
+        self._listening = set()      # channels LISTENed on the current connection
+        self._pid = None
+        self.connected = False
+        self.received = 0
+
+    def subscribe(self, channel, fn):
+        with self._lock:
+            self._handlers.setdefault(channel, []).append(fn)
+        self.start()
+
+    def start(self):
+        """Start this process's listener thread (once per pid, fork-safe)."""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self.connected = False
+            self._listening = set()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _dispatch(self, channel, payload):
+        for fn in list(self._handlers.get(channel, ())):
+            try:
+                fn(payload)
+            except Exception:
+                log.exception("handler for %s failed", channel)
+
+    def _run(self):
+        while True:
+            conn = None
+            try:
+                conn = open_connection()
+                conn.autocommit = True
+                cur = conn.cursor()
+                self._listening = set()
+                self.connected = True
+                first = True
+                while True:
+                    with self._lock:
+                        pending = set(self._handlers) - self._listening
+                    for channel in pending:
+                        cur.execute(f'LISTEN "{channel}"')
+                        self._listening.add(channel)
+                        if not first:
+                            self._dispatch(channel, None)
+                    if first:
+                        for channel in list(self._listening):
+                            self._dispatch(channel, None)
+                        first = False
+                    if select.select([conn], [], [], 1.0) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        note = conn.notifies.pop(0)
+                        self.received += 1
+                        self._dispatch(note.channel, note.payload)
+            except Exception:
+                log.warning("event listener disconnected; retrying", exc_info=True)
+                self.connected = False
+                if conn is not None:
+                    conn.close()
+                time.sleep(5)
+
+    def stats(self):
+        return {"connected": self.connected, "received": self.received,
+                "channels": sorted(self._listening)}
+
+
+bus = EventBus()
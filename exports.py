@@ -0,0 +1,204 @@
+"""Streaming attendance exports (CSV / XLSX).
+
+Rows come off a server-side (named) cursor in EXPORT_CHUNK batches and are
+encoded straight into the response, so a report for ten employees and one
+for ten thousand use the same amount of worker memory. XLSX is written as a
+minimal write-only workbook through zipfile, which supports unseekable
+output, so no spreadsheet library is needed.
+"""
+import calendar
+import csv
+import io
+import zipfile
+from datetime import datetime
+from xml.sax.saxutils import escape
+
+from db import db_conn
+
+EXPORT_CHUNK = 2000
+MAX_EXPORT_DAYS = 3660
+REPORT_PAGE_DAYS = 31      # /monthly_report renders at most this; longer ranges are exported
+
+HEADER = ["Employee ID", "Name", "Date", "Punch In", "Punch Out",
+          "Location In", "Location Out", "Absent", "Reason"]
+
+
+class ExportError(ValueError):
+    """Bad month / date-range parameters."""
+
+
+def _date(value, name):
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").date()
+    except (TypeError, ValueError):
+        raise ExportError(f"{name} must be YYYY-MM-DD")
+
+
+def parse_range(args, today):
+    """?from=&to= or ?month=YYYY-MM; defaults to the current month."""
+    if args.get("from") or args.get("to"):
+        first = _date(args.get("from"), "from")
+        last = _date(args.get("to"), "to")
+    else:
+        month = args.get("month")
+        if month:
+            try:
+                anchor = datetime.strptime(month, "%Y-%m").date()
+            except ValueError:
+                raise ExportError("month must be YYYY-MM")
+        else:
+            anchor = today
+        first = anchor.replace(day=1)
+        last = anchor.replace(day=calendar.monthrange(anchor.year, anchor.month)[1])
+    if last < first:
+        raise ExportError("to is before from")
+    if (last - first).days >= MAX_EXPORT_DAYS:
+        raise ExportError(f"range is limited to {MAX_EXPORT_DAYS} days")
+    return first, last
+
+
+REPORT_SQL = """
+    SELECT e.id, e.name,
+           a.date, a.time_in, a.time_out,
+           a.location_in, a.location_out,
+           a.absent, a.reason
+      FROM employee e
+ LEFT JOIN attendance_range(%s, %s) a      -- hot partitions + archive
+        ON e.id = a.emp_id
+  ORDER BY e.id, a.date
+"""
+
+
+def report_chunks(first, last, chunk=EXPORT_CHUNK):
+    """Yield lists of report rows; holds one pooled connection while iterating."""
+    with db_conn() as conn:
+        cur = conn.cursor(name="report_export")
+        try:
+            cur.execute(REPORT_SQL, (first, last))
+            while True:
+                rows = cur.fetchmany(chunk)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            cur.close()
+
+
+def _cells(r):
+    return [
+        r[0], r[1],
+        r[2].isoformat() if r[2] else "",
+        r[3].strftime("%H:%M:%S") if r[3] else "",
+        r[4].strftime("%H:%M:%S") if r[4] else "",
+        r[5] or "", r[6] or "",
+        ("Yes" if r[7] else "No") if r[2] else "",
+        r[8] or "",
+    ]
+
+
+def csv_stream(chunks):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(HEADER)
+    for rows in chunks:
+        writer.writerows(_cells(r) for r in rows)
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue()
+
+
+# ─────────────── minimal streaming XLSX ───────────────
+class _Sink:
+    """Write-only file object that hands buffered bytes back to a generator."""
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        out, self.parts = b"".join(self.parts), []
+        return out
+
+
+_XLSX_STATIC = {
+    "[Content_Types].xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    "_rels/.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    "xl/workbook.xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Attendance" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    ),
+    "xl/_rels/workbook.xml.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+        '</Relationships>'
+    ),
+}
+
+
+def _xlsx_row(values):
+    cells = []
+    for v in values:
+        if isinstance(v, (int, float)) and not isinstance(v, bool):
+            cells.append(f'<c t="n"><v>{v}</v></c>')
+        else:
+            cells.append(f'<c t="inlineStr"><is><t>{escape(str(v))}</t></is></c>')
+    return "<row>" + "".join(cells) + "</row>"
+
+
+def xlsx_stream(chunks):
+    sink = _Sink()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for name, body in _XLSX_STATIC.items():
+            zf.writestr(name, body)
+        with zf.open("xl/worksheets/sheet1.xml", "w") as sheet:
+            sheet.write(
+                b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                b'<sheetData>'
+            )
+            sheet.write(_xlsx_row(HEADER).encode())
+            for rows in chunks:
+                sheet.write("".join(_xlsx_row(_cells(r)) for r in rows).encode())
+                data = sink.drain()
+                if data:        # deflate may still be buffering
+                    yield data
+            sheet.write(b"</sheetData></worksheet>")
+    yield sink.drain()
+
+
+FORMATS = {
+    "csv": (csv_stream, "text/csv"),
+    "xlsx": (xlsx_stream,
+             "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+}
+
+
+def filename(first, last, fmt):
+    if first.day == 1 and (last - first).days < 31 and first.month == last.month:
+        return f"attendance-{first:%Y-%m}.{fmt}"
+    return f"attendance-{first:%Y%m%d}-{last:%Y%m%d}.{fmt}"
@@ -0,0 +1,91 @@
+"""Data version and cached HTML fragments for the admin pages.
+
+A statement trigger on attendance, leaves and employee bumps data_version
+and sends NOTIFY data_changed '<table>'. Both happen in the writing
+transaction, so every writer – web punches, the punch queue, batch sync,
+absences, leaves, employee edits – moves the version exactly when its rows
+become visible, and every worker reads the same number. Rendered fragments
+and ETags are keyed by it: a request reads it once (a sum over 64 rows) and
+a poll that finds nothing changed does no other SQL.
+
+data_version is 64 counters, and the version is their sum. A writer bumps
+its backend's counter, or, if another open transaction holds that one, any
+counter nobody holds (FOR UPDATE SKIP LOCKED). Concurrent writers therefore
+never wait on each other's commits, as they would on a single row. Every
+committed bump still raises the sum, whatever order the commits land in.
+
+The NOTIFY is for in-process caches that drop entries (identity, search).
+If data_version cannot be read (migration 011 pending, database down) the
+version rolls over every DASHBOARD_TTL seconds, which bounds staleness the
+way the old time-based dashboard cache did.
+"""
+import hashlib
+import logging
+import os
+import time
+
+import psycopg2
+from markupsafe import Markup
+
+from db import PoolTimeout, db_cursor
+from identity_cache import TTLCache
+
+DASHBOARD_TTL = float(os.getenv("DASHBOARD_TTL", "5"))
+CHANNEL = "data_changed"
+TABLES = ("attendance", "leaves", "employee")
+
+log = logging.getLogger("fragments")
+
+# the trigger: migrations.py 006 (notify), 011/012 (data_version); this is
+# for writers of derived tables it does not watch (rollups)
+BUMP_VERSION = "SELECT bump_data_version()"
+
+
+class DataVersions:
+    def __init__(self):
+        self.reads = 0
+        self.failures = 0
+        self.last = None
+
+    def current(self):
+        """The committed data version (one query), or a DASHBOARD_TTL epoch
+        if it cannot be read. Call once per request and pass it along."""
+        try:
+            with db_cursor() as cur:
+                cur.execute("SELECT sum(version)::bigint FROM data_version")
+                row = cur.fetchone()
+        except (psycopg2.Error, PoolTimeout) as e:
+            row = None
+            self.failures += 1
+            log.warning("data_version unavailable (%s); versions follow the clock", e)
+        self.reads += 1
+        if row is None or row[0] is None:
+            return ("t", int(time.time() // DASHBOARD_TTL))
+        self.last = row[0]
+        return row[0]
+
+
+versions = DataVersions()
+
+_rendered = TTLCache(maxsize=256, ttl=float(os.getenv("FRAGMENT_MAX_AGE", "600")))
+
+
+def cached(name, version, render):
+    """Markup of render(), produced once per (name, version); the TTL only
+    bounds memory."""
+    key = (name, version)
+    html = _rendered.get(key, None)
+    if html is None:
+        html = Markup(render())
+        _rendered.set(key, html)
+    return html
+
+
+def etag(*parts):
+    return hashlib.blake2b(repr(parts).encode(), digest_size=12).hexdigest()
+
+
+def stats():
+    return {"version": versions.last, "version_reads": versions.reads,
+            "version_failures": versions.failures, "fragments": len(_rendered),
+            "hits": _rendered.hits, "misses": _rendered.misses}
@@ -0,0 +1,192 @@
+"""Keyset-paginated and incremental attendance history for the mobile app.
+
+Pages are ordered by date DESC and continue from an opaque `before` date
+cursor, so page N costs the same as page 1. Without paging arguments the
+first HISTORY_DEFAULT_LIMIT days come back; has_more says whether older rows
+exist (follow next_cursor), and leave_has_more whether the leave list, which
+rides on the first page and holds the LEAVE_LIMIT newest, was cut.
+`changed_since` returns only rows touched after a server-issued watermark
+(attendance.updated_at, kept current by a trigger); rows inside the overlap
+window may repeat, clients key them by date. Months past the archive horizon
+(partitions.py) are read from attendance_archive once a page runs past the
+hot rows.
+"""
+from datetime import date, datetime, timedelta
+
+import partitions
+
+HISTORY_DEFAULT_LIMIT = 90
+HISTORY_MAX_LIMIT = 366
+LEAVE_LIMIT = 100
+WATERMARK_OVERLAP = timedelta(seconds=60)   # covers transactions committing late
+STREAM_CHUNK = 500
+
+# updated_at columns and their triggers: migrations.py 004
+
+
+class HistoryError(ValueError):
+    """Bad query-string parameter."""
+
+
+def _date_arg(args, name):
+    raw = args.get(name)
+    if not raw:
+        return None
+    try:
+        return datetime.strptime(raw, "%Y-%m-%d").date()
+    except ValueError:
+        raise HistoryError(f"{name} must be YYYY-MM-DD")
+
+
+def parse_args(args):
+    try:
+        limit = int(args.get("limit", HISTORY_DEFAULT_LIMIT))
+    except ValueError:
+        raise HistoryError("limit must be an integer")
+    changed_since = args.get("changed_since")
+    if changed_since:
+        try:
+            changed_since = datetime.fromisoformat(changed_since.replace("Z", "+00:00"))
+        except ValueError:
+            raise HistoryError("changed_since must be an ISO timestamp")
+    return {
+        "limit": max(1, min(limit, HISTORY_MAX_LIMIT)),
+        "before": _date_arg(args, "before"),
+        "since": _date_arg(args, "since"),
+        "until": _date_arg(args, "until"),
+        "changed_since": changed_since or None,
+    }
+
+
+def _filters(emp_id, opts, before=None, prefix=""):
+    clauses, params = [f"{prefix}emp_id = %s"], [emp_id]
+    if opts["since"]:
+        clauses.append(f"{prefix}date >= %s")
+        params.append(opts["since"])
+    if opts["until"]:
+        clauses.append(f"{prefix}date <= %s")
+        params.append(opts["until"])
+    if before:
+        clauses.append(f"{prefix}date < %s")
+        params.append(before)
+    if opts["changed_since"]:
+        clauses.append(f"{prefix}updated_at >= %s")
+        params.append(opts["changed_since"] - WATERMARK_OVERLAP)
+    return clauses, params
+
+
+def _archive_months(opts, before):
+    """The same bounds on whole archived months (archive row `ar`)."""
+    clauses, params = [], []
+    if opts["since"]:
+        clauses.append("ar.month > %s::date - INTERVAL '1 month'")
+        params.append(opts["since"])
+    if opts["until"]:
+        clauses.append("ar.month <= %s")
+        params.append(opts["until"])
+    if before:
+        clauses.append("ar.month < %s")
+        params.append(before)
+    if opts["changed_since"]:
+        clauses.append("ar.last_updated >= %s")
+        params.append(opts["changed_since"] - WATERMARK_OVERLAP)
+    return clauses, params
+
+
+def attendance_query(emp_id, opts, paginate=True):
+    """Hot partitions first, then archived months (see partitions.py).
+
+    Every archived month is older than every hot one. A page reads the
+    archive only when the hot rows cannot fill it, and then month by month,
+    newest first, until it has enough.
+    """
+    before = opts["before"] if paginate else None
+    hot, hot_params = _filters(emp_id, opts, before)
+    months, month_params = _archive_months(opts, before)
+    rows, row_params = _filters(emp_id, opts, before, prefix="u.")
+    archived_params = [emp_id // partitions.ARCHIVE_BLOCK] + month_params + row_params
+    hot_sql = f"""
+        SELECT date, time_in, time_out, absent, reason
+          FROM attendance
+         WHERE {' AND '.join(hot)}
+    """
+    archived_sql = f"""
+        SELECT u.date, u.time_in, u.time_out, u.absent, u.reason
+          FROM attendance_archive ar, {partitions.UNNEST_ARCHIVE}
+         WHERE {' AND '.join(["ar.emp_block = %s"] + months + rows)}
+    """
+    if not paginate:
+        sql = f"{hot_sql} UNION ALL {archived_sql} ORDER BY date DESC"
+        return sql, hot_params + archived_params
+
+    limit = opts["limit"] + 1               # one extra row tells us there's more
+    sql = f"""
+        WITH hot AS MATERIALIZED ({hot_sql} ORDER BY date DESC LIMIT %s)
+        SELECT * FROM hot
+        UNION ALL (
+            {archived_sql}
+               AND (SELECT count(*) FROM hot) < %s
+             ORDER BY ar.month DESC, u.date DESC
+             LIMIT %s
+        )
+        ORDER BY date DESC
+        LIMIT %s
+    """
+    return sql, hot_params + [limit] + archived_params + [limit] * 3
+
+
+def leave_query(emp_id, opts, limit=LEAVE_LIMIT):
+    clauses, params = ["emp_id = %s"], [emp_id]
+    # leaves overlapping the requested window
+    if opts["since"]:
+        clauses.append("to_date >= %s")
+        params.append(opts["since"])
+    if opts["until"]:
+        clauses.append("from_date <= %s")
+        params.append(opts["until"])
+    if opts["changed_since"]:
+        clauses.append("updated_at >= %s")
+        params.append(opts["changed_since"] - WATERMARK_OVERLAP)
+    sql = f"""
+        SELECT from_date, to_date, reason
+          FROM leaves
+         WHERE {' AND '.join(clauses)}
+         ORDER BY id DESC
+    """
+    if limit:
+        sql += " LIMIT %s"
+        params.append(limit)
+    return sql, params
+
+
+def fetch_page(cur, emp_id, opts):
+    """(attendance_rows, leave_rows, next_cursor, leave_more, watermark) for
+    one page."""
+    cur.execute("SELECT now()")
+    watermark = cur.fetchone()[0]
+
+    cur.execute(*attendance_query(emp_id, opts))
+    rows = cur.fetchall()
+
+    # leaves ride along on the first page only
+    leave_rows = []
+    if not opts["before"]:
+        cur.execute(*leave_query(emp_id, opts, limit=LEAVE_LIMIT + 1))
+        leave_rows = cur.fetchall()
+
+    return split_page(rows, leave_rows, opts) + (watermark,)
+
+
+def split_page(rows, leave_rows, opts):
+    """Trim the one-extra rows the queries fetched: (rows, leave_rows,
+    next_cursor, leave_more)."""
+    next_cursor = None
+    if len(rows) > opts["limit"]:
+        rows = rows[:opts["limit"]]
+        next_cursor = rows[-1][0]
+    leave_more = len(leave_rows) > LEAVE_LIMIT
+    return rows, leave_rows[:LEAVE_LIMIT], next_cursor, leave_more
+
+
+def cursor_str(value):
+    return value.isoformat() if isinstance(value, (date, datetime)) else None
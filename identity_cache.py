@@ -0,0 +1,179 @@
+"""In-process cache of PIN / emp_code → employee or admin records.
+
+Entries expire after IDENTITY_TTL seconds and the least recently used are
+evicted past IDENTITY_MAX entries. Every worker drops its copy on the
+data_changed 'employee' NOTIFY that the employee trigger sends for any
+committed write (fragments.py), whoever made it. Writers in this worker call
+invalidate() so they see their own change before the NOTIFY comes back;
+invalidate(broadcast=True) also tells the other workers, for writes the
+trigger does not see (admin PINs). IDENTITY_NOTIFY=0 turns the listener
+off and leaves only the TTL.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from db import db_cursor
+from events import bus
+
+IDENTITY_TTL = float(os.getenv("IDENTITY_TTL", "300"))
+IDENTITY_MAX = int(os.getenv("IDENTITY_MAX", "5000"))
+IDENTITY_NOTIFY = os.getenv("IDENTITY_NOTIFY", "1") == "1"
+CHANNEL = "identity_cache"
+DATA_CHANNEL = "data_changed"      # fragments.CHANNEL; fragments imports this module
+
+# one round trip; employees win over admins sharing a PIN
+PIN_SQL = """
+    SELECT 'employee', id, name, emp_code FROM employee WHERE pin=%s
+    UNION ALL
+    SELECT 'admin', id, username, NULL FROM admin WHERE pin=%s
+    ORDER BY 1 DESC
+    LIMIT 1
+"""
+PROFILE_SQL = """
+    SELECT id, name, emp_code, email, phone, department, designation
+      FROM employee
+     WHERE emp_code = %s
+"""
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Thread-safe LRU map whose entries also expire after `ttl` seconds."""
+
+    def __init__(self, maxsize=IDENTITY_MAX, ttl=IDENTITY_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()   # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=_MISSING):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < now:
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class IdentityCache:
+    def __init__(self):
+        self.by_pin = TTLCache()       # pin -> ("employee"|"admin", row) | None
+        self.by_code = TTLCache()      # emp_code -> profile row | None
+        self.invalidations = 0
+        self._subscribed = False
+        self._on_clear = []            # other per-worker caches keyed off employees
+
+    # ─────────── lookups ───────────
+    def lookup_pin(self, pin):
+        """("employee", (id, name, emp_code)) / ("admin", (id, username)) / None."""
+        self.start_listener()
+        hit = self.by_pin.get(pin)
+        if hit is not _MISSING:
+            return hit
+        gen = self.invalidations
+        with db_cursor() as cur:
+            cur.execute(PIN_SQL, (pin, pin))
+            row = cur.fetchone()
+        if row is None:
+            value = None
+        elif row[0] == "employee":
+            value = ("employee", (row[1], row[2], row[3]))
+        else:
+            value = ("admin", (row[1], row[2]))
+        if gen == self.invalidations:      # don't resurrect pre-invalidation data
+            self.by_pin.set(pin, value)
+        return value
+
+    def employee_by_pin(self, pin):
+        hit = self.lookup_pin(pin)
+        return hit[1] if hit and hit[0] == "employee" else None
+
+    def profile_by_code(self, emp_code):
+        """(id, name, emp_code, email, phone, department, designation) or None."""
+        self.start_listener()
+        hit = self.by_code.get(emp_code)
+        if hit is not _MISSING:
+            return hit
+        gen = self.invalidations
+        with db_cursor() as cur:
+            cur.execute(PROFILE_SQL, (emp_code,))
+            row = cur.fetchone()
+        if gen == self.invalidations:
+            self.by_code.set(emp_code, row)
+        return row
+
+    # ─────────── invalidation ───────────
+    def on_clear(self, fn):
+        """Also run fn() whenever this worker's identities are dropped."""
+        self._on_clear.append(fn)
+
+    def clear_local(self):
+        self.by_pin.clear()
+        self.by_code.clear()
+        self.invalidations += 1
+        for fn in self._on_clear:
+            fn()
+
+    def invalidate(self, broadcast=False):
+        """Drop cached identities here (and with broadcast, in every worker).
+
+        Call after the writer has committed, so no reader can re-cache the
+        old row in between.
+        """
+        self.clear_local()
+        if broadcast and IDENTITY_NOTIFY:
+            with db_cursor(commit=True) as cur:
+                cur.execute("SELECT pg_notify(%s, 'clear')", (CHANNEL,))
+
+    def start_listener(self):
+        """LISTEN for invalidations on this worker's shared event connection."""
+        if not IDENTITY_NOTIFY:
+            return
+        if not self._subscribed:
+            self._subscribed = True
+            # payload None (reconnect) also clears: we may have missed some
+            bus.subscribe(CHANNEL, lambda payload: self.clear_local())
+            bus.subscribe(DATA_CHANNEL, self._on_data_changed)
+        bus.start()
+
+    def _on_data_changed(self, payload):
+        if payload in ("employee", None):
+            self.clear_local()
+
+    def stats(self):
+        return {
+            "pin_hits": self.by_pin.hits,
+            "pin_misses": self.by_pin.misses,
+            "pin_entries": len(self.by_pin),
+            "code_hits": self.by_code.hits,
+            "code_misses": self.by_code.misses,
+            "code_entries": len(self.by_code),
+            "invalidations": self.invalidations,
+        }
+
+
+identity = IdentityCache()
@@ -0,0 +1,112 @@
+"""Set-based leave writes.
+
+Every call is one statement no matter how many employees or days it covers:
+the requested ranges are passed as parallel arrays, expanded server-side with
+generate_series and upserted into attendance alongside the leaves rows.
+"""
+import os
+from datetime import date, datetime
+
+LEAVE_MAX_DAYS = int(os.getenv("LEAVE_MAX_DAYS", "180"))
+HOLIDAYS_FILE = os.getenv("HOLIDAYS_FILE")    # one YYYY-MM-DD per line
+
+_holidays = None
+
+
+class LeaveError(ValueError):
+    """A leave entry failed validation."""
+
+
+def configured_holidays():
+    """Holiday dates from HOLIDAYS_FILE, read once per process."""
+    global _holidays
+    if _holidays is None:
+        _holidays = set()
+        if HOLIDAYS_FILE and os.path.exists(HOLIDAYS_FILE):
+            with open(HOLIDAYS_FILE) as fh:
+                for line in fh:
+                    line = line.split("#", 1)[0].strip()
+                    if line:
+                        _holidays.add(parse_date(line))
+    return _holidays
+
+
+def parse_date(value):
+    if isinstance(value, date):
+        return value
+    try:
+        return datetime.strptime(str(value), "%Y-%m-%d").date()
+    except ValueError:
+        raise LeaveError(f"bad date {value!r}, expected YYYY-MM-DD")
+
+
+def validate_range(from_date, to_date):
+    from_dt, to_dt = parse_date(from_date), parse_date(to_date)
+    if to_dt < from_dt:
+        raise LeaveError("to_date is before from_date")
+    span = (to_dt - from_dt).days + 1
+    if span > LEAVE_MAX_DAYS:
+        raise LeaveError(f"leave spans {span} days, max is {LEAVE_MAX_DAYS}")
+    return from_dt, to_dt
+
+
+def apply_leaves(cur, entries, skip_weekends=False, holidays=()):
+    """Record leave for (emp_id, from_date, to_date, reason) entries.
+
+    emp_id None means every employee (company-wide holiday). Dates must be
+    validated already. Attendance days falling on a weekend (when
+    skip_weekends) or in `holidays` are left untouched. Returns
+    (leave_rows, absent_days, applied): applied has, per entry, the emp_ids
+    it was recorded for – empty for an employee that does not exist.
+    Caller commits.
+    """
+    if not entries:
+        return 0, 0, []
+    emp_ids, froms, tos, reasons = map(list, zip(*entries))
+
+    cur.execute("""
+        WITH req AS (
+            SELECT * FROM unnest(%(emp_ids)s::int[], %(froms)s::date[],
+                                 %(tos)s::date[], %(reasons)s::text[])
+                   WITH ORDINALITY AS r(emp_id, from_date, to_date, reason, n)
+        ),
+        targets AS (
+            SELECT r.n, e.id AS emp_id, r.from_date, r.to_date, r.reason
+              FROM req r
+              JOIN employee e ON r.emp_id IS NULL OR e.id = r.emp_id
+        ),
+        lv AS (
+            INSERT INTO leaves (emp_id, from_date, to_date, reason)
+            SELECT emp_id, from_date, to_date, reason FROM targets
+            RETURNING 1
+        ),
+        days AS (
+            INSERT INTO attendance (emp_id, date, absent, reason)
+            SELECT DISTINCT ON (t.emp_id, d::date) t.emp_id, d::date, true, t.reason
+              FROM targets t
+             CROSS JOIN LATERAL generate_series(t.from_date, t.to_date,
+                                                interval '1 day') AS d
+             WHERE (NOT %(skip_weekends)s OR EXTRACT(ISODOW FROM d) < 6)
+               AND d::date <> ALL(%(holidays)s::date[])
+             ORDER BY t.emp_id, d::date, t.to_date DESC
+            ON CONFLICT (emp_id, date) DO UPDATE SET
+              absent = true,
+              reason = EXCLUDED.reason,
+              time_in = NULL,
+              time_out = NULL
+            RETURNING 1
+        )
+        SELECT (SELECT COUNT(*) FROM lv), (SELECT COUNT(*) FROM days),
+               coalesce(array_agg(t.emp_id ORDER BY t.emp_id)
+                        FILTER (WHERE t.emp_id IS NOT NULL), '{}')
+          FROM req r
+          LEFT JOIN targets t ON t.n = r.n
+         GROUP BY r.n
+         ORDER BY r.n
+    """, {
+        "emp_ids": emp_ids, "froms": froms, "tos": tos, "reasons": reasons,
+        "skip_weekends": bool(skip_weekends),
+        "holidays": sorted(holidays),
+    })
+    rows = cur.fetchall()
+    return rows[0][0], rows[0][1], [r[2] for r in rows]
@@ -0,0 +1,454 @@
+"""Load-test harness: seed a database, replay traffic mixes, catch regressions.
+
+    python loadtest.py seed --employees 10000 --days 90 --reset
+    RATE_LIMIT_BACKEND=off DB_TRIPS_HEADER=1 gunicorn -w 4 -b :8000 app:app
+    python loadtest.py run --out results.json
+    python loadtest.py run --save-baseline loadtest_baseline.json
+    python loadtest.py run --baseline loadtest_baseline.json      # exit 1 on regression
+
+`seed` wipes the application tables and fills them with synthetic employees
+(emp_code LT00001…, password "loadtest"), weekday attendance for the last
+--days days with absences and matching leaves, plus a "loadtest" admin.
+`run` replays each scenario for --duration seconds with a closed-loop client
+(bench_mobile.py) and reports throughput, p50/p95/p99 and database round
+trips per request – read from X-DB-Round-Trips, so start the server with
+DB_TRIPS_HEADER=1. Every client comes from one address, so start it with
+RATE_LIMIT_BACKEND=off too (or RATE_REQUESTS_IP / RATE_REQUESTS_DEVICE far
+above the offered load): otherwise most answers are 429s. 4xx answers are
+counted apart ("rejected", 429s also as "rate_limited") and left out of
+throughput and latency; a run where they pass --max-rejected of the answers
+fails. Baselines are plain JSON from --save-baseline; a run regresses when
+throughput drops or p99 grows past the tolerances, or any route needs more
+round trips than before.
+
+An employee punches in and out once a day, so morning_spike first clears
+today's punches of the seeded employees, then punches each one in at most
+once and out after that. Seed more employees than it sends punches in a run
+(rps × duration), or the extra ones are "Already punched in" 400s.
+"""
+import argparse
+import asyncio
+import collections
+import itertools
+import json
+import random
+import sys
+import time
+from urllib.parse import urlencode, urlsplit
+
+from bench_mobile import _read_response, percentile
+from db import open_connection
+import credentials
+import partitions
+import rollups
+
+LOADTEST_PASSWORD = "loadtest"
+SEED_TABLES = ("punch_receipts", "attendance_rollup_dirty", "attendance_daily",
+               "attendance_emp_monthly", "leaves", "attendance", "attendance_archive",
+               "employee", "admin")
+
+
+# ─────────────── seeding ───────────────
+def seed(employees, days, out=sys.stdout):
+    pin_width = max(4, len(str(employees)))
+    password = credentials.hash_password(LOADTEST_PASSWORD)    # one hash, shared
+    conn = open_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute(f"TRUNCATE {', '.join(SEED_TABLES)} RESTART IDENTITY CASCADE")
+        cur.execute("""
+            INSERT INTO employee (name, emp_code, password, pin, department, designation)
+            SELECT 'Employee ' || g,
+                   'LT' || lpad(g::text, 5, '0'),
+                   %(pw)s,
+                   lpad(g::text, %(width)s, '0'),
+                   (ARRAY['Ops', 'Sales', 'Support', 'Finance'])[1 + g %% 4],
+                   'Staff'
+              FROM generate_series(1, %(n)s) g
+        """, {"pw": password, "width": pin_width, "n": employees})
+        cur.execute("INSERT INTO admin (username, password) VALUES ('loadtest', %s)",
+                    (password,))
+        cur.execute("""
+            SELECT attendance_add_partition(m::date)
+              FROM generate_series(date_trunc('month', CURRENT_DATE - %s),
+                                   CURRENT_DATE, interval '1 month') m
+        """, (days,))
+        # 90% present (some late), 5% absent, 5% no row; weekdays only
+        cur.execute("""
+            INSERT INTO attendance (emp_id, date, time_in, time_out,
+                                    location_in, location_out, absent, reason)
+            SELECT emp_id, d,
+                   CASE WHEN r < 0.90 THEN time '09:00' + r * interval '70 min' END,
+                   CASE WHEN r < 0.90 THEN time '17:30' + r * interval '60 min' END,
+                   CASE WHEN r < 0.90 THEN 'Office|12.971600|77.594600' END,
+                   CASE WHEN r < 0.90 THEN 'Office|12.971600|77.594600' END,
+                   r >= 0.90,
+                   CASE WHEN r >= 0.90 THEN 'Sick' END
+              FROM (
+                    SELECT e.id AS emp_id, d::date AS d, random() AS r
+                      FROM employee e
+                     CROSS JOIN generate_series(CURRENT_DATE - %(days)s,
+                                                CURRENT_DATE - 1, interval '1 day') d
+                     WHERE extract(isodow FROM d) < 6
+              ) s
+             WHERE r < 0.95
+        """, {"days": days})
+        cur.execute("""
+            INSERT INTO leaves (emp_id, from_date, to_date, reason)
+            SELECT emp_id, date, date, reason FROM attendance
+             WHERE absent AND random() < 0.5
+        """)
+        conn.commit()
+        partitions.maintain(conn)       # archives months past ARCHIVE_AFTER_MONTHS
+        rollups.refresh(cur)
+        cur.execute("SELECT (SELECT count(*) FROM employee),"
+                    " (SELECT count(*) FROM attendance_range('-infinity', 'infinity')),"
+                    " (SELECT count(*) FROM leaves)")
+        e, a, l = cur.fetchone()
+        print(f"seeded {e} employees, {a} attendance rows, {l} leaves", file=out)
+    finally:
+        conn.close()
+
+
+def load_context():
+    """Ids, PINs and codes of the seeded employees, for building requests."""
+    conn = open_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT id, pin, emp_code FROM employee WHERE emp_code LIKE 'LT%' ORDER BY id")
+        rows = cur.fetchall()
+    finally:
+        conn.close()
+    if not rows:
+        raise SystemExit("no seeded employees; run `python loadtest.py seed` first")
+    return {"employees": rows}
+
+
+def clear_today():
+    """Drop today's (IST, as the app counts days) punches of the seeded employees."""
+    conn = open_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute("""
+            DELETE FROM attendance
+             WHERE date = (now() AT TIME ZONE 'Asia/Kolkata')::date
+               AND emp_id IN (SELECT id FROM employee WHERE emp_code LIKE 'LT%')
+        """)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+# ─────────────── traffic mixes ───────────────
+# Each entry is (weight, route label, fn(rng, ctx) -> (method, path, body)).
+# Bodies are dicts (JSON) or strings (form-encoded).
+def _punch(kind):
+    # ctx["to_punch_in"] / ctx["punched_in"]: employees still to punch in /
+    # in and not out yet; once one runs dry the picks repeat (and get 400s)
+    def make(rng, ctx):
+        queue, done = ((ctx["to_punch_in"], ctx["punched_in"]) if kind == "in"
+                       else (ctx["punched_in"], None))
+        emp = queue.popleft() if queue else rng.choice(ctx["employees"])
+        if done is not None:
+            done.append(emp)
+        return "POST", "/mobile/punch", {"pin": emp[1], "type": kind}
+    return make
+
+
+def _login_pin(rng, ctx):
+    return "POST", "/login_pin", {"pin": rng.choice(ctx["employees"])[1]}
+
+
+def _history(rng, ctx):
+    emp_id = rng.choice(ctx["employees"])[0]
+    return "GET", f"/mobile/history/{emp_id}?limit=30", None
+
+
+def _history_page2(rng, ctx):
+    emp_id = rng.choice(ctx["employees"])[0]
+    before = time.strftime("%Y-%m-%d", time.localtime(time.time() - 30 * 86400))
+    return "GET", f"/mobile/history/{emp_id}?limit=30&before={before}", None
+
+
+def _profile(rng, ctx):
+    return "POST", "/profile", {"emp_code": rng.choice(ctx["employees"])[2]}
+
+
+def _get(path):
+    return lambda rng, ctx: ("GET", path, None)
+
+
+def _monthly(rng, ctx):
+    month = time.strftime("%Y-%m", time.localtime(time.time() - rng.randint(0, 2) * 30 * 86400))
+    return "GET", f"/monthly_report?month={month}", None
+
+
+SCENARIOS = {
+    # shift start: punch-ins dominate, with logins and the odd punch-out
+    "morning_spike": {"concurrency": 200, "admin": False, "punches": True, "mix": [
+        (70, "punch in", _punch("in")),
+        (10, "punch out", _punch("out")),
+        (20, "login_pin", _login_pin),
+    ]},
+    "history": {"concurrency": 100, "admin": False, "mix": [
+        (60, "history", _history),
+        (25, "history page 2", _history_page2),
+        (15, "profile", _profile),
+    ]},
+    "admin_dashboard": {"concurrency": 10, "admin": True, "mix": [
+        (50, "admin", _get("/admin")),
+        (30, "dashboard.json absent", _get("/admin/dashboard.json?panel=absent")),
+        (20, "reports", _get("/reports")),
+    ]},
+    "monthly_report": {"concurrency": 5, "admin": True, "mix": [
+        (70, "monthly_report", _monthly),
+        (30, "export csv", _get("/monthly_report/export?format=csv")),
+    ]},
+}
+
+
+# ─────────────── runner ───────────────
+def _encode(method, path, host, body, cookie):
+    headers = [f"{method} {path} HTTP/1.1", f"Host: {host}"]
+    if isinstance(body, dict):
+        payload = json.dumps(body).encode()
+        headers.append("Content-Type: application/json")
+    elif isinstance(body, str):
+        payload = body.encode()
+        headers.append("Content-Type: application/x-www-form-urlencoded")
+    else:
+        payload = b""
+    if cookie:
+        headers.append(f"Cookie: {cookie}")
+    headers.append(f"Content-Length: {len(payload)}")
+    return ("\r\n".join(headers) + "\r\n\r\n").encode() + payload
+
+
+async def admin_cookie(host, port):
+    """Log in as the seeded admin and return the session cookie."""
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        form = urlencode({"role": "admin", "username": "loadtest",
+                          "password": LOADTEST_PASSWORD})
+        writer.write(_encode("POST", "/login", host, form, None))
+        await writer.drain()
+        status, headers, _ = await _read_response(reader)
+    finally:
+        writer.close()
+    cookie = headers.get("set-cookie", "").split(";")[0]
+    if status != 302 or not cookie:
+        raise SystemExit("admin login failed; was the database seeded?")
+    return cookie
+
+
+async def _client(host, port, picks, ctx, rng, cookie, measure_from, deadline, records, errors):
+    reader = writer = None
+    for label, make in picks:
+        if time.monotonic() >= deadline:
+            break
+        method, path, body = make(rng, ctx)
+        request = _encode(method, path, host, body, cookie)
+        started = time.perf_counter()
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection(host, port)
+            writer.write(request)
+            await writer.drain()
+            status, headers, close = await _read_response(reader)
+        except (OSError, ConnectionError, asyncio.IncompleteReadError, ValueError):
+            errors["io"] += 1
+            if writer is not None:
+                writer.close()
+            reader = writer = None
+            continue
+        if time.monotonic() >= measure_from:
+            trips = headers.get("x-db-round-trips")
+            records.append((label, time.perf_counter() - started, status,
+                            int(trips) if trips is not None else None))
+        if close:
+            writer.close()
+            reader = writer = None
+    if writer is not None:
+        writer.close()
+
+
+def _summary(records, elapsed):
+    # a 4xx (a 429 above all) is fast because nothing was done: not throughput
+    served = [r for r in records if not 400 <= r[2] < 500]
+    latencies = sorted(r[1] for r in served)
+    trips = [r[3] for r in served if r[3] is not None]
+    statuses = {}
+    for r in records:
+        statuses[str(r[2])] = statuses.get(str(r[2]), 0) + 1
+    return {
+        "requests": len(records),
+        "rejected": len(records) - len(served),
+        "rate_limited": statuses.get("429", 0),
+        "rps": round(len(served) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "db_trips_per_request": round(sum(trips) / len(trips), 2) if trips else None,
+        "status": statuses,
+    }
+
+
+async def run_scenario(url, name, ctx, duration, warmup, concurrency=None, seed_value=0):
+    spec = SCENARIOS[name]
+    parts = urlsplit(url)
+    host, port = parts.hostname, parts.port or 80
+    cookie = await admin_cookie(host, port) if spec["admin"] else None
+    concurrency = concurrency or spec["concurrency"]
+    if spec.get("punches"):
+        clear_today()
+        employees = list(ctx["employees"])
+        random.Random(seed_value).shuffle(employees)
+        ctx = dict(ctx, to_punch_in=collections.deque(employees),
+                   punched_in=collections.deque())
+    weights = [w for w, _, _ in spec["mix"]]
+    routes = [(label, fn) for _, label, fn in spec["mix"]]
+
+    records, errors = [], {"io": 0}
+    measure_from = time.monotonic() + warmup
+    deadline = measure_from + duration
+    clients = []
+    for n in range(concurrency):
+        rng = random.Random(seed_value * 100_003 + n)
+        picks = (rng.choices(routes, weights)[0] for _ in itertools.count())
+        clients.append(_client(host, port, picks, ctx, rng, cookie,
+                               measure_from, deadline, records, errors))
+    await asyncio.gather(*clients)
+    elapsed = time.monotonic() - measure_from
+
+    result = _summary(records, elapsed)
+    result["concurrency"] = concurrency
+    result["errors"] = errors["io"] + sum(v for k, v in result["status"].items()
+                                          if k.startswith("5"))
+    by_route = {}
+    for label, _ in routes:
+        mine = [r for r in records if r[0] == label]
+        if mine:
+            by_route[label] = _summary(mine, elapsed)
+    result["routes"] = by_route
+    return result
+
+
+# ─────────────── baseline comparison ───────────────
+def compare(baseline, current, rps_tolerance, latency_tolerance, trips_tolerance):
+    """[(scenario, route or None, message)] for every regression."""
+    found = []
+    for name, now in current.items():
+        then = baseline.get(name)
+        if not then:
+            continue
+        if then["rps"] and now["rps"] < then["rps"] * (1 - rps_tolerance):
+            found.append((name, None, f"throughput {then['rps']} → {now['rps']} rps"))
+        if then["p99_ms"] and now["p99_ms"] > then["p99_ms"] * (1 + latency_tolerance):
+            found.append((name, None, f"p99 {then['p99_ms']} → {now['p99_ms']} ms"))
+        if now["errors"] > then.get("errors", 0):
+            found.append((name, None, f"errors {then.get('errors', 0)} → {now['errors']}"))
+        for route, r_now in now["routes"].items():
+            r_then = then.get("routes", {}).get(route)
+            if not r_then:
+                continue
+            a, b = r_then.get("db_trips_per_request"), r_now.get("db_trips_per_request")
+            if a is not None and b is not None and b > a + trips_tolerance:
+                found.append((name, route, f"db round trips {a} → {b} per request"))
+    return found
+
+
+def rejected_runs(results, max_rejected):
+    """[(scenario, message)] for runs whose answers were mostly 4xx."""
+    found = []
+    for name, r in results.items():
+        if r["requests"] and r["rejected"] > r["requests"] * max_rejected:
+            found.append((name, f"{r['rejected']} of {r['requests']} answers were 4xx "
+                                f"({r['rate_limited']} rate limited)"))
+    return found
+
+
+def _print_table(results, out):
+    print(f"{'scenario / route':36} {'req':>7} {'4xx':>6} {'rps':>8} {'p50':>8} "
+          f"{'p95':>8} {'p99':>8} {'trips':>6}", file=out)
+    for name, r in results.items():
+        rows = [(name, r)] + [(f"  {k}", v) for k, v in r["routes"].items()]
+        for label, v in rows:
+            trips = v["db_trips_per_request"]
+            print(f"{label:36} {v['requests']:>7} {v['rejected']:>6} {v['rps']:>8} "
+                  f"{v['p50_ms']:>8} {v['p95_ms']:>8} {v['p99_ms']:>8} "
+                  f"{'-' if trips is None else trips:>6}", file=out)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p_seed = sub.add_parser("seed", help="wipe and fill the database with synthetic data")
+    p_seed.add_argument("--employees", type=int, default=2000)
+    p_seed.add_argument("--days", type=int, default=90)
+    p_seed.add_argument("--reset", action="store_true",
+                        help="required: confirms the application tables may be wiped")
+
+    p_run = sub.add_parser("run", help="replay traffic mixes against a running server")
+    p_run.add_argument("--url", default="http://127.0.0.1:8000")
+    p_run.add_argument("--scenario", default="all",
+                       help="all or a comma list of " + ", ".join(SCENARIOS))
+    p_run.add_argument("--duration", type=float, default=15)
+    p_run.add_argument("--warmup", type=float, default=3)
+    p_run.add_argument("--concurrency", type=int, help="override every scenario's default")
+    p_run.add_argument("--seed", type=int, default=0, help="request-mix random seed")
+    p_run.add_argument("--out", help="write results JSON here")
+    p_run.add_argument("--baseline", help="compare against this results JSON")
+    p_run.add_argument("--save-baseline", help="write results as the new baseline")
+    p_run.add_argument("--rps-tolerance", type=float, default=0.15)
+    p_run.add_argument("--latency-tolerance", type=float, default=0.25)
+    p_run.add_argument("--trips-tolerance", type=float, default=0.25)
+    p_run.add_argument("--max-rejected", type=float, default=0.5,
+                       help="fail when more than this share of answers are 4xx")
+
+    args = parser.parse_args(argv)
+    if args.cmd == "seed":
+        if not args.reset:
+            parser.error("seed wipes employee/attendance/leaves/admin; pass --reset to confirm")
+        seed(args.employees, args.days)
+        return 0
+
+    names = list(SCENARIOS) if args.scenario == "all" else args.scenario.split(",")
+    unknown = [n for n in names if n not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenario: {', '.join(unknown)}")
+    ctx = load_context()
+    results = {}
+    for name in names:
+        results[name] = asyncio.run(run_scenario(
+            args.url, name, ctx, args.duration, args.warmup,
+            args.concurrency, args.seed))
+    _print_table(results, sys.stdout)
+
+    rejected = rejected_runs(results, args.max_rejected)
+    for name, msg in rejected:
+        print(f"REJECTED  {name}: {msg}; is the server rate limiting "
+              f"(RATE_LIMIT_BACKEND=off)?")
+    # a rejected run is no baseline
+    for path in (args.out, None if rejected else args.save_baseline):
+        if path:
+            with open(path, "w") as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+    if rejected:
+        return 1
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, results, args.rps_tolerance,
+                              args.latency_tolerance, args.trips_tolerance)
+        for name, route, msg in regressions:
+            print(f"REGRESSION  {name}{' / ' + route if route else ''}: {msg}")
+        if regressions:
+            return 1
+        print("no regressions against", args.baseline)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
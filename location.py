@@ -0,0 +1,177 @@
+import csv
+import ipaddress
+import math
+import os
+import threading
+import time
+
+# LOCATION_RESOLVER picks the backend used when a punch arrives without GPS:
+#   geocoder  – server IP lookup via geocoder, cached & refreshed off-request
+#   static    – fixed "City|lat|lng" from LOCATION_STATIC
+#   iprange   – client IP matched against a local CIDR table (LOCATION_IP_TABLE)
+#   fallback  – always "Unknown|0.0000|0.0000" (tests / offline)
+LOCATION_RESOLVER = os.getenv("LOCATION_RESOLVER", "geocoder")
+LOCATION_TTL = float(os.getenv("LOCATION_TTL", "3600"))
+
+
+def format_location(city, lat, lng):
+    return f"{city or 'Unknown'}|{lat or 0.0:.4f}|{lng or 0.0:.4f}"
+
+
+class FallbackResolver:
+    """Never looks anything up."""
+
+    def resolve(self, client_ip=None):
+        return format_location("Unknown", 0.0, 0.0)
+
+
+class StaticResolver:
+    """Fixed site location, e.g. LOCATION_STATIC='Chennai|13.0827|80.2707'."""
+
+    def __init__(self, spec=None):
+        spec = spec or os.getenv("LOCATION_STATIC", "Unknown|0|0")
+        city, lat, lng = (spec.split("|") + ["0", "0"])[:3]
+        self.location = format_location(city, float(lat), float(lng))
+
+    def resolve(self, client_ip=None):
+        return self.location
+
+
+class IPRangeResolver:
+    """Offline lookup of the client IP in a CSV of cidr,city,lat,lng rows."""
+
+    def __init__(self, path=None, default=None):
+        self.default = default or FallbackResolver()
+        self.ranges = []
+        path = path or os.getenv("LOCATION_IP_TABLE")
+        if path and os.path.exists(path):
+            with open(path, newline="") as fh:
+                for row in csv.reader(fh):
+                    if not row or row[0].startswith("#"):
+                        continue
+                    net = ipaddress.ip_network(row[0].strip(), strict=False)
+                    self.ranges.append(
+                        (net, format_location(row[1].strip(), float(row[2]), float(row[3])))
+                    )
+            # most specific network wins
+            self.ranges.sort(key=lambda r: r[0].prefixlen, reverse=True)
+
+    def resolve(self, client_ip=None):
+        if client_ip:
+            try:
+                ip = ipaddress.ip_address(client_ip)
+            except ValueError:
+                ip = None
+            if ip is not None:
+                for net, location in self.ranges:
+                    if ip.version == net.version and ip in net:
+                        return location
+        return self.default.resolve(client_ip)
+
+
+class GeocoderResolver:
+    """Server IP geolocation, cached for `ttl` seconds.
+
+    resolve() never performs network I/O: it returns the cached value (or the
+    fallback before the first lookup completes) and refreshes in a daemon
+    thread once the entry goes stale.
+    """
+
+    def __init__(self, ttl=LOCATION_TTL, default=None):
+        self.ttl = ttl
+        self.default = default or FallbackResolver()
+        self._value = None
+        self._fetched_at = 0.0
+        self._refreshing = False
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        try:
+            import geocoder
+            geo = geocoder.ip("me")
+            lat, lng = (geo.latlng or [0.0, 0.0])
+            value = format_location(geo.city, lat, lng)
+        except Exception:
+            value = None
+        with self._lock:
+            if value:
+                self._value = value
+            self._fetched_at = time.monotonic()
+            self._refreshing = False
+
+    def warm(self):
+        with self._lock:
+            stale = time.monotonic() - self._fetched_at > self.ttl or self._value is None
+            if self._refreshing or not stale:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._refresh, daemon=True).start()
+
+    def resolve(self, client_ip=None):
+        self.warm()
+        return self._value or self.default.resolve(client_ip)
+
+
+_RESOLVERS = {
+    "geocoder": GeocoderResolver,
+    "static": StaticResolver,
+    "iprange": IPRangeResolver,
+    "fallback": FallbackResolver,
+}
+
+_resolver = None
+
+
+def get_resolver():
+    global _resolver
+    if _resolver is None:
+        _resolver = _RESOLVERS.get(LOCATION_RESOLVER, GeocoderResolver)()
+    return _resolver
+
+
+def set_resolver(resolver):
+    """Swap the active resolver (tests, custom site tables)."""
+    global _resolver
+    _resolver = resolver
+
+
+def resolve_location(client_ip=None):
+    return get_resolver().resolve(client_ip)
+
+
+class LocationError(ValueError):
+    """A client-sent GPS location that cannot be stored."""
+
+
+def parse_gps(raw):
+    """Client GPS → {latitude, longitude, address}, or None when none was sent.
+
+    latitude/longitude must be numbers (None counts as 0) within range and
+    address a string; anything else raises LocationError.
+    """
+    if not raw:
+        return None
+    if not isinstance(raw, dict):
+        raise LocationError("location must be an object")
+    gps = {}
+    for field, bound in (("latitude", 90.0), ("longitude", 180.0)):
+        value = raw.get(field)
+        value = 0.0 if value is None else value
+        if isinstance(value, bool) or not isinstance(value, (int, float)) \
+                or not math.isfinite(value) or abs(value) > bound:
+            raise LocationError(f"location.{field} must be a number within ±{bound:g}")
+        gps[field] = float(value)
+    address = raw.get("address")
+    if address is not None and not isinstance(address, str):
+        raise LocationError("location.address must be a string")
+    gps["address"] = "Unknown" if address is None else address
+    return gps
+
+
+def punch_location(gps_location=None, client_ip=None):
+    """Location string stored on a punch: device GPS if sent, else resolver."""
+    gps = parse_gps(gps_location)
+    if gps:
+        return f"{gps['address']}|{gps['latitude']:.6f}|{gps['longitude']:.6f}"
+    # cached / offline lookup – never does network I/O on the request
+    return resolve_location(client_ip)
@@ -0,0 +1,144 @@
+"""Opt-in request instrumentation (REQUEST_METRICS=1).
+
+app.py's before/after-request hooks time every request and pick up the
+query count, rows fetched and SQL time that db.CountingCursor tallies for
+the request's thread. Totals are kept per endpoint and rendered in the
+Prometheus text format by /metrics. Each gunicorn worker keeps its own
+registry and labels its samples with its pid, so scrape every worker or
+sum by endpoint.
+
+Requests slower than SLOW_REQUEST_MS are logged with their DB numbers.
+With PROFILE_TOKEN set, a request carrying `X-Profile: <token>` runs under
+cProfile; the stats go to PROFILE_DIR and the file name comes back in
+X-Profile-File (read with `python -m pstats`).
+"""
+import cProfile
+import hmac
+import logging
+import os
+import threading
+import time
+
+REQUEST_METRICS = os.getenv("REQUEST_METRICS", "0") == "1"
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "1000"))
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+PROFILE_DIR = os.getenv("PROFILE_DIR", "/tmp/attendance-profiles")
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+log = logging.getLogger("metrics")
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = {}      # (endpoint, method, status) -> count
+        self.latency = {}       # endpoint -> [bucket counts..., +Inf count, sum]
+        self.db = {}            # endpoint -> [queries, rows, sql seconds, round trips]
+
+    def observe(self, endpoint, method, status, seconds, qstats):
+        with self._lock:
+            key = (endpoint, method, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            hist = self.latency.get(endpoint)
+            if hist is None:
+                hist = self.latency[endpoint] = [0] * (len(BUCKETS) + 1) + [0.0]
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    hist[i] += 1
+            hist[len(BUCKETS)] += 1
+            hist[-1] += seconds
+            db = self.db.setdefault(endpoint, [0, 0, 0.0, 0])
+            db[0] += qstats.queries
+            db[1] += qstats.rows
+            db[2] += qstats.sql_time
+            db[3] += qstats.trips
+
+    def snapshot(self):
+        with self._lock:
+            return (dict(self.requests),
+                    {k: list(v) for k, v in self.latency.items()},
+                    {k: list(v) for k, v in self.db.items()})
+
+
+registry = Registry()
+
+
+def observe_request(endpoint, method, status, seconds, qstats):
+    registry.observe(endpoint, method, status, seconds, qstats)
+    if SLOW_REQUEST_MS and seconds * 1000 >= SLOW_REQUEST_MS:
+        log.warning("slow request %s %s %.1f ms: %d queries, %d rows, %.1f ms in SQL",
+                    method, endpoint, seconds * 1000, qstats.queries, qstats.rows,
+                    qstats.sql_time * 1000)
+
+
+# ─────────────── Prometheus text format ───────────────
+def _labels(**kw):
+    inner = ",".join(f'{k}="{str(v)}"' for k, v in kw.items())
+    return "{" + inner + "}"
+
+
+def render(gauges=()):
+    """Exposition text; gauges are extra (name, help, value) samples."""
+    pid = os.getpid()
+    requests, latency, db = registry.snapshot()
+    out = []
+
+    out.append("# HELP attendance_http_requests_total Requests by endpoint, method and status.")
+    out.append("# TYPE attendance_http_requests_total counter")
+    for (endpoint, method, status), n in sorted(requests.items()):
+        out.append("attendance_http_requests_total"
+                   f"{_labels(endpoint=endpoint, method=method, status=status, pid=pid)} {n}")
+
+    out.append("# HELP attendance_http_request_duration_seconds Wall time per request.")
+    out.append("# TYPE attendance_http_request_duration_seconds histogram")
+    for endpoint, hist in sorted(latency.items()):
+        for bound, n in zip(BUCKETS, hist):
+            out.append("attendance_http_request_duration_seconds_bucket"
+                       f"{_labels(endpoint=endpoint, le=bound, pid=pid)} {n}")
+        total = hist[len(BUCKETS)]
+        out.append("attendance_http_request_duration_seconds_bucket"
+                   f"{_labels(endpoint=endpoint, le='+Inf', pid=pid)} {total}")
+        out.append("attendance_http_request_duration_seconds_sum"
+                   f"{_labels(endpoint=endpoint, pid=pid)} {hist[-1]:.6f}")
+        out.append("attendance_http_request_duration_seconds_count"
+                   f"{_labels(endpoint=endpoint, pid=pid)} {total}")
+
+    for i, (name, help_text) in enumerate((
+        ("attendance_db_queries_total", "Statements executed, by endpoint."),
+        ("attendance_db_rows_total", "Rows fetched, by endpoint."),
+        ("attendance_db_seconds_total", "Seconds spent waiting on Postgres, by endpoint."),
+        ("attendance_db_round_trips_total", "Database round trips, by endpoint."),
+    )):
+        out.append(f"# HELP {name} {help_text}")
+        out.append(f"# TYPE {name} counter")
+        for endpoint, values in sorted(db.items()):
+            value = f"{values[i]:.6f}" if isinstance(values[i], float) else values[i]
+            out.append(f"{name}{_labels(endpoint=endpoint, pid=pid)} {value}")
+
+    for name, help_text, value in gauges:
+        out.append(f"# HELP {name} {help_text}")
+        out.append(f"# TYPE {name} gauge")
+        out.append(f"{name}{_labels(pid=pid)} {value}")
+    return "\n".join(out) + "\n"
+
+
+# ─────────────── one-off cProfile ───────────────
+def profile_requested(header_value):
+    return bool(PROFILE_TOKEN and header_value
+                and hmac.compare_digest(header_value, PROFILE_TOKEN))
+
+
+def start_profile():
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+
+def dump_profile(profiler, endpoint):
+    profiler.disable()
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR,
+                        f"{endpoint}-{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}.prof")
+    profiler.dump_stats(path)
+    return path
@@ -0,0 +1,407 @@
+"""ASGI entry point: async mobile JSON API, everything else via Flask.
+
+    uvicorn mobile_asgi:asgi --workers 2 --port 8000
+
+/login_pin, /mobile/punch, /mobile/history, /mobile/whoami and /profile are
+served here on an asyncpg pool, so one worker keeps hundreds of slow mobile
+clients in flight instead of one per sync gunicorn worker. /admin/stream
+(the dashboard's live roster) is a long-lived SSE response and is served
+here for the same reason. The HTML admin
+pages and every other route fall through to the unchanged Flask app (run in
+a thread pool by a2wsgi). Responses match the Flask routes field for field,
+and the identity caches, their SQL, the rate limiter and the metrics
+registry are the same objects, so add/delete employee and the NOTIFY
+listener invalidate both paths and /metrics counts both.
+"""
+import json
+import os
+from contextlib import asynccontextmanager
+from functools import wraps
+from time import perf_counter
+
+import asyncpg
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from itsdangerous import BadSignature
+from starlette.responses import (
+    JSONResponse, RedirectResponse, Response, StreamingResponse
+)
+from starlette.routing import Mount, Route
+
+from db import POOL_MAX, POOL_MIN, QueryStats
+from identity_cache import PIN_SQL, PROFILE_SQL, identity
+from location import LocationError, parse_gps, punch_location
+import app as wsgi
+import history
+import metrics
+import ratelimit
+import roster_feed
+import tokens
+
+_MISSING = object()
+
+
+def _dollar(sql):
+    """psycopg2 %s placeholders → asyncpg $1..$n."""
+    parts = sql.split("%s")
+    out = [parts[0]]
+    for n, part in enumerate(parts[1:], 1):
+        out.append(f"${n}{part}")
+    return "".join(out)
+
+
+_PUNCH_SQL = {wsgi.PUNCH_IN_SQL: _dollar(wsgi.PUNCH_IN_SQL),
+              wsgi.PUNCH_OUT_SQL: _dollar(wsgi.PUNCH_OUT_SQL)}
+_PIN_SQL = _dollar(PIN_SQL)
+_PROFILE_SQL = _dollar(PROFILE_SQL)
+
+_CORS_PREFLIGHT = {
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Headers": "Content-Type, Authorization",
+    "Access-Control-Allow-Methods": "POST, OPTIONS",
+}
+
+
+def _json(request, payload, status=200):
+    # same shape as flask-cors with origins="*" and credentials
+    origin = request.headers.get("origin")
+    headers = {"Access-Control-Allow-Origin": origin or "*"}
+    if origin:
+        headers["Access-Control-Allow-Credentials"] = "true"
+        headers["Vary"] = "Origin"
+    return JSONResponse(payload, status_code=status, headers=headers)
+
+
+async def _body(request):
+    try:
+        data = json.loads(await request.body() or b"{}")
+    except ValueError:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+# ─────────────── async identity lookups (shared caches) ───────────────
+async def lookup_pin(pool, pin):
+    identity.start_listener()
+    hit = identity.by_pin.get(pin, _MISSING)
+    if hit is not _MISSING:
+        return hit
+    gen = identity.invalidations
+    row = await pool.fetchrow(_PIN_SQL, pin, pin)
+    if row is None:
+        value = None
+    elif row[0] == "employee":
+        value = ("employee", (row[1], row[2], row[3]))
+    else:
+        value = ("admin", (row[1], row[2]))
+    if gen == identity.invalidations:
+        identity.by_pin.set(pin, value)
+    return value
+
+
+async def employee_by_pin(pool, pin):
+    hit = await lookup_pin(pool, pin)
+    return hit[1] if hit and hit[0] == "employee" else None
+
+
+def bearer_employee(request):
+    return tokens.employee_claims(request.headers.get("authorization"))
+
+
+async def issue_tokens(pool, role, row):
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            if tokens.sweep_due():
+                await conn.execute(tokens.SESSION_SWEEP)
+            refresh, params = tokens.new_session(role, row[0])
+            await conn.execute(_dollar(tokens.SESSION_INSERT), *params)
+    return tokens.token_pair(tokens.claims_for(role, row), refresh)
+
+
+async def profile_by_code(pool, emp_code):
+    identity.start_listener()
+    hit = identity.by_code.get(emp_code, _MISSING)
+    if hit is not _MISSING:
+        return hit
+    gen = identity.invalidations
+    row = await pool.fetchrow(_PROFILE_SQL, emp_code)
+    row = tuple(row) if row else None
+    if gen == identity.invalidations:
+        identity.by_code.set(emp_code, row)
+    return row
+
+
+# ─────────────── rate limits (before any pool acquire) ───────────────
+def _client_ip(request):
+    return ratelimit.client_ip(request.client.host if request.client else None,
+                               request.headers.get("x-forwarded-for"))
+
+
+def _client(request):
+    return _client_ip(request), request.headers.get(ratelimit.DEVICE_HEADER)
+
+
+async def over_limit(request, token_exempt=False):
+    """A 429 response when the client is over a limit, else None."""
+    limiter = ratelimit.limiter
+    pins = not (token_exempt and request.headers.get("authorization"))
+    if limiter.backend.remote:
+        retry = await run_in_threadpool(limiter.check, *_client(request), None, pins)
+    else:
+        retry = limiter.check(*_client(request), pins=pins)
+    if not retry:
+        return None
+    response = _json(request, {"success": False, "msg": "too many attempts, try later"}, 429)
+    response.headers["Retry-After"] = str(retry)
+    return response
+
+
+async def pin_failed(request):
+    limiter = ratelimit.limiter
+    if limiter.backend.remote:
+        await run_in_threadpool(limiter.failed, *_client(request))
+    else:
+        limiter.failed(*_client(request))
+
+
+# ─────────────── metrics (same registry and endpoint names as Flask) ───────────────
+def observed(handler):
+    """Time a route into metrics.registry under the Flask endpoint's name.
+    asyncpg queries are not tallied, so the DB columns stay at zero."""
+    @wraps(handler)
+    async def route(request):
+        if not metrics.REQUEST_METRICS:
+            return await handler(request)
+        started = perf_counter()
+        status = 500
+        try:
+            response = await handler(request)
+            status = response.status_code
+        finally:
+            elapsed = perf_counter() - started
+            metrics.observe_request(handler.__name__, request.method, status,
+                                    elapsed, QueryStats())
+        response.headers["Server-Timing"] = f"app;dur={elapsed * 1000:.1f}"
+        return response
+    return route
+
+
+# ─────────────── routes ───────────────
+async def login_pin(request):
+    if request.method == "OPTIONS":
+        return Response("", headers=_CORS_PREFLIGHT)
+    limited = await over_limit(request)
+    if limited:
+        return limited
+    data = await _body(request)
+    pin = str(data.get("pin", "")).strip()
+
+    pool = request.app.state.pool
+    hit = await lookup_pin(pool, pin)
+    role, row = hit if hit else (None, None)
+    if role == "employee":
+        return _json(request, {"success": True, "role": "employee",
+                               "user": {"id": row[0], "name": row[1], "emp_code": row[2]},
+                               **await issue_tokens(pool, role, row)})
+    if role == "admin":
+        return _json(request, {"success": True, "role": "admin",
+                               "user": {"id": row[0], "name": row[1]},
+                               **await issue_tokens(pool, role, row)})
+    await pin_failed(request)
+    return _json(request, {"success": False}, 401)
+
+
+async def punch_mobile(request):
+    limited = await over_limit(request, token_exempt=True)
+    if limited:
+        return limited
+    data = await _body(request)
+    pin = str(data.get("pin", "")).strip()
+    ptype = str(data.get("type", "")).lower()
+    client_ip = _client_ip(request)
+
+    if ptype not in ("in", "out"):
+        return _json(request, {"success": False, "msg": "type?"}, 400)
+    try:
+        gps_location = parse_gps(data.get("location"))
+    except LocationError as e:
+        return _json(request, {"success": False, "msg": str(e)}, 400)
+
+    pool = request.app.state.pool
+    try:
+        emp = bearer_employee(request) or await employee_by_pin(pool, pin)
+    except tokens.TokenError as e:
+        return _json(request, {"success": False, "msg": str(e)}, 401)
+    if not emp:
+        await pin_failed(request)
+        return _json(request, {"success": False, "msg": "bad pin"}, 400)
+
+    now = wsgi.get_ist_now()
+    nice_time = now.strftime("%I:%M %p")
+    if wsgi.PUNCH_QUEUE:
+        ticket = await run_in_threadpool(wsgi.punch_queue.enqueue, emp[0], ptype, now,
+                                         gps_location, client_ip)
+        return _json(request, {"success": True, "msg": "Queued", "queued": True,
+                               "ticket": ticket, "time": nice_time}, 202)
+
+    location = punch_location(gps_location, client_ip)
+    sql, params = wsgi.punch_params(emp[0], ptype, now, location)
+    row = await pool.fetchrow(_PUNCH_SQL[sql], *params)
+    ok = row is not None
+    if ok:
+        roster_feed.feed.touch(emp[0])
+    return _json(request, {"success": ok, "msg": "Saved" if ok else wsgi.PUNCH_FAILURE[ptype],
+                           "time": nice_time, "location": location},
+                 200 if ok else 400)
+
+
+async def mobile_history(request):
+    emp_id = request.path_params["emp_id"]
+    try:
+        emp = bearer_employee(request)
+    except tokens.TokenError as e:
+        return _json(request, {"success": False, "message": str(e)}, 401)
+    if emp and emp[0] != emp_id:
+        return _json(request, {"success": False, "message": "not your history"}, 403)
+    try:
+        opts = history.parse_args(request.query_params)
+    except history.HistoryError as e:
+        return _json(request, {"success": False, "message": str(e)}, 400)
+
+    pool = request.app.state.pool
+    if request.query_params.get("stream") == "1":
+        return StreamingResponse(_stream_history(pool, emp_id, opts),
+                                 media_type="application/x-ndjson")
+
+    async with pool.acquire() as conn:
+        watermark = await conn.fetchval("SELECT now()")
+        sql, params = history.attendance_query(emp_id, opts)
+        rows = await conn.fetch(_dollar(sql), *params)
+        leave_rows = []
+        if not opts["before"]:
+            sql, params = history.leave_query(emp_id, opts, limit=history.LEAVE_LIMIT + 1)
+            leave_rows = await conn.fetch(_dollar(sql), *params)
+    rows, leave_rows, next_cursor, leave_more = history.split_page(rows, leave_rows, opts)
+
+    return _json(request, {
+        "attendance": [wsgi._history_attendance(r) for r in rows],
+        "leave": [wsgi._history_leave(r) for r in leave_rows],
+        "has_more": next_cursor is not None,
+        "next_cursor": history.cursor_str(next_cursor),
+        "leave_has_more": leave_more,
+        "watermark": history.cursor_str(watermark),
+    })
+
+
+async def _stream_history(pool, emp_id, opts):
+    async with pool.acquire() as conn:
+        async with conn.transaction():      # asyncpg cursors need one
+            watermark = await conn.fetchval("SELECT now()")
+            sql, params = history.attendance_query(emp_id, opts, paginate=False)
+            lines = []
+            async for r in conn.cursor(_dollar(sql), *params, prefetch=history.STREAM_CHUNK):
+                lines.append(json.dumps({"type": "attendance", **wsgi._history_attendance(r)}))
+                if len(lines) >= history.STREAM_CHUNK:
+                    yield "\n".join(lines) + "\n"
+                    lines = []
+            sql, params = history.leave_query(emp_id, opts, limit=None)
+            async for r in conn.cursor(_dollar(sql), *params):
+                lines.append(json.dumps({"type": "leave", **wsgi._history_leave(r)}))
+            if lines:
+                yield "\n".join(lines) + "\n"
+    yield json.dumps({"type": "end", "watermark": history.cursor_str(watermark)}) + "\n"
+
+
+async def mobile_whoami(request):
+    limited = await over_limit(request, token_exempt=True)
+    if limited:
+        return limited
+    pin = request.path_params.get("pin")
+    try:
+        emp = bearer_employee(request) or (
+            await employee_by_pin(request.app.state.pool, pin) if pin else None)
+    except tokens.TokenError:
+        return _json(request, {"success": False}, 401)
+    if not emp:
+        if pin:
+            await pin_failed(request)
+        return _json(request, {"success": False}, 404)
+    return _json(request, {"success": True, "id": emp[0], "name": emp[1],
+                           "emp_code": emp[2] if len(emp) > 2 else None})
+
+
+async def get_profile(request):
+    if request.method == "OPTIONS":
+        return Response("", headers=_CORS_PREFLIGHT)
+    limited = await over_limit(request)
+    if limited:
+        return limited
+    data = await _body(request)
+    emp_code = str(data.get("emp_code", "")).strip()
+    if not emp_code:
+        return _json(request, {"success": False, "message": "emp_code required"}, 400)
+
+    row = await profile_by_code(request.app.state.pool, emp_code)
+    if not row:
+        return _json(request, {"success": False, "message": "Employee not found"}, 404)
+    return _json(request, {"success": True, "user": {
+        "id": row[0],
+        "name": row[1],
+        "emp_code": row[2],
+        "email": row[3] or "N/A",
+        "phone": row[4] or "N/A",
+        "department": row[5] or "N/A",
+        "designation": row[6] or "N/A",
+    }})
+
+
+def _session_admin(request):
+    """Admin id from the Flask session cookie, verified with the app's key."""
+    raw = request.cookies.get(wsgi.app.config["SESSION_COOKIE_NAME"])
+    serializer = wsgi.app.session_interface.get_signing_serializer(wsgi.app)
+    if not raw or serializer is None:
+        return None
+    max_age = int(wsgi.app.permanent_session_lifetime.total_seconds())
+    try:
+        return serializer.loads(raw, max_age=max_age).get("admin")
+    except BadSignature:
+        return None
+
+
+async def admin_stream(request):
+    # one task per open dashboard instead of one thread
+    if not _session_admin(request):
+        return RedirectResponse("/login", 302)
+    return StreamingResponse(roster_feed.feed.astream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+# ─────────────── app ───────────────
+@asynccontextmanager
+async def lifespan(app):
+    app.state.pool = await asyncpg.create_pool(
+        os.getenv("DATABASE_URL"),
+        ssl=os.getenv("DB_SSLMODE", "require"),
+        min_size=POOL_MIN,
+        max_size=int(os.getenv("ASYNC_POOL_MAX", POOL_MAX)),
+    )
+    try:
+        yield
+    finally:
+        await app.state.pool.close()
+
+
+asgi = Starlette(
+    routes=[
+        Route("/login_pin", observed(login_pin), methods=["POST", "OPTIONS"]),
+        Route("/mobile/punch", observed(punch_mobile), methods=["POST"]),
+        Route("/mobile/history/{emp_id:int}", observed(mobile_history), methods=["GET"]),
+        Route("/mobile/whoami", observed(mobile_whoami), methods=["GET"]),
+        Route("/mobile/whoami/{pin}", observed(mobile_whoami), methods=["GET"]),
+        Route("/profile", observed(get_profile), methods=["POST", "OPTIONS"]),
+        Route("/admin/stream", observed(admin_stream), methods=["GET"]),
+        Mount("/", app=WSGIMiddleware(wsgi.app)),
+    ],
+    lifespan=lifespan,
+)
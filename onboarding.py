@@ -0,0 +1,259 @@
+"""Bulk employee import and collision-free PIN allocation.
+
+PINs are PIN_DIGITS-digit strings, unique across employees (employee_pin_key)
+and never equal to an admin PIN. A PinPool takes a transaction-level
+advisory lock, reads every PIN in use once into a bitmap and hands out free
+ones drawn with `secrets`: a thousand-row import costs one query for its
+PINs, concurrent imports and add_employee never draw the same PIN, and the
+unique index backs that up.
+
+check_rows() enforces IMPORT_MAX_ROWS and validates every row (required
+fields, emp_code unique within the file, explicit PINs well-formed);
+hash_passwords() then hashes the passwords of the rows that passed
+(credentials.hash_many) before the transaction opens, so a rejected file or
+row costs no hashing. import_employees() checks what needs the table
+(emp_code and PIN free), writes the valid rows with one multi-row INSERT and
+reports per row: created (id, pin) or why the row was skipped. A PIN taken
+between the pool read and the INSERT (a writer outside the lock) is re-drawn,
+or reported when the file chose it.
+"""
+import csv
+import io
+import os
+import secrets
+
+import psycopg2.errors
+from psycopg2.extras import execute_values
+
+import credentials
+
+PIN_DIGITS = int(os.getenv("PIN_DIGITS", "4"))          # 4–6: the bitmap is 10^n bytes
+IMPORT_MAX_ROWS = int(os.getenv("IMPORT_MAX_ROWS", "10000"))
+PIN_RETRIES = 2         # re-draws when a PIN is taken under the import
+
+FIELDS = ("name", "emp_code", "password", "pin", "email", "phone",
+          "department", "designation")
+REQUIRED = ("name", "emp_code")
+RESULT_FIELDS = ("index", "emp_code", "name", "success", "message", "id", "pin")
+
+_PIN_LOCK = 7_140_813   # serializes PIN allocation, cluster-wide
+_rng = secrets.SystemRandom()
+
+# employee_pin_key and the duplicate check before it: migrations.py 009
+
+
+class OnboardingError(ValueError):
+    """An import (or one of its rows) failed validation."""
+
+
+# ─────────────── PIN allocation ───────────────
+class PinPool:
+    """The free PINs as of now, for the caller's transaction.
+
+    The advisory lock is held until that transaction ends, so commit soon
+    after drawing.
+    """
+
+    def __init__(self, cur, digits=PIN_DIGITS):
+        self.digits = digits
+        self.space = 10 ** digits
+        cur.execute("SELECT pg_advisory_xact_lock(%s)", (_PIN_LOCK,))
+        cur.execute("""
+            SELECT pin FROM employee WHERE pin IS NOT NULL
+            UNION
+            SELECT pin FROM admin WHERE pin IS NOT NULL
+        """)
+        self._used = bytearray(self.space)
+        for (pin,) in cur.fetchall():
+            slot = self._slot(pin)
+            if slot is not None:
+                self._used[slot] = 1
+        self.free = self.space - self._used.count(1)
+
+    def _slot(self, pin):
+        pin = str(pin)
+        return int(pin) if len(pin) == self.digits and pin.isdigit() else None
+
+    def claim(self, pin):
+        """Reserve a PIN chosen by the caller; False if it is taken."""
+        slot = self._slot(pin)
+        if slot is None or self._used[slot]:
+            return False
+        self._used[slot] = 1
+        self.free -= 1
+        return True
+
+    def draw(self, n):
+        """n unused PINs, uniformly at random."""
+        if n > self.free:
+            raise OnboardingError(f"only {self.free} unused {self.digits}-digit PINs left")
+        if n * 4 < self.free:
+            # sparse: random slots, retrying the (rare) taken ones
+            slots = []
+            while len(slots) < n:
+                slot = _rng.randrange(self.space)
+                if not self._used[slot]:
+                    self._used[slot] = 1
+                    slots.append(slot)
+        else:
+            slots = _rng.sample([i for i in range(self.space) if not self._used[i]], n)
+            for slot in slots:
+                self._used[slot] = 1
+        self.free -= n
+        return [f"{slot:0{self.digits}d}" for slot in slots]
+
+
+# ─────────────── parsing ───────────────
+def parse_csv(text):
+    """CSV with a header row (any order, case-insensitive) → list of dicts."""
+    reader = csv.DictReader(io.StringIO(text.lstrip("﻿")))
+    header = [(h or "").strip().lower() for h in reader.fieldnames or ()]
+    missing = [f for f in REQUIRED if f not in header]
+    if missing:
+        raise OnboardingError(f"CSV header must include {', '.join(missing)}")
+    reader.fieldnames = header
+    return [row for row in reader if any((v or "").strip() for v in row.values()
+                                         if isinstance(v, str))]
+
+
+def parse_json(data):
+    employees = (data or {}).get("employees")
+    if not isinstance(employees, list):
+        raise OnboardingError("employees must be a list")
+    return employees
+
+
+def _clean(raw):
+    if not isinstance(raw, dict):
+        raise OnboardingError("row must be an object")
+    row = {}
+    for field in FIELDS:
+        value = raw.get(field)
+        value = "" if value is None else str(value).strip()
+        row[field] = value or None
+    for field in REQUIRED:
+        if not row[field]:
+            raise OnboardingError(f"{field} required")
+    if row["pin"] and not (row["pin"].isdigit() and len(row["pin"]) == PIN_DIGITS):
+        raise OnboardingError(f"pin must be {PIN_DIGITS} digits")
+    return row
+
+
+def check_rows(raw_rows):
+    """(results, rows): a result per raw row – None while it is still valid –
+    and the valid rows as (index, cleaned row)."""
+    if len(raw_rows) > IMPORT_MAX_ROWS:
+        raise OnboardingError(f"at most {IMPORT_MAX_ROWS} rows per import")
+    results, rows = [], []
+    first_code = {}
+    for idx, raw in enumerate(raw_rows):
+        try:
+            row = _clean(raw)
+            if row["emp_code"] in first_code:
+                raise OnboardingError(f"emp_code repeats row {first_code[row['emp_code']]}")
+        except OnboardingError as e:
+            raw = raw if isinstance(raw, dict) else {}
+            results.append(_result(idx, raw, False, str(e)))
+            continue
+        first_code[row["emp_code"]] = idx
+        results.append(None)
+        rows.append((idx, row))
+    return results, rows
+
+
+def hash_passwords(checked):
+    """Replace each valid row's password with its hash, in place (before
+    import_employees)."""
+    rows = [row for _, row in checked[1] if row["password"]]
+    hashes = credentials.hash_many([row["password"] for row in rows])
+    for row, hashed in zip(rows, hashes):
+        row["password"] = hashed
+
+
+# ─────────────── import ───────────────
+def import_employees(cur, checked):
+    """Create employees from check_rows() output; one result per row, in order.
+
+    Rows without a pin get one from the pool. Caller commits (promptly: the
+    PIN lock is held until then).
+    """
+    results, rows = checked
+    results = list(results)
+    cur.execute("SELECT emp_code FROM employee WHERE emp_code = ANY(%s)",
+                ([r["emp_code"] for _, r in rows],))
+    existing = {r[0] for r in cur.fetchall()}
+
+    pool = PinPool(cur)
+    accepted = []
+    for idx, row in rows:
+        if row["emp_code"] in existing:
+            results[idx] = _result(idx, row, False, "emp_code already exists")
+        elif row["pin"] and not pool.claim(row["pin"]):
+            results[idx] = _result(idx, row, False, "pin already in use")
+        else:
+            accepted.append((idx, row))
+    drawn = {idx for idx, row in accepted if not row["pin"]}
+    need = [row for idx, row in accepted if idx in drawn]
+    for row, pin in zip(need, pool.draw(len(need))):
+        row["pin"] = pin
+
+    created = {}
+    for attempt in range(PIN_RETRIES + 1):
+        if not accepted:
+            break
+        cur.execute("SAVEPOINT import_rows")
+        try:
+            # (emp_code) DO NOTHING: a row that lost a race with another
+            # writer is reported, not fatal to the rest
+            created = dict(execute_values(cur, f"""
+                INSERT INTO employee ({', '.join(FIELDS)})
+                VALUES %s
+                ON CONFLICT (emp_code) DO NOTHING
+                RETURNING emp_code, id
+            """, [tuple(row[f] for f in FIELDS) for _, row in accepted],
+                page_size=len(accepted), fetch=True))
+            cur.execute("RELEASE SAVEPOINT import_rows")
+            break
+        except psycopg2.errors.UniqueViolation as e:
+            cur.execute("ROLLBACK TO SAVEPOINT import_rows")
+            if e.diag.constraint_name != "employee_pin_key" or attempt == PIN_RETRIES:
+                raise
+            # a writer outside the PIN lock took one of our PINs since the
+            # pool was read
+            accepted = _repin(cur, accepted, drawn, results)
+
+    for idx, row in accepted:
+        emp_id = created.get(row["emp_code"])
+        results[idx] = (_result(idx, row, True, "Created", id=emp_id, pin=row["pin"])
+                        if emp_id else _result(idx, row, False, "emp_code already exists"))
+    return results
+
+
+def _repin(cur, accepted, drawn, results):
+    """accepted minus the rows whose own PIN is now taken (reported), with
+    fresh PINs for drawn ones that are."""
+    pool = PinPool(cur)
+    keep, redraw = [], []
+    for idx, row in accepted:
+        if pool.claim(row["pin"]):
+            keep.append((idx, row))
+        elif idx in drawn:
+            redraw.append((idx, row))
+        else:
+            results[idx] = _result(idx, row, False, "pin already in use")
+    for (_, row), pin in zip(redraw, pool.draw(len(redraw))):
+        row["pin"] = pin
+    return sorted(keep + redraw, key=lambda a: a[0])
+
+
+def _result(idx, row, success, message, **extra):
+    return {"index": idx, "emp_code": row.get("emp_code"), "name": row.get("name"),
+            "success": success, "message": message, **extra}
+
+
+def results_csv(results):
+    out = io.StringIO()
+    writer = csv.DictWriter(out, RESULT_FIELDS, extrasaction="ignore")
+    writer.writeheader()
+    writer.writerows(results)
+    return out.getvalue()
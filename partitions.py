@@ -0,0 +1,229 @@
+"""Monthly partitions for attendance, with a compressed archive for old months.
+
+attendance is PARTITION BY RANGE (date): one attendance_pYYYYMM per month
+plus attendance_pdefault, which catches writes for a month that has no
+partition (a leave booked far ahead, a late correction to an archived day)
+so no insert ever fails on a missing partition.
+
+maintain() – run every PARTITION_MAINTENANCE_HOURS by one worker, or from
+cron with `python partitions.py maintain` – keeps PARTITION_AHEAD_MONTHS of
+future partitions attached, moves default-partition rows into their month,
+and archives every month older than ARCHIVE_AFTER_MONTHS (0: never):
+
+    attendance_archive  one row per month per block of ARCHIVE_BLOCK
+                        employees, one array per column – large enough for
+                        TOAST to compress (a 42k-row month: ~8 MB hot,
+                        ~1 MB archived), small enough that one employee's
+                        month is a few kB to decompress
+
+Archiving writes the archive row, then DETACHes and drops the partition, so
+no row triggers fire and the rollups stay as they were. Rows that show up
+for an archived month later are merged into its archive row on the next
+run (the live row wins).
+
+Readers see both tiers through attendance_range(first_day, last_day): an
+inlinable SQL function that is a plain partition-pruned scan when the range
+is hot and adds the archived months only when the range reaches into them.
+The mobile history keyset query reads the archive only once a page runs
+past the hot rows (see history.attendance_query).
+
+    python partitions.py maintain   # add / sweep / archive now
+    python partitions.py status     # partitions and archived months
+"""
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from datetime import date
+
+from db import open_connection
+
+PARTITION_AHEAD_MONTHS = int(os.getenv("PARTITION_AHEAD_MONTHS", "3"))
+ARCHIVE_AFTER_MONTHS = int(os.getenv("ARCHIVE_AFTER_MONTHS", "24"))
+PARTITION_MAINTENANCE_HOURS = float(os.getenv("PARTITION_MAINTENANCE_HOURS", "6"))
+# DETACH needs a brief exclusive lock on attendance: give up rather than
+# queue every punch behind a long report, and retry on the next run
+PARTITION_LOCK_TIMEOUT = os.getenv("PARTITION_LOCK_TIMEOUT", "5s")
+
+log = logging.getLogger("partitions")
+
+_LOCK_KEY = 7_140_812   # one maintainer at a time, cluster-wide
+_PARTITION = re.compile(r"^attendance_p(\d{4})(\d{2})$")
+
+# archive rows hold emp_id / ARCHIVE_BLOCK; fixed once anything is archived
+# (migrations.py 008 has it written into the archive function)
+ARCHIVE_BLOCK = 32
+
+# attendance columns, each an array in the archive
+COLUMNS = ("id", "emp_id", "date", "time_in", "time_out", "location_in",
+           "location_out", "absent", "reason", "auth_method", "updated_at")
+
+# FROM-clause item: the attendance rows of archive row `ar` as u(id, emp_id, ...)
+UNNEST_ARCHIVE = (f"unnest({', '.join('ar.' + c for c in COLUMNS)}) "
+                  f"AS u({', '.join(COLUMNS)})")
+
+# tables and functions: migrations.py 008
+
+
+def partition_month(name):
+    """attendance_p202601 → date(2026, 1, 1); None for anything else."""
+    m = _PARTITION.match(name or "")
+    return date(int(m.group(1)), int(m.group(2)), 1) if m else None
+
+
+def add_months(month, n):
+    y, m = divmod(month.year * 12 + month.month - 1 + n, 12)
+    return date(y, m + 1, 1)
+
+
+def attached(cur):
+    """[(month, name)] of attached monthly partitions, oldest first."""
+    cur.execute("""
+        SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+         WHERE i.inhparent = 'attendance'::regclass
+    """)
+    return sorted((partition_month(r[0]), r[0]) for r in cur.fetchall()
+                  if partition_month(r[0]))
+
+
+def maintain(conn=None, today=None, out=None):
+    """Add future partitions, sweep the default partition, archive old months.
+
+    Every step commits on its own; a step that cannot get its lock in
+    PARTITION_LOCK_TIMEOUT is skipped and retried on the next run. Returns
+    {"added": [...], "archived": {month: rows}} or None if another process
+    is already maintaining.
+    """
+    own = conn is None
+    conn = conn or open_connection()
+    this_month = (today or date.today()).replace(day=1)
+    horizon = add_months(this_month, -ARCHIVE_AFTER_MONTHS) if ARCHIVE_AFTER_MONTHS > 0 else None
+    done = {"added": [], "archived": {}}
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT pg_try_advisory_lock(%s)", (_LOCK_KEY,))
+        if not cur.fetchone()[0]:
+            conn.rollback()
+            return None
+        try:
+            cur.execute("SELECT DISTINCT date_trunc('month', date)::date FROM attendance_pdefault")
+            stray = {r[0] for r in cur.fetchall()}
+            conn.commit()
+
+            wanted = {add_months(this_month, i) for i in range(PARTITION_AHEAD_MONTHS + 1)}
+            for month in sorted(wanted | stray):
+                if horizon and month < horizon:
+                    continue
+                if _step(cur, "SELECT attendance_add_partition(%s)", month, out):
+                    done["added"].append(month)
+
+            old = {m for m, _ in attached(cur) if horizon and m < horizon}
+            old |= {m for m in stray if horizon and m < horizon}
+            conn.commit()
+            for month in sorted(old):
+                rows = _step(cur, "SELECT attendance_archive_month(%s)", month, out)
+                if rows is not None:
+                    done["archived"][month] = rows
+        finally:
+            conn.rollback()
+            cur.execute("SELECT pg_advisory_unlock(%s)", (_LOCK_KEY,))
+            conn.commit()
+    finally:
+        if own:
+            conn.close()
+    for month in done["added"]:
+        _say(out, f"added     attendance_p{month:%Y%m}")
+    for month, rows in done["archived"].items():
+        _say(out, f"archived  {month:%Y-%m} ({rows} rows)")
+    return done
+
+
+def _step(cur, sql, month, out):
+    """One maintenance statement in its own transaction; None if it failed."""
+    try:
+        cur.execute("SET LOCAL lock_timeout = %s", (PARTITION_LOCK_TIMEOUT,))
+        cur.execute(sql, (month,))
+        result = cur.fetchone()[0]
+        cur.connection.commit()
+        return result
+    except Exception as e:
+        cur.connection.rollback()
+        log.warning("partition maintenance for %s failed: %s", month, e)
+        _say(out, f"skipped   {month:%Y-%m}: {str(e).strip()}")
+        return None
+
+
+def _say(out, line):
+    if out is not None:
+        print(line, file=out)
+
+
+def status(out=sys.stdout):
+    conn = open_connection()
+    try:
+        cur = conn.cursor()
+        for month, name in attached(cur):
+            cur.execute("SELECT reltuples::bigint, pg_total_relation_size(oid) "
+                        "FROM pg_class WHERE relname = %s", (name,))
+            rows, size = cur.fetchone()
+            print(f"hot       {month:%Y-%m}  ~{max(rows, 0):>8} rows  {size // 1024:>8} kB", file=out)
+        cur.execute("SELECT count(*) FROM attendance_pdefault")
+        print(f"default   {cur.fetchone()[0]} rows", file=out)
+        cur.execute(f"""
+            SELECT month, sum(cardinality(date)),
+                   sum({' + '.join(f'pg_column_size({c})' for c in COLUMNS)})
+              FROM attendance_archive GROUP BY month ORDER BY month
+        """)
+        for month, rows, size in cur.fetchall():
+            print(f"archived  {month:%Y-%m}  {rows:>9} rows  {size // 1024:>8} kB", file=out)
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+class Maintainer:
+    """Runs maintain() every PARTITION_MAINTENANCE_HOURS from each worker;
+    the advisory lock lets one of them do the work."""
+
+    def __init__(self):
+        self._pid = None
+        self.runs = 0
+        self.last_error = None
+
+    def start(self):
+        """Start this process's maintenance thread (once per pid, fork-safe)."""
+        if PARTITION_MAINTENANCE_HOURS <= 0 or self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        while True:
+            try:
+                maintain()
+                self.runs += 1
+                self.last_error = None
+            except Exception as e:
+                self.last_error = repr(e)
+                log.exception("partition maintenance failed")
+            time.sleep(PARTITION_MAINTENANCE_HOURS * 3600)
+
+
+maintainer = Maintainer()
+
+
+def main(argv):
+    cmd = argv[1] if len(argv) > 1 else "status"
+    if cmd == "maintain":
+        return 0 if maintain(out=sys.stdout) is not None else 1
+    if cmd == "status":
+        status()
+        return 0
+    print(__doc__, file=sys.stderr)
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
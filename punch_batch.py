@@ -0,0 +1,262 @@
+"""Offline/batch punch sync for shared kiosk phones.
+
+A batch is applied with a fixed number of statements however many punches it
+carries: one PIN lookup, one receipt lookup, one CTE that inserts punch-ins
+and applies punch-outs, and one multi-row receipt insert. Receipts are keyed
+by the client's idempotency key, so replaying a batch only costs the receipt
+lookup.
+"""
+from datetime import datetime, timedelta
+
+from psycopg2.extras import execute_values
+
+from location import LocationError, parse_gps, punch_location
+
+MAX_BATCH = 500
+MAX_AGE = timedelta(days=7)        # oldest queued punch we still accept
+MAX_SKEW = timedelta(minutes=5)    # tolerated client clock drift into the future
+TOO_MANY_PINS = "too many wrong PINs, try later"
+
+# punch_receipts: migrations.py 003
+
+# One statement per single punch (app.py, mobile_asgi.py): the state checks
+# ride on the write itself, so two devices punching together can't both pass
+# a SELECT and race.
+PUNCH_IN_SQL = """
+    INSERT INTO attendance (emp_id, date, time_in, location_in, auth_method)
+    VALUES (%s, %s, %s, %s, %s)
+    ON CONFLICT (emp_id, date) DO NOTHING
+    RETURNING id
+"""
+PUNCH_OUT_SQL = """
+    UPDATE attendance
+       SET time_out=%s, location_out=%s,
+           auth_method=COALESCE(%s, auth_method)
+     WHERE emp_id=%s AND date=%s AND time_out IS NULL
+ RETURNING id
+"""
+
+
+class BatchError(ValueError):
+    """The batch as a whole is unusable (not a list, too large)."""
+
+
+def _parse_ts(raw, now):
+    if not raw:
+        return now
+    ts = datetime.fromisoformat(str(raw).replace("Z", "+00:00"))
+    if ts.tzinfo is None:
+        ts = now.tzinfo.localize(ts) if hasattr(now.tzinfo, "localize") \
+            else ts.replace(tzinfo=now.tzinfo)
+    return ts.astimezone(now.tzinfo)
+
+
+def parse_items(payload, now):
+    """Normalise the request body into item dicts; bad items carry an error."""
+    punches = payload.get("punches") if isinstance(payload, dict) else payload
+    if not isinstance(punches, list):
+        raise BatchError("punches must be a list")
+    if len(punches) > MAX_BATCH:
+        raise BatchError(f"at most {MAX_BATCH} punches per batch")
+
+    items, seen = [], set()
+    for idx, raw in enumerate(punches):
+        raw = raw if isinstance(raw, dict) else {}
+        item = {
+            "index": idx,
+            "key": str(raw.get("idempotency_key") or "").strip(),
+            "pin": str(raw.get("pin", "")).strip(),
+            "type": str(raw.get("type", "")).lower(),
+            "location": raw.get("location"),
+            "error": None,
+        }
+        if not item["key"]:
+            item["error"] = "idempotency_key required"
+        elif item["key"] in seen:
+            item["error"] = "duplicate idempotency_key in batch"
+        elif item["type"] not in ("in", "out"):
+            item["error"] = "type?"
+        else:
+            try:
+                ts = _parse_ts(raw.get("timestamp"), now)
+            except (TypeError, ValueError):
+                item["error"] = "bad timestamp"
+            else:
+                if ts > now + MAX_SKEW or ts < now - MAX_AGE:
+                    item["error"] = "timestamp out of range"
+                item["ts"] = ts
+        if not item["error"]:
+            try:
+                item["location"] = parse_gps(item["location"])
+            except LocationError as e:
+                item["error"] = str(e)
+        seen.add(item["key"])
+        items.append(item)
+    return items
+
+
+def sync_punches(cur, items, client_ip=None, max_bad_pins=None):
+    """Apply parsed items on `cur` (caller commits); returns per-item results.
+
+    max_bad_pins caps the distinct unknown PINs one batch may try. Once it is
+    spent, every later item whose PIN has not already matched is refused
+    unapplied, so the batch cannot reveal which other PINs are valid.
+    """
+    results = {}
+
+    def done(item, ok, msg, replayed=False):
+        ts = item.get("ts")
+        results[item["index"]] = {
+            "idempotency_key": item["key"] or None,
+            "success": ok,
+            "msg": msg,
+            "time": ts.strftime("%I:%M %p") if ts else None,
+            "replayed": replayed,
+        }
+
+    live = []
+    for item in items:
+        if item["error"]:
+            done(item, False, item["error"])
+        else:
+            live.append(item)
+
+    # ---- replays: answer from stored receipts, no writes ----
+    if live:
+        cur.execute("""
+            SELECT idempotency_key, ok, message
+              FROM punch_receipts
+             WHERE idempotency_key = ANY(%s)
+        """, ([i["key"] for i in live],))
+        receipts = {r[0]: r for r in cur.fetchall()}
+        fresh = []
+        for item in live:
+            r = receipts.get(item["key"])
+            if r:
+                done(item, r[1], r[2], replayed=True)
+            else:
+                fresh.append(item)
+        live = fresh
+
+    # ---- one query for every PIN in the batch (queued items carry emp_id) ----
+    pins = {i["pin"] for i in live if "emp_id" not in i}
+    emp_by_pin = {}
+    if pins:
+        cur.execute("SELECT pin, id FROM employee WHERE pin = ANY(%s)", (list(pins),))
+        emp_by_pin = dict(cur.fetchall())
+    fresh, bad_pins, matched, spent = [], set(), set(), False
+    for item in live:
+        emp_id = item.get("emp_id") or emp_by_pin.get(item["pin"])
+        if "emp_id" not in item and spent and item["pin"] not in matched:
+            done(item, False, TOO_MANY_PINS)
+        elif emp_id is None:
+            if (max_bad_pins is not None and item["pin"] not in bad_pins
+                    and len(bad_pins) >= max_bad_pins):
+                spent = True
+                done(item, False, TOO_MANY_PINS)
+            else:
+                bad_pins.add(item["pin"])
+                done(item, False, "bad pin")
+        else:
+            if "emp_id" not in item:
+                matched.add(item["pin"])
+            item["emp_id"] = emp_id
+            item["loc"] = punch_location(item["location"],
+                                         item.get("client_ip") or client_ip)
+            fresh.append(item)
+    live = fresh
+
+    if not live:
+        return [results[i] for i in sorted(results)]
+
+    # ---- fold each employee-day into at most one in and one out ----
+    groups = {}
+    for item in sorted(live, key=lambda i: (i["emp_id"], i["ts"])):
+        g = groups.setdefault((item["emp_id"], item["ts"].date()),
+                              {"in": None, "out": None, "rejected": []})
+        if item["type"] == "in":
+            if g["in"] is None and g["out"] is None:
+                g["in"] = item
+            elif g["in"] is None:
+                # an out queued before the day's in: apply in order, out loses
+                g["rejected"].append((g["out"], "Not punched in yet / already out"))
+                g["out"], g["in"] = None, item
+            else:
+                g["rejected"].append((item, "Already punched in"))
+        elif g["out"] is None:
+            g["out"] = item
+        else:
+            g["rejected"].append((item, "Not punched in yet / already out"))
+
+    rows = []
+    for (emp_id, day), g in groups.items():
+        pin_in, pin_out = g["in"], g["out"]
+        rows.append((
+            emp_id, day,
+            pin_in["ts"].time() if pin_in else None,
+            pin_in["loc"] if pin_in else None,
+            pin_out["ts"].time() if pin_out else None,
+            pin_out["loc"] if pin_out else None,
+        ))
+
+    # Inserted rows carry their same-batch punch-out; existing rows get the
+    # out via UPDATE (the CTE snapshot cannot see the INSERT's own rows).
+    applied = execute_values(cur, """
+        WITH batch (emp_id, date, time_in, location_in, time_out, location_out) AS (
+            VALUES %s
+        ),
+        ins AS (
+            INSERT INTO attendance (emp_id, date, time_in, location_in,
+                                    time_out, location_out)
+            SELECT emp_id, date, time_in, location_in, time_out, location_out
+              FROM batch
+             WHERE time_in IS NOT NULL
+            ON CONFLICT (emp_id, date) DO NOTHING
+            RETURNING emp_id, date, time_out IS NOT NULL AS with_out
+        ),
+        upd AS (
+            UPDATE attendance a
+               SET time_out = b.time_out, location_out = b.location_out
+              FROM batch b
+             WHERE a.emp_id = b.emp_id AND a.date = b.date
+               AND b.time_out IS NOT NULL AND a.time_out IS NULL
+            RETURNING a.emp_id, a.date
+        )
+        SELECT 'in', emp_id, date, with_out FROM ins
+        UNION ALL
+        SELECT 'out', emp_id, date, true FROM upd
+    """, rows,
+        template="(%s::int, %s::date, %s::time, %s, %s::time, %s)",
+        page_size=len(rows), fetch=True)
+
+    saved_in, saved_out = set(), set()
+    for kind, emp_id, day, with_out in applied:
+        if kind == "in":
+            saved_in.add((emp_id, day))
+            if with_out:
+                saved_out.add((emp_id, day))
+        else:
+            saved_out.add((emp_id, day))
+
+    for key, g in groups.items():
+        if g["in"]:
+            ok = key in saved_in
+            done(g["in"], ok, "Saved" if ok else "Already punched in")
+        if g["out"]:
+            ok = key in saved_out
+            done(g["out"], ok, "Saved" if ok else "Not punched in yet / already out")
+        for item, msg in g["rejected"]:
+            done(item, False, msg)
+
+    execute_values(cur, """
+        INSERT INTO punch_receipts
+               (idempotency_key, emp_id, punch_type, ok, message, punched_at)
+        VALUES %s
+        ON CONFLICT (idempotency_key) DO NOTHING
+    """, [
+        (i["key"], i["emp_id"], i["type"],
+         results[i["index"]]["success"], results[i["index"]]["msg"], i["ts"])
+        for i in live
+    ], page_size=len(live))
+
+    return [results[i] for i in sorted(results)]
@@ -0,0 +1,254 @@
+"""Write-behind ingestion for /mobile/punch (PUNCH_QUEUE=1).
+
+A validated punch is appended to a local SQLite file in WAL mode and
+acknowledged straight away with a ticket. A writer thread drains the file
+into attendance in batches through punch_batch.sync_punches, so a burst at
+shift change costs one Postgres transaction per batch instead of one per
+punch. Only one process on the box drains at a time (flock), and it applies
+rows in arrival order, which keeps each employee's punches in sequence.
+
+The ticket is the punch's idempotency key: results land in punch_receipts,
+and a crash between the Postgres commit and the local delete just replays
+the batch against its receipts. If a batch fails for anything but a lost
+connection, its punches are retried one at a time; one that still fails is
+moved to the dead_letter table with a failure receipt, so a single bad row
+cannot hold up the punches queued behind it. Let the queue drain (depth 0 on
+/mobile/punch/queue) before switching PUNCH_QUEUE off.
+"""
+import fcntl
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+
+import psycopg2
+
+from db import PoolTimeout, db_cursor
+from location import parse_gps
+import punch_batch
+
+PUNCH_QUEUE = os.getenv("PUNCH_QUEUE", "0") == "1"
+QUEUE_PATH = os.getenv("PUNCH_QUEUE_PATH", "punch_queue.db")
+QUEUE_BATCH = int(os.getenv("PUNCH_QUEUE_BATCH", "200"))
+QUEUE_INTERVAL = float(os.getenv("PUNCH_QUEUE_INTERVAL", "0.25"))   # idle poll, seconds
+
+log = logging.getLogger("punch_queue")
+_local = threading.local()
+
+# the database, not the punch: back off and retry the same batch
+_TRANSIENT = (psycopg2.OperationalError, psycopg2.InterfaceError, PoolTimeout)
+DEAD_LETTER_MESSAGE = "Could not be saved"
+
+
+def _db():
+    """Per-thread SQLite connection (sqlite3 connections are not shareable)."""
+    conn = getattr(_local, "conn", None)
+    if conn is None or getattr(_local, "pid", None) != os.getpid():
+        conn = sqlite3.connect(QUEUE_PATH, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=FULL")     # an ack means it's on disk
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS queue (
+                seq         INTEGER PRIMARY KEY AUTOINCREMENT,
+                ticket      TEXT NOT NULL UNIQUE,
+                emp_id      INTEGER NOT NULL,
+                punch_type  TEXT NOT NULL,
+                punched_at  TEXT NOT NULL,
+                location    TEXT,
+                client_ip   TEXT,
+                enqueued_at REAL NOT NULL
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS dead_letter (
+                seq         INTEGER PRIMARY KEY,
+                ticket      TEXT NOT NULL UNIQUE,
+                emp_id      INTEGER NOT NULL,
+                punch_type  TEXT NOT NULL,
+                punched_at  TEXT NOT NULL,
+                location    TEXT,
+                client_ip   TEXT,
+                enqueued_at REAL NOT NULL,
+                error       TEXT NOT NULL,
+                failed_at   REAL NOT NULL
+            )
+        """)
+        _local.conn, _local.pid = conn, os.getpid()
+    return conn
+
+
+class PunchQueue:
+    def __init__(self):
+        self._wake = threading.Event()
+        self._writer_pid = None
+        self.drained = 0
+        self.batches = 0
+        self.failures = 0
+        self.last_error = None
+        self.last_drain_at = None
+        self.dead_lettered = 0
+
+    # ─────────── producer side ───────────
+    def enqueue(self, emp_id, punch_type, punched_at, gps_location=None, client_ip=None):
+        """Persist one punch locally; returns its ticket.
+
+        Raises LocationError for GPS that could never be stored, before
+        anything is acknowledged.
+        """
+        gps_location = parse_gps(gps_location)
+        self.start()
+        ticket = f"q-{uuid.uuid4().hex}"
+        _db().execute("""
+            INSERT INTO queue (ticket, emp_id, punch_type, punched_at,
+                               location, client_ip, enqueued_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, (ticket, emp_id, punch_type, punched_at.isoformat(),
+              json.dumps(gps_location) if gps_location is not None else None,
+              client_ip, time.time()))
+        self._wake.set()
+        return ticket
+
+    def status(self, ticket):
+        """("pending", None) / ("done", (ok, message, punched_at)) / (None, None)."""
+        row = _db().execute("SELECT 1 FROM queue WHERE ticket = ?", (ticket,)).fetchone()
+        if row:
+            return "pending", None
+        with db_cursor() as cur:
+            cur.execute("""
+                SELECT ok, message, punched_at FROM punch_receipts
+                 WHERE idempotency_key = %s
+            """, (ticket,))
+            receipt = cur.fetchone()
+        return ("done", receipt) if receipt else (None, None)
+
+    # ─────────── writer ───────────
+    def start(self):
+        """Start this process's writer thread (once per pid, fork-safe)."""
+        if self._writer_pid == os.getpid():
+            return
+        self._writer_pid = os.getpid()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        lock = open(QUEUE_PATH + ".lock", "a")
+        while True:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX)     # another worker may be draining
+                try:
+                    while self.drain_once():
+                        pass
+                finally:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+            except Exception as e:
+                self.failures += 1
+                self.last_error = repr(e)
+                log.exception("punch queue drain failed (attempt %d)", self.failures)
+                time.sleep(min(30, 2 ** min(self.failures, 5)))
+                continue
+            self._wake.wait(QUEUE_INTERVAL)
+            self._wake.clear()
+
+    def drain_once(self):
+        """Apply the oldest QUEUE_BATCH punches; returns how many were applied."""
+        conn = _db()
+        rows = conn.execute("""
+            SELECT seq, ticket, emp_id, punch_type, punched_at, location, client_ip
+              FROM queue ORDER BY seq LIMIT ?
+        """, (QUEUE_BATCH,)).fetchall()
+        if not rows:
+            return 0
+        items = [_item(n, row) for n, row in enumerate(rows)]
+
+        try:
+            with db_cursor(commit=True) as cur:
+                punch_batch.sync_punches(cur, items)
+        except _TRANSIENT:
+            raise
+        except Exception as e:
+            log.warning("punch batch failed (%r); applying its punches one by one", e)
+            for row, item in zip(rows, items):
+                self._apply_one(conn, row, item)
+        else:
+            conn.execute("DELETE FROM queue WHERE seq <= ?", (rows[-1][0],))
+        self.drained += len(rows)
+        self.batches += 1
+        self.failures = 0
+        self.last_drain_at = time.time()
+        return len(rows)
+
+    def _apply_one(self, conn, row, item):
+        item = dict(item, index=0)
+        try:
+            with db_cursor(commit=True) as cur:
+                punch_batch.sync_punches(cur, [item])
+        except _TRANSIENT:
+            raise
+        except Exception as e:
+            self._dead_letter(conn, row, item, e)
+            return
+        conn.execute("DELETE FROM queue WHERE seq = ?", (row[0],))
+
+    def _dead_letter(self, conn, row, item, error):
+        log.error("punch %s moved to dead_letter: %r", item["key"], error)
+        with db_cursor(commit=True) as cur:
+            cur.execute("""
+                INSERT INTO punch_receipts
+                       (idempotency_key, emp_id, punch_type, ok, message, punched_at)
+                VALUES (%s, %s, %s, false, %s, %s)
+                ON CONFLICT (idempotency_key) DO NOTHING
+            """, (item["key"], item["emp_id"], item["type"], DEAD_LETTER_MESSAGE, item["ts"]))
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("""
+                INSERT OR IGNORE INTO dead_letter
+                       (seq, ticket, emp_id, punch_type, punched_at, location,
+                        client_ip, enqueued_at, error, failed_at)
+                SELECT seq, ticket, emp_id, punch_type, punched_at, location,
+                       client_ip, enqueued_at, ?, ?
+                  FROM queue WHERE seq = ?
+            """, (repr(error), time.time(), row[0]))
+            conn.execute("DELETE FROM queue WHERE seq = ?", (row[0],))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self.dead_lettered += 1
+
+    # ─────────── observability ───────────
+    def stats(self):
+        depth, oldest = _db().execute(
+            "SELECT COUNT(*), MIN(enqueued_at) FROM queue").fetchone()
+        now = time.time()
+        return {
+            "enabled": PUNCH_QUEUE,
+            "depth": depth,
+            "lag_seconds": round(now - oldest, 3) if oldest else 0.0,
+            "drained": self.drained,
+            "batches": self.batches,
+            "failures": self.failures,
+            "dead_letter": _db().execute("SELECT COUNT(*) FROM dead_letter").fetchone()[0],
+            "last_error": self.last_error,
+            "last_drain_age": round(now - self.last_drain_at, 3) if self.last_drain_at else None,
+        }
+
+
+def _item(n, row):
+    _, ticket, emp_id, punch_type, punched_at, location, client_ip = row
+    return {
+        "index": n,
+        "key": ticket,
+        "pin": None,
+        "emp_id": emp_id,
+        "type": punch_type,
+        "ts": datetime.fromisoformat(punched_at),
+        "location": json.loads(location) if location else None,
+        "client_ip": client_ip,
+        "error": None,
+    }
+
+
+queue = PunchQueue()
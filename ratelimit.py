@@ -0,0 +1,233 @@
+"""Sliding-window rate limits for the PIN endpoints.
+
+A PIN is four digits, so /login_pin, /mobile/punch and /mobile/whoami/<pin>
+– and /profile, the other identity lookup – are checked before they do any
+work – no pool checkout, no cache lookup:
+
+    RATE_REQUESTS_IP          requests per client IP
+    RATE_REQUESTS_DEVICE      requests per device (X-Device-Id header)
+    RATE_PIN_FAILURES_IP      wrong PINs per client IP
+    RATE_PIN_FAILURES_DEVICE  wrong PINs per device
+
+each "<count>/<seconds>". The per-IP limits are the loose ones: a whole
+office punches in from behind one NAT address. Requests are counted as they
+arrive; wrong PINs are counted by the handler once the lookup fails, so
+people who type their PIN right are never slowed down. Over any limit → 429
+with Retry-After. A /mobile/punch/batch may only try as many unknown PINs
+as the client has failures left (failure_budget()).
+
+The client IP is the socket peer unless TRUST_PROXY=<n> says the app sits
+behind n reverse proxies; then it is the n-th X-Forwarded-For entry from
+the right (werkzeug's ProxyFix rule), which the outermost proxy wrote and
+the client cannot forge. X-Device-Id is chosen by the client and trivially
+rotated, so the device limits only slow down honest-but-buggy apps; the IP
+limits are the real guard. Requests that authenticate with a bearer token
+never look up a PIN and skip the wrong-PIN limits, so an attacker behind
+an office NAT cannot lock out signed-in phones on the same address.
+
+Each counter is a sliding-window estimate over two fixed buckets: the
+current bucket's count plus the previous bucket's, weighted by how much of
+it still overlaps the window. A key costs four numbers whatever the
+traffic.
+
+RATE_LIMIT_BACKEND picks where the counters live:
+  local  – this process only: with N gunicorn/uvicorn workers every limit
+           is effectively N times as loose. Fine for one worker and tests;
+           use redis for anything larger. Keys idle for two windows are
+           swept past RATE_LIMIT_MAX_KEYS
+  redis  – shared by every worker (RATE_LIMIT_REDIS_URL; needs the `redis`
+           package). If Redis is unreachable, requests are let through.
+  off    – no limits
+"""
+import logging
+import math
+import os
+import threading
+import time
+
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "local")
+RATE_LIMIT_REDIS_URL = os.getenv("RATE_LIMIT_REDIS_URL", "redis://localhost:6379/0")
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+TRUST_PROXY = int(os.getenv("TRUST_PROXY", "0"))      # reverse proxies in front
+DEVICE_HEADER = "X-Device-Id"
+
+log = logging.getLogger("ratelimit")
+
+
+def parse_limit(spec):
+    """'20/900' → (20, 900.0): at most 20 per 900 seconds."""
+    count, _, seconds = spec.partition("/")
+    return int(count), float(seconds or 60)
+
+
+RATE_REQUESTS_IP = parse_limit(os.getenv("RATE_REQUESTS_IP", "600/60"))
+RATE_REQUESTS_DEVICE = parse_limit(os.getenv("RATE_REQUESTS_DEVICE", "30/60"))
+RATE_PIN_FAILURES_IP = parse_limit(os.getenv("RATE_PIN_FAILURES_IP", "100/900"))
+RATE_PIN_FAILURES_DEVICE = parse_limit(os.getenv("RATE_PIN_FAILURES_DEVICE", "5/900"))
+
+
+def client_ip(peer, forwarded_for=None, trusted=None):
+    """The client's address: the peer, or the X-Forwarded-For entry written
+    by the outermost of `trusted` (TRUST_PROXY) proxies."""
+    trusted = TRUST_PROXY if trusted is None else trusted
+    if trusted <= 0 or not forwarded_for:
+        return peer
+    hops = [h.strip() for h in forwarded_for.split(",") if h.strip()]
+    return hops[-trusted] if len(hops) >= trusted else peer
+
+
+def _estimate(prev, cur, window, now):
+    elapsed = (now % window) / window
+    return prev * (1.0 - elapsed) + cur
+
+
+# ─────────────── backends ───────────────
+class LocalBackend:
+    """Counters in this process: key -> (bucket, previous, current, idle after)."""
+
+    remote = False
+
+    def __init__(self, max_keys=RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def add(self, key, window, n=1, now=None):
+        """Add n (0: just read) and return the sliding-window count."""
+        now = time.time() if now is None else now
+        bucket = int(now // window)
+        with self._lock:
+            start, prev, cur, _ = self._data.get(key, (bucket, 0, 0, 0))
+            if start != bucket:
+                prev, cur = (cur if start == bucket - 1 else 0), 0
+            if n:
+                cur += n
+                if key not in self._data and len(self._data) >= self.max_keys:
+                    self._sweep(now)
+                self._data[key] = (bucket, prev, cur, (bucket + 2) * window)
+        return _estimate(prev, cur, window, now)
+
+    def _sweep(self, now):
+        for key in [k for k, v in self._data.items() if v[3] <= now]:
+            del self._data[key]
+        if len(self._data) >= self.max_keys:     # still full: drop the oldest half
+            for key in list(self._data)[:len(self._data) // 2]:
+                del self._data[key]
+
+    def __len__(self):
+        return len(self._data)
+
+
+class RedisBackend:
+    """Counters shared through Redis: one key per (counter, bucket)."""
+
+    remote = True
+
+    def __init__(self, url=RATE_LIMIT_REDIS_URL):
+        import redis
+        self._client = redis.Redis.from_url(url, socket_timeout=0.05,
+                                            socket_connect_timeout=0.05)
+
+    def add(self, key, window, n=1, now=None):
+        now = time.time() if now is None else now
+        bucket = int(now // window)
+        cur_key, prev_key = f"rl:{key}:{bucket}", f"rl:{key}:{bucket - 1}"
+        try:
+            pipe = self._client.pipeline(transaction=False)
+            if n:
+                pipe.incrby(cur_key, n)
+                pipe.expire(cur_key, int(2 * window) + 1)
+            else:
+                pipe.get(cur_key)
+            pipe.get(prev_key)
+            res = pipe.execute()
+        except Exception as e:
+            log.warning("rate limit backend unavailable: %s", e)
+            return 0.0
+        return _estimate(int(res[-1] or 0), int(res[0] or 0), window, now)
+
+    def __len__(self):
+        return 0
+
+
+class NullBackend:
+    remote = False
+
+    def add(self, key, window, n=1, now=None):
+        return 0.0
+
+    def __len__(self):
+        return 0
+
+
+_BACKENDS = {"local": LocalBackend, "redis": RedisBackend, "off": NullBackend}
+
+
+# ─────────────── limiter ───────────────
+class RateLimiter:
+    def __init__(self, backend=None):
+        self._backend = backend
+        self.rejected = 0
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            try:
+                self._backend = _BACKENDS.get(RATE_LIMIT_BACKEND, LocalBackend)()
+            except ImportError as e:
+                log.error("RATE_LIMIT_BACKEND=%s unavailable (%s); limiting per process",
+                          RATE_LIMIT_BACKEND, e)
+                self._backend = LocalBackend()
+        return self._backend
+
+    def _counters(self, ip, device):
+        if ip:
+            yield f"ip:{ip}", RATE_REQUESTS_IP, RATE_PIN_FAILURES_IP
+        if device:
+            yield f"dev:{device[:128]}", RATE_REQUESTS_DEVICE, RATE_PIN_FAILURES_DEVICE
+
+    def check(self, ip, device=None, now=None, pins=True):
+        """Count a request; seconds to wait if the client is over a limit, else None.
+
+        pins=False: the request cannot try a PIN (bearer token), so the
+        wrong-PIN limits do not apply to it.
+        """
+        now = time.time() if now is None else now
+        backend = self.backend
+        for key, (req_limit, req_window), (fail_limit, fail_window) in self._counters(ip, device):
+            if pins and backend.add(f"fail:{key}", fail_window, 0, now) >= fail_limit:
+                return self._reject(fail_window, now)
+            if backend.add(f"req:{key}", req_window, 1, now) > req_limit:
+                return self._reject(req_window, now)
+        return None
+
+    def failure_budget(self, ip, device=None, now=None):
+        """Wrong PINs this client may still try before it is locked out."""
+        now = time.time() if now is None else now
+        budget = None
+        for key, _, (fail_limit, fail_window) in self._counters(ip, device):
+            left = max(0, math.ceil(fail_limit - self.backend.add(f"fail:{key}", fail_window, 0, now)))
+            budget = left if budget is None else min(budget, left)
+        return budget
+
+    def failed(self, ip, device=None, n=1, now=None):
+        """Record n wrong PINs from this client."""
+        now = time.time() if now is None else now
+        for key, _, (_, fail_window) in self._counters(ip, device):
+            self.backend.add(f"fail:{key}", fail_window, n, now)
+
+    def _reject(self, window, now):
+        self.rejected += 1
+        return max(1, math.ceil(window - now % window))
+
+    def stats(self):
+        return {"backend": type(self.backend).__name__, "keys": len(self.backend),
+                "rejected": self.rejected}
+
+
+limiter = RateLimiter()
+
+
+def set_backend(backend):
+    """Swap the counter store (tests, a shared store of your own)."""
+    limiter._backend = backend
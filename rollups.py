@@ -0,0 +1,211 @@
+"""Daily attendance rollups for the dashboards.
+
+attendance_daily holds present / absent / late / on-leave counts per date and
+attendance_emp_monthly the same per employee per month. A row trigger on
+attendance records every (date, emp_id) a writer touched in
+attendance_rollup_dirty – punches, absences, leaves and batch sync all go
+through it – and refresh() recomputes just those days. Dirty rows carry a
+version so a write racing a refresh is never lost: only markers whose version
+was seen are cleared.
+
+Readers never write. Each worker runs a Refresher thread that wakes on the
+data_changed 'attendance' NOTIFY (at most every ROLLUP_REFRESH_SECONDS, and
+at least once a minute without one); an advisory lock lets one worker at a
+time do the work, and a refresh that changed anything bumps data_version so
+cached dashboards re-render. The rollups lag writes by about
+ROLLUP_REFRESH_SECONDS.
+"""
+import calendar
+import logging
+import os
+import threading
+import time
+
+from db import db_cursor
+from events import bus
+import fragments
+
+SHIFT_START = os.getenv("SHIFT_START", "09:30")   # punch-in after this is late
+ROLLUP_REFRESH_SECONDS = float(os.getenv("ROLLUP_REFRESH_SECONDS", "2"))  # 0: off
+ROLLUP_IDLE_SECONDS = 60
+
+_LOCK_KEY = 7_140_814   # one refresher at a time, cluster-wide
+
+log = logging.getLogger("rollups")
+
+# tables and the dirty-marking trigger: migrations.py 005
+
+# Per-row classification shared by both grains. A leave day is an absent row
+# covered by a leaves range; absent counts only the remaining absences.
+# attendance_range also reads archived months, so a day dirtied there (a late
+# correction merged into the archive) is recounted in full.
+_CLASSIFY = """
+    SELECT a.date, a.emp_id,
+           (NOT a.absent AND a.time_in IS NOT NULL)                AS is_present,
+           (a.absent AND lv.emp_id IS NULL)                        AS is_absent,
+           (NOT a.absent AND a.time_in > %(shift_start)s::time)    AS is_late,
+           (a.absent AND lv.emp_id IS NOT NULL)                    AS is_leave
+      FROM attendance_range(%(first)s, %(last)s) a
+      LEFT JOIN LATERAL (
+            SELECT l.emp_id FROM leaves l
+             WHERE l.emp_id = a.emp_id
+               AND a.date BETWEEN l.from_date AND l.to_date
+             LIMIT 1
+      ) lv ON true
+"""
+
+
+def refresh(cur):
+    """Bring the rollups up to date with every write so far; commits.
+
+    Returns the number of days recounted, or None if another process is
+    refreshing right now.
+    """
+    cur.execute("SELECT pg_try_advisory_xact_lock(%s)", (_LOCK_KEY,))
+    if not cur.fetchone()[0]:
+        cur.connection.rollback()
+        return None
+    cur.execute("SELECT date, emp_id, version FROM attendance_rollup_dirty")
+    dirty = cur.fetchall()
+    if not dirty:
+        cur.connection.commit()
+        return 0
+
+    dates = sorted({d for d, _, _ in dirty})
+    months = sorted({(e, d.replace(day=1)) for d, e, _ in dirty})
+    params = {
+        # whole months: the monthly grain recounts every day of them
+        "first": dates[0].replace(day=1),
+        "last": dates[-1].replace(day=calendar.monthrange(dates[-1].year, dates[-1].month)[1]),
+        "dates": dates,
+        "m_emp": [e for e, _ in months],
+        "m_month": [m for _, m in months],
+        "shift_start": SHIFT_START,
+    }
+
+    cur.execute(f"""
+        WITH days AS (SELECT unnest(%(dates)s::date[]) AS date),
+        classified AS ({_CLASSIFY} WHERE a.date = ANY(%(dates)s::date[]))
+        INSERT INTO attendance_daily (date, present, absent, late, on_leave)
+        SELECT d.date,
+               COUNT(*) FILTER (WHERE r.is_present),
+               COUNT(*) FILTER (WHERE r.is_absent),
+               COUNT(*) FILTER (WHERE r.is_late),
+               COUNT(*) FILTER (WHERE r.is_leave)
+          FROM days d
+          LEFT JOIN classified r ON r.date = d.date
+         GROUP BY d.date
+        ON CONFLICT (date) DO UPDATE SET
+            present = EXCLUDED.present, absent = EXCLUDED.absent,
+            late = EXCLUDED.late, on_leave = EXCLUDED.on_leave
+    """, params)
+
+    cur.execute(f"""
+        WITH months AS (
+            SELECT * FROM unnest(%(m_emp)s::int[], %(m_month)s::date[]) AS m(emp_id, month)
+        ),
+        classified AS (
+            {_CLASSIFY}
+            JOIN months m ON m.emp_id = a.emp_id
+             AND a.date >= m.month AND a.date < m.month + INTERVAL '1 month'
+        )
+        INSERT INTO attendance_emp_monthly (emp_id, month, present, absent, late, on_leave)
+        SELECT m.emp_id, m.month,
+               COUNT(*) FILTER (WHERE r.is_present),
+               COUNT(*) FILTER (WHERE r.is_absent),
+               COUNT(*) FILTER (WHERE r.is_late),
+               COUNT(*) FILTER (WHERE r.is_leave)
+          FROM months m
+          LEFT JOIN classified r
+            ON r.emp_id = m.emp_id
+           AND r.date >= m.month AND r.date < m.month + INTERVAL '1 month'
+         GROUP BY m.emp_id, m.month
+        ON CONFLICT (emp_id, month) DO UPDATE SET
+            present = EXCLUDED.present, absent = EXCLUDED.absent,
+            late = EXCLUDED.late, on_leave = EXCLUDED.on_leave
+    """, params)
+
+    # only clear markers nobody has bumped since we read them
+    cur.execute("""
+        DELETE FROM attendance_rollup_dirty d
+         USING unnest(%s::date[], %s::int[], %s::bigint[]) AS s(date, emp_id, version)
+         WHERE d.date = s.date AND d.emp_id = s.emp_id AND d.version = s.version
+    """, ([r[0] for r in dirty], [r[1] for r in dirty], [r[2] for r in dirty]))
+    cur.execute(fragments.BUMP_VERSION)
+    cur.connection.commit()
+    return len(dates)
+
+
+class Refresher:
+    """Runs refresh() in the background of each worker, woken by attendance
+    writes."""
+
+    def __init__(self):
+        self._pid = None
+        self._wake = threading.Event()
+        self._subscribed = False
+        self.runs = 0
+        self.last_error = None
+
+    def _on_notify(self, payload):
+        # None: (re)connected, so writes may have been missed
+        if payload in ("attendance", None):
+            self._wake.set()
+
+    def start(self):
+        """Start this process's refresh thread (once per pid, fork-safe)."""
+        if ROLLUP_REFRESH_SECONDS <= 0 or self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        if not self._subscribed:
+            self._subscribed = True
+            bus.subscribe(fragments.CHANNEL, self._on_notify)
+        bus.start()
+        self._wake.set()            # catch up on whatever is dirty now
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(ROLLUP_IDLE_SECONDS)
+            self._wake.clear()
+            try:
+                with db_cursor() as cur:
+                    if refresh(cur) is None:
+                        self._wake.set()    # the other refresher may miss our writes
+                self.runs += 1
+                self.last_error = None
+            except Exception as e:
+                self.last_error = repr(e)
+                log.exception("rollup refresh failed")
+            time.sleep(ROLLUP_REFRESH_SECONDS)
+
+
+refresher = Refresher()
+
+
+# ─────────────── readers ───────────────
+def last_days(cur, limit=7):
+    """[(date, present)] for the most recent days with punch-ins, oldest first."""
+    cur.execute("""
+        SELECT date, present FROM attendance_daily
+         WHERE present > 0
+         ORDER BY date DESC LIMIT %s
+    """, (limit,))
+    return cur.fetchall()[::-1]
+
+
+def day(cur, on_date):
+    """(present, absent, late, on_leave) for one date."""
+    cur.execute("""
+        SELECT present, absent, late, on_leave FROM attendance_daily WHERE date = %s
+    """, (on_date,))
+    return cur.fetchone() or (0, 0, 0, 0)
+
+
+def employee_month(cur, emp_id, month):
+    """(present, absent, late, on_leave) for one employee-month."""
+    cur.execute("""
+        SELECT present, absent, late, on_leave FROM attendance_emp_monthly
+         WHERE emp_id = %s AND month = %s
+    """, (emp_id, month.replace(day=1)))
+    return cur.fetchone() or (0, 0, 0, 0)
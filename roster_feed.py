@@ -0,0 +1,220 @@
+"""Live roster changes for /admin/stream (Server-Sent Events).
+
+Statement triggers on attendance and employee send
+NOTIFY roster_changed '<emp_id>,<emp_id>,...' for the employees whose row in
+today's roster a committed statement touched ('*' when the list would not
+fit in a payload). Each worker has one RosterFeed: it listens on the shared
+events connection (plus touch() from this worker's own writers), lets a
+burst settle for ROSTER_FEED_INTERVAL, re-reads just the changed rows in one
+query, renders them once and hands the same event to every connected admin.
+So a roster change costs one query per worker, however many admins watch.
+
+Events are `roster` ({"rows": [...], "removed": [emp_id, ...]}, each row with
+its rendered <tr>) and `reload` (the feed may have missed changes: after a
+listener reconnect, a '*' payload, or a subscriber that fell SSE_QUEUE
+events behind).
+"""
+import asyncio
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+from db import db_cursor
+from events import bus
+
+ROSTER_FEED_INTERVAL = float(os.getenv("ROSTER_FEED_INTERVAL", "0.25"))
+SSE_QUEUE = int(os.getenv("SSE_QUEUE", "64"))
+SSE_HEARTBEAT = float(os.getenv("SSE_HEARTBEAT", "15"))
+CHANNEL = "roster_changed"
+
+log = logging.getLogger("roster_feed")
+
+# today's roster; dashboard_stats orders it, the feed filters it
+ROSTER_SELECT = """
+        SELECT e.id, e.name, e.emp_code, e.pin,
+               to_char(a.time_in, 'HH12:MI AM'), to_char(a.time_out, 'HH12:MI AM'),
+               a.location_in, a.location_out,
+               a.absent, a.reason
+          FROM employee e
+     LEFT JOIN attendance a
+            ON a.emp_id = e.id AND a.date = CURRENT_DATE
+"""
+
+# the triggers: migrations.py 007
+
+
+def roster_json(r):
+    return {
+        "id": r[0], "name": r[1], "emp_code": r[2], "pin": r[3],
+        "time_in": r[4], "time_out": r[5],
+        "location_in": r[6], "location_out": r[7],
+        "absent": bool(r[8]), "reason": r[9],
+    }
+
+
+def sse(seq, name, data):
+    return f"id: {seq}\nevent: {name}\ndata: {json.dumps(data)}\n\n"
+
+
+class RosterFeed:
+    def __init__(self):
+        self.render_rows = None        # rows -> [<tr> html]; set by app.py
+        self._subs = {}                # token -> deliver(seq, name, data)
+        self._wake = threading.Condition()
+        self._pending = set()
+        self._reload = False
+        self._pid = None
+        self._subscribed = False
+        self._connects = 0
+        self.seq = 0
+        self.queries = 0
+
+    # ─────────── producers ───────────
+    def touch(self, *emp_ids):
+        """This worker just committed a change to these employees' roster rows."""
+        with self._wake:
+            if not self._subs:
+                return                 # nobody watching here
+            self._pending.update(emp_ids)
+            self._wake.notify()
+
+    def _on_notify(self, payload):
+        if payload is None:
+            self._connects += 1
+            if self._connects == 1:
+                return                 # first LISTEN: nothing was missed yet
+        if payload is None or payload == "*":
+            with self._wake:
+                self._reload = True
+                self._wake.notify()
+            return
+        self.touch(*(int(i) for i in payload.split(",")))
+
+    # ─────────── consumers ───────────
+    def subscribe(self, deliver):
+        """deliver(seq, name, data) runs on the feed thread and must not block."""
+        self.start()
+        token = object()
+        with self._wake:
+            self._subs[token] = deliver
+        return token
+
+    def unsubscribe(self, token):
+        with self._wake:
+            self._subs.pop(token, None)
+
+    def start(self):
+        if not self._subscribed:
+            self._subscribed = True
+            bus.subscribe(CHANNEL, self._on_notify)
+        bus.start()
+        if self._pid == os.getpid():
+            return
+        with self._wake:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._subs = {}
+            self._connects = 0
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        while True:
+            with self._wake:
+                while not (self._pending or self._reload):
+                    self._wake.wait()
+            time.sleep(ROSTER_FEED_INTERVAL)     # let a burst coalesce
+            with self._wake:
+                ids, self._pending = self._pending, set()
+                reload, self._reload = self._reload, False
+                if not self._subs:
+                    continue
+            try:
+                if reload:
+                    self._publish("reload", {})
+                else:
+                    self._publish("roster", self._changes(ids))
+            except Exception:
+                log.exception("roster feed update failed")
+
+    def _changes(self, ids):
+        with db_cursor() as cur:
+            cur.execute(ROSTER_SELECT + " WHERE e.id = ANY(%s)", (sorted(ids),))
+            rows = cur.fetchall()
+        self.queries += 1
+        html = self.render_rows(rows) if self.render_rows else [None] * len(rows)
+        return {
+            "rows": [dict(roster_json(r), html=h) for r, h in zip(rows, html)],
+            "removed": sorted(ids - {r[0] for r in rows}),
+        }
+
+    def _publish(self, name, data):
+        self.seq += 1
+        with self._wake:
+            subs = list(self._subs.values())
+        for deliver in subs:
+            deliver(self.seq, name, data)
+
+    # ─────────── SSE bodies ───────────
+    def stream(self):
+        """Blocking SSE generator for a threaded WSGI server."""
+        inbox = queue.Queue(SSE_QUEUE)
+
+        def deliver(seq, name, data):
+            try:
+                inbox.put_nowait((seq, name, data))
+            except queue.Full:
+                pass                   # noticed below: the client reloads
+
+        token = self.subscribe(deliver)
+        try:
+            yield "retry: 5000\n: connected\n\n"
+            while True:
+                if inbox.full():
+                    yield sse(self.seq, "reload", {})
+                    return
+                try:
+                    event = inbox.get(timeout=SSE_HEARTBEAT)
+                except queue.Empty:
+                    yield ": ping\n\n"
+                    continue
+                yield sse(*event)
+        finally:
+            self.unsubscribe(token)
+
+    async def astream(self):
+        """The same stream for an asyncio server, one task per admin."""
+        loop = asyncio.get_running_loop()
+        inbox = asyncio.Queue(SSE_QUEUE)
+
+        def put(event):
+            if not inbox.full():
+                inbox.put_nowait(event)
+
+        def deliver(seq, name, data):
+            loop.call_soon_threadsafe(put, (seq, name, data))
+
+        token = self.subscribe(deliver)
+        try:
+            yield "retry: 5000\n: connected\n\n"
+            while True:
+                if inbox.full():
+                    yield sse(self.seq, "reload", {})
+                    return
+                try:
+                    event = await asyncio.wait_for(inbox.get(), SSE_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                yield sse(*event)
+        finally:
+            self.unsubscribe(token)
+
+    def stats(self):
+        return {"subscribers": len(self._subs), "events": self.seq, "queries": self.queries}
+
+
+feed = RosterFeed()
@@ -0,0 +1,48 @@
+import os
+import sys
+
+import pytest
+
+# the modules live at the repo root, not in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("SECRET_KEY", "test-secret")
+
+
+@pytest.fixture
+def pg():
+    """A connection to DATABASE_URL (migrated schema) whose work is rolled
+    back afterwards; the test is skipped without one."""
+    if not os.getenv("DATABASE_URL"):
+        pytest.skip("DATABASE_URL not set")
+    import psycopg2
+    from db import open_connection
+    try:
+        conn = open_connection()
+    except psycopg2.OperationalError as e:
+        pytest.skip(f"database unavailable: {e}")
+    try:
+        yield conn
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+@pytest.fixture
+def cur(pg):
+    return pg.cursor()
+
+
+@pytest.fixture
+def make_employee(cur):
+    """Insert an employee inside the test's transaction; returns its id."""
+    made = []
+
+    def make(**fields):
+        fields.setdefault("name", f"Test Employee {len(made)}")
+        fields.setdefault("emp_code", f"PYTEST-{os.getpid()}-{len(made)}")
+        cols = ", ".join(fields)
+        cur.execute(f"INSERT INTO employee ({cols}) VALUES ({', '.join(['%s'] * len(fields))})"
+                    " RETURNING id", list(fields.values()))
+        made.append(cur.fetchone()[0])
+        return made[-1]
+    return make
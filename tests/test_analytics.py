@@ -0,0 +1,43 @@
+import struct
+from datetime import date
+
+import pytest
+
+from analytics import _NO_TIME, _PG_EPOCH, _SIGNATURE, _parse_copy
+
+
+def copy_buffer(rows):
+    """What COPY ... TO STDOUT (FORMAT binary) sends for _COPY_SQL."""
+    out = bytearray(_SIGNATURE + struct.pack(">ii", 0, 0))
+    for emp_id, day, t_in, t_out, absent in rows:
+        out += struct.pack(">h", 5)
+        out += struct.pack(">ii", 4, emp_id)
+        out += struct.pack(">ii", 4, (day - _PG_EPOCH).days)
+        out += struct.pack(">iq", 8, _NO_TIME if t_in is None else t_in)
+        out += struct.pack(">iq", 8, _NO_TIME if t_out is None else t_out)
+        out += struct.pack(">iB", 1, absent)
+    out += struct.pack(">h", -1)
+    return bytes(out)
+
+
+def test_parse_copy():
+    nine = 9 * 3600 * 10**6
+    cols = _parse_copy(copy_buffer([
+        (7, date(2026, 3, 2), nine, nine + 8 * 3600 * 10**6, False),
+        (8, date(2026, 3, 4), None, None, True),
+    ]), date(2026, 3, 1))
+    assert cols["emp_id"].tolist() == [7, 8]
+    assert cols["day"].tolist() == [1, 3]
+    assert cols["t_in"].tolist() == [nine, -1]
+    assert cols["t_out"].tolist() == [nine + 8 * 3600 * 10**6, -1]
+    assert cols["absent"].tolist() == [False, True]
+
+
+def test_parse_copy_empty():
+    cols = _parse_copy(copy_buffer([]), date(2026, 3, 1))
+    assert len(cols["emp_id"]) == 0
+
+
+def test_parse_copy_rejects_other_input():
+    with pytest.raises(ValueError):
+        _parse_copy(b"emp_id,date\n1,2026-03-01\n", date(2026, 3, 1))
@@ -0,0 +1,55 @@
+import json
+import logging
+import os
+
+import pytest
+
+import applog
+from applog import Overrides
+
+
+@pytest.fixture
+def levels_file(tmp_path, monkeypatch):
+    path = tmp_path / "instance" / "log-levels.json"
+    monkeypatch.setattr(applog, "LOG_LEVELS_FILE", str(path))
+    root = logging.getLogger()
+    monkeypatch.setattr(root, "level", root.level)
+    return path
+
+
+def test_default_file_is_inside_the_app():
+    app_dir = os.path.dirname(os.path.abspath(applog.__file__))
+    assert os.path.commonpath([app_dir, applog.LOG_LEVELS_FILE]) == app_dir
+
+
+def test_update_reaches_other_workers(levels_file):
+    Overrides().update(levels={"apply_leave": "debug"}, sample={"punch_mobile": 1.0})
+    assert oct(levels_file.parent.stat().st_mode & 0o777) == "0o700"
+    other = Overrides()
+    other.refresh()
+    assert other.level_for("apply_leave") == logging.DEBUG
+    assert other.sample_for("punch_mobile") == 1.0
+
+
+def test_bad_entries_are_skipped(levels_file, caplog):
+    levels_file.parent.mkdir()
+    levels_file.write_text(json.dumps({
+        "levels": {"apply_leave": "DEBUG", "login_pin": "LOUD", "punch_mobile": 5},
+        "sample": {"login_pin": 0.5, "mobile_whoami": "all", "punch_mobile": 7},
+    }))
+    overrides = Overrides()
+    overrides.refresh()
+    assert overrides.levels == {"apply_leave": logging.DEBUG}
+    assert overrides.sample_for("login_pin") == 0.5
+    assert overrides.sample_for("punch_mobile") == applog.DEFAULT_SAMPLE["punch_mobile"]
+    assert len([r for r in caplog.records if r.name == "applog"]) == 4
+
+
+@pytest.mark.parametrize("doc", [[], {"levels": ["DEBUG"]}, {"sample": 1}])
+def test_wrong_shapes_are_ignored(levels_file, doc):
+    levels_file.parent.mkdir()
+    levels_file.write_text(json.dumps(doc))
+    overrides = Overrides()
+    overrides.refresh()
+    assert overrides.levels == {}
+    assert overrides.sample_for("login_pin") == applog.DEFAULT_SAMPLE["login_pin"]
@@ -0,0 +1,137 @@
+import contextlib
+import threading
+
+import pytest
+from werkzeug.security import check_password_hash, generate_password_hash
+
+import credentials
+from credentials import CredentialsBusy, HashPool
+
+FAST = "pbkdf2:sha256:1000"
+
+
+@pytest.fixture
+def fast(monkeypatch):
+    """A cheap PASSWORD_HASH, a private pool and a count of hash checks."""
+    monkeypatch.setattr(credentials, "PASSWORD_HASH", FAST)
+    credentials._dummy.cache_clear()
+    pool = HashPool(workers=2, queue=4)
+    monkeypatch.setattr(credentials, "pool", pool)
+    checks = []
+
+    def counting(stored, raw):
+        checks.append(stored)
+        return check_password_hash(stored, raw)
+    monkeypatch.setattr(credentials, "check_password_hash", counting)
+    yield checks, pool
+    if pool._executor:
+        pool._executor.shutdown(wait=True)
+    credentials._dummy.cache_clear()
+
+
+@pytest.fixture
+def updates(monkeypatch):
+    """The rehash UPDATEs, captured instead of run."""
+    seen = []
+
+    class Cursor:
+        def execute(self, sql, params=None):
+            seen.append((" ".join(sql.split()), params))
+
+    @contextlib.contextmanager
+    def fake_cursor(commit=False):
+        yield Cursor()
+    monkeypatch.setattr(credentials, "db_cursor", fake_cursor)
+    return seen
+
+
+def _settle(pool):
+    pool._executor.shutdown(wait=True)      # background rehashes are done
+    pool._pid = None
+
+
+def test_every_path_costs_one_hash(fast, updates):
+    checks, _ = fast
+    stored = credentials.hash_password("right")
+    assert credentials.verify("employee", 1, stored, "right")
+    assert not credentials.verify("employee", 1, stored, "wrong")
+    assert credentials.verify("employee", 2, "plain", "plain")
+    assert not credentials.verify("employee", 2, "plain", "wrong")
+    assert not credentials.verify("admin", None, None, "anything")
+    assert len(checks) == 5
+    assert checks.count(stored) == 2     # the other three ran against the dummy
+
+
+def test_unknown_table(fast):
+    with pytest.raises(ValueError):
+        credentials.verify("sessions", 1, "x", "x")
+
+
+def test_plain_text_is_rehashed(fast, updates):
+    _, pool = fast
+    assert credentials.verify("employee", 7, "secret", "secret")
+    _settle(pool)
+    (sql, (new, emp_id, old)), = updates
+    assert sql == "UPDATE employee SET password = %s WHERE id = %s AND password = %s"
+    assert (emp_id, old) == (7, "secret")
+    assert new.startswith(FAST + "$") and check_password_hash(new, "secret")
+
+
+def test_old_method_is_rehashed_current_one_is_not(fast, updates):
+    _, pool = fast
+    old = generate_password_hash("pw", method="pbkdf2:sha256:500")
+    current = credentials.hash_password("pw")
+    assert credentials.verify("admin", 3, old, "pw")
+    assert credentials.verify("admin", 4, current, "pw")
+    assert not credentials.verify("admin", 5, "plain", "wrong")
+    _settle(pool)
+    assert [params[1:] for _, params in updates] == [(3, old)]
+
+
+def test_rehash_never_overwrites_a_changed_password(pg, cur, make_employee, monkeypatch):
+    monkeypatch.setattr(credentials, "PASSWORD_HASH", FAST)
+
+    @contextlib.contextmanager
+    def in_test_transaction(commit=False):
+        yield cur
+    monkeypatch.setattr(credentials, "db_cursor", in_test_transaction)
+    emp_id = make_employee(password="changed since")
+    credentials._rehash("employee", emp_id, "what the login read", "what the login read")
+    cur.execute("SELECT password FROM employee WHERE id = %s", (emp_id,))
+    assert cur.fetchone()[0] == "changed since"
+
+    credentials._rehash("employee", emp_id, "changed since", "changed since")
+    cur.execute("SELECT password FROM employee WHERE id = %s", (emp_id,))
+    assert check_password_hash(cur.fetchone()[0], "changed since")
+
+
+def test_full_queue_refuses_fast(fast):
+    pool = HashPool(workers=1, queue=1)
+    gate = threading.Event()
+    try:
+        running = pool.submit(gate.wait)
+        waiting = pool.submit(gate.wait)
+        with pytest.raises(CredentialsBusy):
+            pool.submit(gate.wait)
+        assert pool.stats() == {"workers": 1, "refused": 1}
+        gate.set()
+        running.result(timeout=5)
+        waiting.result(timeout=5)
+        _settle(pool)                       # slots come back in done-callbacks
+        assert pool.submit(lambda: "free again").result(timeout=5) == "free again"
+    finally:
+        gate.set()
+        pool._executor.shutdown(wait=True)
+
+
+def test_busy_login_is_refused(fast, monkeypatch):
+    full = HashPool(workers=1, queue=0)
+    gate = threading.Event()
+    monkeypatch.setattr(credentials, "pool", full)
+    try:
+        full.submit(gate.wait)
+        with pytest.raises(CredentialsBusy):
+            credentials.verify("employee", 1, "plain", "plain")
+    finally:
+        gate.set()
+        full._executor.shutdown(wait=True)
@@ -0,0 +1,139 @@
+from types import SimpleNamespace
+
+import psycopg2
+import pytest
+from psycopg2 import extensions
+
+import db
+from db import ConnectionPool, PoolTimeout
+
+
+class FakeConn:
+    opened = 0
+
+    def __init__(self, fail_ping=False):
+        FakeConn.opened += 1
+        self.closed = 0
+        self.fail_ping = fail_ping
+        self.rollbacks = 0
+        self.info = SimpleNamespace(transaction_status=extensions.TRANSACTION_STATUS_IDLE)
+
+    def cursor(self):
+        conn = self
+
+        class Cursor:
+            def execute(self, sql, params=None):
+                if conn.fail_ping:
+                    raise psycopg2.OperationalError("server closed the connection")
+
+            def close(self):
+                pass
+        return Cursor()
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.info.transaction_status = extensions.TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = 1
+
+
+def pool(**kw):
+    kw.setdefault("factory", FakeConn)
+    kw.setdefault("timeout", 0.05)
+    return ConnectionPool(**kw)
+
+
+def test_reuses_the_last_returned_connection():
+    p = pool(maxconn=2)
+    a, b = p.getconn(), p.getconn()
+    p.putconn(a)
+    p.putconn(b)
+    assert p.getconn() is b
+    assert p.stats()["created"] == 2
+
+
+def test_bounded():
+    p = pool(maxconn=1)
+    conn = p.getconn()
+    with pytest.raises(PoolTimeout):
+        p.getconn()
+    p.putconn(conn)
+    assert p.getconn() is conn
+    stats = p.stats()
+    assert (stats["timeouts"], stats["in_use"], stats["size"]) == (1, 1, 1)
+
+
+def test_open_transaction_is_rolled_back_on_return():
+    p = pool()
+    conn = p.getconn()
+    conn.info.transaction_status = extensions.TRANSACTION_STATUS_INTRANS
+    p.putconn(conn)
+    assert conn.rollbacks == 1
+    assert p.getconn() is conn
+
+
+def test_old_connections_are_recycled():
+    p = pool(max_lifetime=0.01)
+    conn = p.getconn()
+    p._born[id(conn)] -= 1
+    p.putconn(conn)
+    assert conn.closed
+    assert p.stats()["recycled"] == 1
+    assert p.getconn() is not conn
+
+
+def test_dead_idle_connection_is_replaced():
+    p = pool(health_idle=0, factory=lambda: FakeConn(fail_ping=FakeConn.opened == 0))
+    FakeConn.opened = 0
+    conn = p.getconn()
+    p.putconn(conn)
+    fresh = p.getconn()
+    assert fresh is not conn and conn.closed
+    assert p.stats()["discarded"] == 1
+
+
+def test_failed_connect_frees_its_slot():
+    def refuse():
+        raise psycopg2.OperationalError("connection refused")
+    p = pool(maxconn=1, factory=refuse)
+    for _ in range(2):
+        with pytest.raises(psycopg2.OperationalError):
+            p.getconn()
+    assert p.stats()["size"] == 0
+
+
+def test_prefill_opens_minconn():
+    p = pool(minconn=3)
+    p.prefill()
+    stats = p.stats()
+    assert (stats["idle"], stats["created"]) == (3, 3)
+
+
+def test_get_pool_prefills_and_survives_a_down_database(monkeypatch):
+    made = []
+
+    def refuse():
+        raise psycopg2.OperationalError("connection refused")
+    monkeypatch.setattr(db, "_pool", None)
+    monkeypatch.setattr(db, "ConnectionPool",
+                        lambda: made.append(pool(minconn=2)) or made[-1])
+    assert db.get_pool().stats()["idle"] == 2
+    monkeypatch.setattr(db, "_pool", None)
+    monkeypatch.setattr(db, "ConnectionPool", lambda: pool(minconn=2, factory=refuse))
+    assert db.get_pool().stats()["size"] == 0
+
+
+def test_db_cursor_commits_and_returns(monkeypatch):
+    p = pool()
+    commits = []
+    monkeypatch.setattr(FakeConn, "commit", lambda self: commits.append(self), raising=False)
+    monkeypatch.setattr(db, "get_pool", lambda: p)
+    with db.db_cursor(commit=True):
+        pass
+    with pytest.raises(ZeroDivisionError):
+        with db.db_cursor(commit=True):
+            1 / 0
+    assert len(commits) == 1
+    stats = p.stats()
+    assert (stats["in_use"], stats["idle"]) == (0, 1)
@@ -0,0 +1,103 @@
+from contextlib import contextmanager
+
+import pytest
+
+import employee_search
+from employee_search import EmployeeIndex
+
+STAFF = [
+    (1, "Asha Rao", "E100"),
+    (2, "Ravi Kumar", "E101"),
+    (3, "Kumaran S", "OPS-7"),
+    (4, "Sita  Ravindran", "E200"),
+]
+STAFF_BY_NAME = sorted(STAFF, key=lambda r: " ".join(r[1].lower().split()))
+
+
+@pytest.fixture
+def index(monkeypatch):
+    table = list(STAFF)
+    loads = []
+
+    @contextmanager
+    def db_cursor(commit=False):
+        class Cursor:
+            def execute(self, sql, params=None):
+                loads.append(sql)
+
+            def fetchall(self):
+                return list(table)
+        yield Cursor()
+
+    class Bus:
+        def subscribe(self, channel, fn):
+            pass
+
+        def start(self):
+            pass
+    monkeypatch.setattr(employee_search, "db_cursor", db_cursor)
+    monkeypatch.setattr(employee_search, "bus", Bus())
+    index = EmployeeIndex()
+    index.table, index.loads = table, loads
+    return index
+
+
+def ids(rows):
+    return [r[0] for r in rows]
+
+
+def test_typeahead_ranks_code_then_name_prefix_then_substring(index):
+    assert ids(index.search("e101")) == [2]
+    assert ids(index.search("kum")) == [3, 2]          # name prefix before word prefix
+    assert ids(index.search("avi")) == [2, 4]          # substring, by name
+    assert ids(index.search("ra")) == [2, 1, 4]        # short: word prefixes only
+    assert index.search("  ") == []
+
+
+def test_typeahead_limit(index):
+    assert len(index.search("e", limit=1)) == 1
+    assert len(index.search("e", limit=0)) == 1
+    assert len(index.search("e", limit=1000)) == 3
+
+
+def test_find_keeps_ilike_semantics(index):
+    assert index.find("") == (STAFF_BY_NAME, 4)
+    assert ids(index.find("a")[0]) == [1, 3, 2, 4]     # substring even when short
+    assert ids(index.find("7")[0]) == [3]
+    assert ids(index.find("SITA RAV")[0]) == [4]       # whitespace normalised
+    assert index.find("nobody") == ([], 0)
+
+
+def test_find_reports_the_total_past_the_limit(index):
+    rows, total = index.find("e", limit=2)
+    assert (len(rows), total) == (2, 3)
+
+
+def test_rebuilds_on_employee_notify_only(index):
+    index.search("asha")
+    index.table.append((5, "Asha Menon", "E300"))
+    index._on_notify("attendance")
+    assert ids(index.search("asha")) == [1]
+    index._on_notify("employee")
+    assert ids(index.search("asha")) == [5, 1]
+    assert len(index.loads) == 2
+
+
+def test_rebuilds_after_the_ttl(index, monkeypatch):
+    index.search("asha")
+    monkeypatch.setattr(employee_search, "SEARCH_INDEX_TTL", -1)
+    index.search("asha")
+    assert index.rebuilds == 2
+
+
+def test_failed_build_is_retried(index, monkeypatch):
+    @contextmanager
+    def down(commit=False):
+        raise RuntimeError("database down")
+        yield
+    real = employee_search.db_cursor
+    monkeypatch.setattr(employee_search, "db_cursor", down)
+    with pytest.raises(RuntimeError):
+        index.search("asha")
+    monkeypatch.setattr(employee_search, "db_cursor", real)
+    assert ids(index.search("asha")) == [1]
@@ -0,0 +1,101 @@
+import csv
+import io
+import zipfile
+from contextlib import contextmanager
+from datetime import date, time
+from xml.etree import ElementTree
+
+import pytest
+
+import exports
+from exports import ExportError, csv_stream, filename, parse_range, xlsx_stream
+
+TODAY = date(2026, 2, 14)
+ROWS = [
+    (1, "Asha", date(2026, 2, 2), time(9, 5), time(17, 30), "Gate|1|2", None, False, None),
+    (1, "Asha", date(2026, 2, 3), None, None, None, None, True, "sick <fever> & rest"),
+    (2, "Ravi", None, None, None, None, None, None, None),        # no rows in range
+]
+
+
+def test_parse_range():
+    assert parse_range({}, TODAY) == (date(2026, 2, 1), date(2026, 2, 28))
+    assert parse_range({"month": "2024-02"}, TODAY) == (date(2024, 2, 1), date(2024, 2, 29))
+    assert parse_range({"from": "2026-01-30", "to": "2026-02-02"}, TODAY) == \
+        (date(2026, 1, 30), date(2026, 2, 2))
+
+
+@pytest.mark.parametrize("args, message", [
+    ({"month": "2026-13"}, "month must be YYYY-MM"),
+    ({"from": "2026-02-01"}, "to must be YYYY-MM-DD"),
+    ({"from": "2026-02-05", "to": "2026-02-01"}, "to is before from"),
+    ({"from": "2000-01-01", "to": "2026-01-01"}, "range is limited"),
+])
+def test_parse_range_errors(args, message):
+    with pytest.raises(ExportError, match=message):
+        parse_range(args, TODAY)
+
+
+def test_filename():
+    assert filename(date(2026, 2, 1), date(2026, 2, 28), "csv") == "attendance-2026-02.csv"
+    assert filename(date(2026, 1, 30), date(2026, 2, 2), "xlsx") == \
+        "attendance-20260130-20260202.xlsx"
+
+
+def test_csv_streams_one_piece_per_chunk():
+    pieces = list(csv_stream([ROWS[:1], ROWS[1:]]))
+    assert len(pieces) == 2
+    table = list(csv.reader(io.StringIO("".join(pieces))))
+    assert table[0] == exports.HEADER
+    assert table[1] == ["1", "Asha", "2026-02-02", "09:05:00", "17:30:00", "Gate|1|2", "", "No", ""]
+    assert table[2][7:] == ["Yes", "sick <fever> & rest"]
+    assert table[3] == ["2", "Ravi", "", "", "", "", "", "", ""]
+
+
+def test_csv_without_rows_is_just_the_header():
+    assert list(csv.reader(io.StringIO("".join(csv_stream([]))))) == [exports.HEADER]
+
+
+def sheet_rows(data):
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        assert zf.testzip() is None
+        assert {"[Content_Types].xml", "xl/workbook.xml"} <= set(zf.namelist())
+        root = ElementTree.fromstring(zf.read("xl/worksheets/sheet1.xml"))
+    ns = {"s": "http://schemas.openxmlformats.org/spreadsheetml/2006/main"}
+    return [[c.findtext("s:v", namespaces=ns) or c.findtext("s:is/s:t", namespaces=ns)
+             for c in row] for row in root.iterfind(".//s:row", ns)]
+
+
+def test_xlsx_is_a_valid_workbook():
+    rows = sheet_rows(b"".join(xlsx_stream([ROWS[:1], ROWS[1:]])))
+    assert rows[0] == exports.HEADER
+    assert rows[1][:3] == ["1", "Asha", "2026-02-02"]
+    assert rows[2][8] == "sick <fever> & rest"
+    assert len(rows) == 4
+
+
+def test_xlsx_streams_before_the_end():
+    stream = xlsx_stream([[ROWS[0]] * 2000] * 3)
+    first = next(stream)
+    assert first.startswith(b"PK")             # the zip is on its way already
+    rest = b"".join(stream)
+    assert rest
+    assert len(sheet_rows(first + rest)) == 6001
+
+
+def test_report_chunks(pg, cur, make_employee, monkeypatch):
+    @contextmanager
+    def db_conn():
+        yield pg
+    monkeypatch.setattr(exports, "db_conn", db_conn)
+    present, missing = make_employee(name="Present"), make_employee(name="Missing")
+    for day in (date(2026, 10, 1), date(2026, 10, 2)):
+        cur.execute("INSERT INTO attendance (emp_id, date, time_in) VALUES (%s, %s, '09:00')",
+                    (present, day))
+    chunks = list(exports.report_chunks(date(2026, 10, 1), date(2026, 10, 31), chunk=500))
+    assert all(len(c) <= 500 for c in chunks)
+    rows = [r for c in chunks for r in c]
+    assert [r[0] for r in rows] == sorted(r[0] for r in rows)
+    mine = [(r[1], r[2]) for r in rows if r[0] in (present, missing)]
+    assert mine == [("Present", date(2026, 10, 1)), ("Present", date(2026, 10, 2)),
+                    ("Missing", None)]
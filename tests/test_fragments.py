@@ -0,0 +1,73 @@
+from contextlib import contextmanager
+
+import psycopg2
+import pytest
+
+import fragments
+from fragments import DataVersions, etag
+
+
+def fake_db(row=None, error=None):
+    @contextmanager
+    def db_cursor(commit=False):
+        if error:
+            raise error
+
+        class Cursor:
+            def execute(self, sql, params=None):
+                pass
+
+            def fetchone(self):
+                return row
+        yield Cursor()
+    return db_cursor
+
+
+def test_current_reads_the_version(monkeypatch):
+    monkeypatch.setattr(fragments, "db_cursor", fake_db(row=(42,)))
+    versions = DataVersions()
+    assert versions.current() == 42
+    assert (versions.reads, versions.failures, versions.last) == (1, 0, 42)
+
+
+@pytest.mark.parametrize("row, error", [
+    (None, None),
+    (None, psycopg2.OperationalError("down")),
+])
+def test_current_falls_back_to_the_clock(monkeypatch, row, error):
+    monkeypatch.setattr(fragments, "db_cursor", fake_db(row=row, error=error))
+    monkeypatch.setattr(fragments.time, "time", lambda: 1000.0)
+    versions = DataVersions()
+    assert versions.current() == ("t", int(1000 // fragments.DASHBOARD_TTL))
+    assert versions.failures == (1 if error else 0)
+    assert versions.last is None
+
+
+def test_etag():
+    assert etag("chart", 42) == etag("chart", 42)
+    assert etag("chart", 42) != etag("chart", 43)
+    assert etag("chart", 42) != etag("absent", 42)
+    assert len(etag(("t", 1))) == 24
+
+
+def test_empty_table_falls_back_to_the_clock(monkeypatch):
+    monkeypatch.setattr(fragments, "db_cursor", fake_db(row=(None,)))
+    assert DataVersions().current()[0] == "t"
+
+
+def test_concurrent_writers_do_not_queue_on_the_version(pg):
+    from db import open_connection
+    other = open_connection()
+    try:
+        first, second = pg.cursor(), other.cursor()
+        start = DataVersions().current()
+        first.execute(fragments.BUMP_VERSION)
+        # a single version row would make this wait for `first` to commit
+        second.execute("SET LOCAL lock_timeout = '1s'")
+        second.execute(fragments.BUMP_VERSION)
+        other.commit()
+        assert DataVersions().current() == start + 1
+        pg.commit()
+        assert DataVersions().current() == start + 2
+    finally:
+        other.close()
@@ -0,0 +1,100 @@
+from datetime import date, datetime, time, timedelta, timezone
+
+import pytest
+
+import history
+import partitions
+from history import HistoryError, fetch_page, parse_args, split_page
+
+HOT = [date(2026, 10, 1) + timedelta(days=i) for i in range(6)]         # newest last
+ARCHIVED = [date(2019, 1, 10), date(2019, 1, 20)]                       # one archived month
+
+
+def opts(**kw):
+    return {**parse_args({}), **kw}
+
+
+def test_parse_args():
+    assert parse_args({})["limit"] == history.HISTORY_DEFAULT_LIMIT
+    assert parse_args({"limit": "100000"})["limit"] == history.HISTORY_MAX_LIMIT
+    assert parse_args({"limit": "0"})["limit"] == 1
+    parsed = parse_args({"before": "2026-10-05", "changed_since": "2026-10-05T08:00:00Z"})
+    assert parsed["before"] == date(2026, 10, 5)
+    assert parsed["changed_since"] == datetime(2026, 10, 5, 8, tzinfo=timezone.utc)
+    for bad in ({"limit": "ten"}, {"before": "05/10/2026"}, {"changed_since": "soon"}):
+        with pytest.raises(HistoryError):
+            parse_args(bad)
+
+
+def test_split_page(monkeypatch):
+    monkeypatch.setattr(history, "LEAVE_LIMIT", 2)
+    rows = [(d,) for d in reversed(HOT)]
+    page = split_page(rows, ["l1", "l2", "l3"], opts(limit=5))
+    assert page == (rows[:5], ["l1", "l2"], HOT[1], True)
+    assert split_page(rows, ["l1"], opts(limit=6)) == (rows, ["l1"], None, False)
+
+
+@pytest.fixture
+def emp(cur, make_employee):
+    emp_id = make_employee()
+    for day in HOT:
+        cur.execute("INSERT INTO attendance (emp_id, date, time_in) VALUES (%s, %s, %s)",
+                    (emp_id, day, time(9, 0)))
+    n = len(ARCHIVED)
+    cur.execute("""
+        INSERT INTO attendance_archive (emp_block, month, last_updated, id, emp_id, date,
+            time_in, time_out, location_in, location_out, absent, reason, auth_method,
+            updated_at)
+        VALUES (%s, '2019-01-01', now(), %s::int[], %s::int[], %s::date[], %s::time[],
+                %s::time[], %s::text[], %s::text[], %s::bool[], %s::text[], %s::text[],
+                %s::timestamptz[])
+    """, (emp_id // partitions.ARCHIVE_BLOCK, list(range(-n, 0)), [emp_id] * n, ARCHIVED,
+          [time(9, 0)] * n, [None] * n, [None] * n, [None] * n, [False] * n, [None] * n,
+          [None] * n, [datetime(2019, 2, 1, tzinfo=timezone.utc)] * n))
+    return emp_id
+
+
+def pages(cur, emp_id, limit):
+    before, seen = None, []
+    while True:
+        rows, _, next_cursor, _, _ = fetch_page(cur, emp_id, opts(limit=limit, before=before))
+        seen.append([r[0] for r in rows])
+        if next_cursor is None:
+            return seen
+        before = next_cursor
+
+
+def test_keyset_pages_run_into_the_archive(cur, emp):
+    assert pages(cur, emp, 3) == [HOT[:2:-1], HOT[2::-1], ARCHIVED[::-1]]
+    assert pages(cur, emp, 4) == [HOT[:1:-1], HOT[1::-1] + ARCHIVED[::-1]]
+
+
+def test_exact_fit_has_no_next_page(cur, emp):
+    rows, _, next_cursor, _, _ = fetch_page(cur, emp, opts(limit=len(HOT) + len(ARCHIVED)))
+    assert len(rows) == 8 and next_cursor is None
+
+
+def test_date_window(cur, emp):
+    rows, _, _, _, _ = fetch_page(cur, emp, opts(since=date(2019, 1, 15), until=HOT[1]))
+    assert [r[0] for r in rows] == [HOT[1], HOT[0], ARCHIVED[1]]
+
+
+def test_changed_since(cur, emp):
+    cur.execute("SELECT now()")
+    now = cur.fetchone()[0]
+    rows, _, _, _, watermark = fetch_page(cur, emp, opts(changed_since=now))
+    assert len(rows) == len(HOT)           # touched in this transaction; archive is older
+    assert watermark == now
+    rows, _, _, _, _ = fetch_page(cur, emp, opts(changed_since=now + timedelta(hours=1)))
+    assert rows == []
+
+
+def test_leaves_ride_on_the_first_page(cur, emp, monkeypatch):
+    monkeypatch.setattr(history, "LEAVE_LIMIT", 2)
+    for day in HOT[:3]:
+        cur.execute("INSERT INTO leaves (emp_id, from_date, to_date, reason) "
+                    "VALUES (%s, %s, %s, 'x')", (emp, day, day))
+    _, leave_rows, next_cursor, leave_more, _ = fetch_page(cur, emp, opts(limit=2))
+    assert [r[0] for r in leave_rows] == [HOT[2], HOT[1]] and leave_more
+    _, leave_rows, _, _, _ = fetch_page(cur, emp, opts(limit=2, before=next_cursor))
+    assert leave_rows == []
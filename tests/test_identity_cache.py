@@ -0,0 +1,122 @@
+from types import SimpleNamespace
+
+import pytest
+
+import identity_cache
+from identity_cache import TTLCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(identity_cache, "time", SimpleNamespace(monotonic=lambda: now[0]))
+    return now
+
+
+def test_get_set_and_counters(clock):
+    cache = TTLCache(maxsize=10, ttl=60)
+    assert cache.get("a", None) is None
+    cache.set("a", 1)
+    assert cache.get("a") == 1
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_cached_none_is_a_hit(clock):
+    cache = TTLCache(maxsize=10, ttl=60)
+    cache.set("unknown pin", None)
+    assert cache.get("unknown pin", "miss") is None
+
+
+def test_entries_expire(clock):
+    cache = TTLCache(maxsize=10, ttl=60)
+    cache.set("a", 1)
+    clock[0] += 59
+    assert cache.get("a") == 1
+    clock[0] += 2
+    assert cache.get("a", None) is None
+    assert len(cache) == 0
+
+
+def test_least_recently_used_goes_first(clock):
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b", None) is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+
+
+def test_clear(clock):
+    cache = TTLCache(maxsize=10, ttl=60)
+    cache.set("a", 1)
+    cache.clear()
+    assert cache.get("a", None) is None
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    """An IdentityCache on a fake database that records its queries."""
+    from contextlib import contextmanager
+    queries = []
+    rows = {"1234": ("employee", 7, "Asha", "E7"), "9999": ("admin", 1, "root", None)}
+
+    @contextmanager
+    def db_cursor(commit=False):
+        class Cursor:
+            def execute(self, sql, params):
+                queries.append(params)
+                self.row = (rows.get(params[0]) if "pin" in sql
+                            else (7, "Asha", "E7", None, None, "Ops", "Lead"))
+
+            def fetchone(self):
+                return self.row
+        yield Cursor()
+    monkeypatch.setattr(identity_cache, "db_cursor", db_cursor)
+    monkeypatch.setattr(identity_cache, "IDENTITY_NOTIFY", False)
+    cache = identity_cache.IdentityCache()
+    cache.queries = queries
+    return cache
+
+
+def test_lookups_hit_the_database_once(cache):
+    assert cache.lookup_pin("1234") == ("employee", (7, "Asha", "E7"))
+    assert cache.employee_by_pin("1234") == (7, "Asha", "E7")
+    assert cache.lookup_pin("9999") == ("admin", (1, "root"))
+    assert cache.employee_by_pin("9999") is None
+    assert cache.lookup_pin("0000") is None
+    assert cache.lookup_pin("0000") is None
+    assert cache.profile_by_code("E7")[5] == "Ops"
+    cache.profile_by_code("E7")
+    assert cache.queries == [("1234", "1234"), ("9999", "9999"), ("0000", "0000"), ("E7",)]
+
+
+def test_invalidation_clears_both_maps_and_dependents(cache):
+    cleared = []
+    cache.on_clear(lambda: cleared.append(1))
+    cache.lookup_pin("1234")
+    cache.profile_by_code("E7")
+    cache.invalidate()
+    assert (len(cache.by_pin), len(cache.by_code), cleared) == (0, 0, [1])
+    cache.lookup_pin("1234")
+    assert len(cache.queries) == 3
+
+
+@pytest.mark.parametrize("payload, clears", [
+    ("employee", True), (None, True), ("attendance", False), ("leaves", False),
+])
+def test_data_changed_notify(cache, payload, clears):
+    cache.lookup_pin("1234")
+    cache._on_data_changed(payload)
+    assert (len(cache.by_pin) == 0) == clears
+
+
+def test_lookup_racing_an_invalidation_is_not_cached(cache, monkeypatch):
+    real = identity_cache.db_cursor
+
+    def invalidated_meanwhile(commit=False):
+        cache.clear_local()          # a writer committed during our query
+        return real(commit)
+    monkeypatch.setattr(identity_cache, "db_cursor", invalidated_meanwhile)
+    assert cache.lookup_pin("1234") == ("employee", (7, "Asha", "E7"))
+    assert len(cache.by_pin) == 0
@@ -0,0 +1,80 @@
+from datetime import date, time
+
+import pytest
+
+import leaves
+from leaves import LeaveError, apply_leaves, validate_range
+
+FRI, SAT, SUN, MON = (date(2026, 10, d) for d in (16, 17, 18, 19))
+
+
+def absent_days(cur, emp_id):
+    cur.execute("""
+        SELECT date, reason, time_in FROM attendance
+         WHERE emp_id = %s AND absent ORDER BY date
+    """, (emp_id,))
+    return cur.fetchall()
+
+
+def test_validate_range():
+    assert validate_range("2026-10-16", "2026-10-19") == (FRI, MON)
+    with pytest.raises(LeaveError, match="before"):
+        validate_range(MON, FRI)
+    with pytest.raises(LeaveError, match="expected YYYY-MM-DD"):
+        validate_range("16/10/2026", MON)
+    with pytest.raises(LeaveError, match="max is"):
+        validate_range(date(2026, 1, 1), date(2026, 12, 31))
+
+
+def test_holidays_file(tmp_path, monkeypatch):
+    path = tmp_path / "holidays.txt"
+    path.write_text("# national\n2026-10-02\n\n2026-10-20  # Diwali\n")
+    monkeypatch.setattr(leaves, "HOLIDAYS_FILE", str(path))
+    monkeypatch.setattr(leaves, "_holidays", None)
+    assert leaves.configured_holidays() == {date(2026, 10, 2), date(2026, 10, 20)}
+
+
+def test_span_writes_one_day_per_date(cur, make_employee):
+    emp = make_employee()
+    assert apply_leaves(cur, [(emp, FRI, MON, "trip")]) == (1, 4, [[emp]])
+    assert [d for d, _, _ in absent_days(cur, emp)] == [FRI, SAT, SUN, MON]
+
+
+def test_weekends_and_holidays_are_skipped(cur, make_employee):
+    emp = make_employee()
+    leave_rows, days, _ = apply_leaves(cur, [(emp, FRI, MON, "trip")],
+                                       skip_weekends=True, holidays={MON})
+    assert (leave_rows, days) == (1, 1)
+    assert [d for d, _, _ in absent_days(cur, emp)] == [FRI]
+
+
+def test_leave_overwrites_a_punch(cur, make_employee):
+    emp = make_employee()
+    cur.execute("INSERT INTO attendance (emp_id, date, time_in) VALUES (%s, %s, %s)",
+                (emp, FRI, time(9, 0)))
+    apply_leaves(cur, [(emp, FRI, FRI, "sick")])
+    assert absent_days(cur, emp) == [(FRI, "sick", None)]
+
+
+def test_overlapping_entries_write_each_day_once(cur, make_employee):
+    emp = make_employee()
+    leave_rows, days, applied = apply_leaves(cur, [(emp, FRI, SAT, "first"),
+                                                   (emp, SAT, MON, "second")])
+    assert (leave_rows, days, applied) == (2, 4, [[emp], [emp]])
+    # the entry reaching furthest wins a shared day
+    assert [r for _, r, _ in absent_days(cur, emp)] == ["first", "second", "second", "second"]
+
+
+def test_unknown_employee_and_company_wide(cur, make_employee):
+    emp = make_employee()
+    cur.execute("SELECT max(id) + 1000, count(*) FROM employee")
+    missing, headcount = cur.fetchone()
+    leave_rows, days, applied = apply_leaves(cur, [(missing, FRI, FRI, "x"),
+                                                   (None, MON, MON, "holiday")])
+    assert applied[0] == []
+    assert emp in applied[1] and len(applied[1]) == headcount
+    assert (leave_rows, days) == (headcount, headcount)
+
+
+def test_no_entries(cur):
+    assert apply_leaves(cur, []) == (0, 0, [])
@@ -0,0 +1,18 @@
+from loadtest import _summary, rejected_runs
+
+
+def test_4xx_are_counted_apart_from_throughput():
+    records = [("punch in", 0.020, 200, 2), ("punch in", 0.001, 429, None),
+               ("punch in", 0.001, 400, 1), ("punch in", 0.030, 500, 2)]
+    r = _summary(records, elapsed=1.0)
+    assert (r["requests"], r["rejected"], r["rate_limited"]) == (4, 2, 1)
+    assert r["rps"] == 2.0
+    assert r["p50_ms"] >= 20          # the fast rejections are not latencies
+    assert r["db_trips_per_request"] == 2
+
+
+def test_mostly_rejected_runs_fail():
+    ok = _summary([("a", 0.01, 200, None)] * 3 + [("a", 0.001, 429, None)], 1.0)
+    limited = _summary([("a", 0.01, 200, None)] + [("a", 0.001, 429, None)] * 3, 1.0)
+    found = rejected_runs({"ok": ok, "limited": limited}, max_rejected=0.5)
+    assert found == [("limited", "3 of 4 answers were 4xx (3 rate limited)")]
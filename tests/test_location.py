@@ -0,0 +1,87 @@
+import sys
+import threading
+from types import ModuleType, SimpleNamespace
+
+import pytest
+
+import location
+from location import (FallbackResolver, GeocoderResolver, IPRangeResolver,
+                      StaticResolver, punch_location)
+
+UNKNOWN = "Unknown|0.0000|0.0000"
+
+
+def test_static():
+    assert StaticResolver("Chennai|13.0827|80.2707").resolve() == "Chennai|13.0827|80.2707"
+    assert StaticResolver("Depot").resolve("10.0.0.1") == "Depot|0.0000|0.0000"
+
+
+@pytest.fixture
+def ip_table(tmp_path):
+    path = tmp_path / "sites.csv"
+    path.write_text("# cidr,city,lat,lng\n"
+                    "10.0.0.0/8,Head office,13.08,80.27\n"
+                    "10.1.0.0/16,Warehouse,12.97,77.59\n"
+                    "2001:db8::/32,Lab,1,2\n")
+    return str(path)
+
+
+def test_ip_range_most_specific_wins(ip_table):
+    resolver = IPRangeResolver(ip_table)
+    assert resolver.resolve("10.1.2.3") == "Warehouse|12.9700|77.5900"
+    assert resolver.resolve("10.9.9.9") == "Head office|13.0800|80.2700"
+    assert resolver.resolve("2001:db8::1") == "Lab|1.0000|2.0000"
+
+
+def test_ip_range_falls_back(ip_table):
+    resolver = IPRangeResolver(ip_table, default=StaticResolver("Site|1|1"))
+    assert resolver.resolve("192.168.1.1") == "Site|1.0000|1.0000"
+    assert resolver.resolve("not an ip") == "Site|1.0000|1.0000"
+    assert resolver.resolve(None) == "Site|1.0000|1.0000"
+    assert IPRangeResolver("/no/such/table").resolve("10.0.0.1") == UNKNOWN
+
+
+@pytest.fixture
+def slow_geocoder(monkeypatch):
+    release = threading.Event()
+    calls = []
+
+    def ip(addr):
+        calls.append(addr)
+        release.wait(5)
+        return SimpleNamespace(city="Pune", latlng=[18.52, 73.85])
+    module = ModuleType("geocoder")
+    module.ip = ip
+    monkeypatch.setitem(sys.modules, "geocoder", module)
+    return release, calls
+
+
+def test_geocoder_never_blocks_the_request(slow_geocoder):
+    release, calls = slow_geocoder
+    resolver = GeocoderResolver(ttl=3600)
+    # lookup still in flight: the fallback, and no second lookup
+    assert resolver.resolve() == UNKNOWN
+    assert resolver.resolve() == UNKNOWN
+    release.set()
+    for _ in range(100):
+        if resolver._value:
+            break
+        threading.Event().wait(0.01)
+    assert resolver.resolve() == "Pune|18.5200|73.8500"
+    assert calls == ["me"]
+
+
+def test_geocoder_failure_keeps_the_fallback(monkeypatch):
+    module = ModuleType("geocoder")
+    module.ip = lambda addr: 1 / 0
+    monkeypatch.setitem(sys.modules, "geocoder", module)
+    resolver = GeocoderResolver(ttl=3600, default=StaticResolver("Site|1|1"))
+    resolver._refresh()
+    assert resolver.resolve() == "Site|1.0000|1.0000"
+
+
+def test_punch_location(monkeypatch):
+    monkeypatch.setattr(location, "_resolver", FallbackResolver())
+    gps = {"latitude": 13.0827, "longitude": 80.2707, "address": "Gate 2"}
+    assert punch_location(gps, "10.0.0.1") == "Gate 2|13.082700|80.270700"
+    assert punch_location(None, "10.0.0.1") == UNKNOWN
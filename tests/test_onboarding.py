@@ -0,0 +1,116 @@
+import pytest
+
+import onboarding
+from onboarding import OnboardingError, PinPool, check_rows, import_employees
+
+
+class FakeCursor:
+    def __init__(self, pins):
+        self.pins = pins
+        self.queries = []
+
+    def execute(self, sql, params=None):
+        self.queries.append((sql, params))
+
+    def fetchall(self):
+        return [(p,) for p in self.pins]
+
+
+def test_pool_marks_pins_in_use():
+    pool = PinPool(FakeCursor(["0000", "0042", "bad", "12345"]), digits=4)
+    assert pool.free == 10_000 - 2
+    assert not pool.claim("0042")
+    assert pool.claim("0043")
+    assert not pool.claim("0043")
+    assert not pool.claim("abcd")
+    assert pool.free == 10_000 - 3
+
+
+def test_pool_takes_the_advisory_lock_first():
+    cur = FakeCursor([])
+    PinPool(cur, digits=4)
+    assert "pg_advisory_xact_lock" in cur.queries[0][0]
+
+
+def test_sparse_draw_skips_used_pins():
+    used = [f"{i:04d}" for i in range(0, 10_000, 2)]
+    pool = PinPool(FakeCursor(used), digits=4)
+    pins = pool.draw(100)
+    assert len(set(pins)) == 100
+    assert all(len(p) == 4 and int(p) % 2 for p in pins)
+    assert pool.free == 5_000 - 100
+
+
+def test_dense_draw_takes_every_free_pin():
+    pool = PinPool(FakeCursor([f"{i:02d}" for i in range(90)]), digits=2)
+    pins = pool.draw(10)
+    assert sorted(pins) == [str(i) for i in range(90, 100)]
+    assert pool.free == 0
+    with pytest.raises(OnboardingError):
+        pool.draw(1)
+
+
+def test_check_rows():
+    results, rows = check_rows([
+        {"name": "A", "emp_code": "E1"},
+        {"name": "B"},
+        {"name": "C", "emp_code": "E1"},
+        {"name": "D", "emp_code": "E4", "pin": "12"},
+        "not a row",
+    ])
+    assert [i for i, _ in rows] == [0]
+    assert results[0] is None
+    assert [r["message"] for r in results[1:]] == [
+        "emp_code required", "emp_code repeats row 0", "pin must be 4 digits",
+        "row must be an object"]
+
+
+# ─────────────── import (database) ───────────────
+def _rows(*rows):
+    return check_rows([dict(r, name=r.get("name", "Import Test")) for r in rows])
+
+
+def test_import_reports_each_row(cur, make_employee):
+    make_employee(emp_code="IMP-TAKEN")
+    taken_pin, = PinPool(cur).draw(1)
+    make_employee(emp_code="IMP-PIN-OWNER", pin=taken_pin)
+
+    results = import_employees(cur, _rows(
+        {"emp_code": "IMP-NEW"},
+        {"emp_code": "IMP-TAKEN"},
+        {"emp_code": "IMP-PIN", "pin": taken_pin},
+        {"emp_code": "IMP-NEW"},
+    ))
+    assert [(r["success"], r["message"]) for r in results] == [
+        (True, "Created"), (False, "emp_code already exists"),
+        (False, "pin already in use"), (False, "emp_code repeats row 0")]
+    cur.execute("SELECT id, pin FROM employee WHERE emp_code = 'IMP-NEW'")
+    assert cur.fetchone() == (results[0]["id"], results[0]["pin"])
+
+
+def test_import_survives_a_pin_taken_under_it(cur, make_employee, monkeypatch):
+    """A writer outside the PIN lock takes the drawn PIN and the file's own
+    PIN after the pool was read: the first is re-drawn, the second reported."""
+    chosen, = PinPool(cur).draw(1)
+    raced = []
+
+    class RacedPool(PinPool):
+        def draw(self, n):
+            pins = super().draw(n)
+            if not raced:
+                raced.extend(pins + [chosen])
+                for i, pin in enumerate(raced):
+                    make_employee(emp_code=f"IMP-RIVAL-{i}", pin=pin)
+            return pins
+
+    monkeypatch.setattr(onboarding, "PinPool", RacedPool)
+    results = import_employees(cur, _rows(
+        {"emp_code": "IMP-DRAWN"},
+        {"emp_code": "IMP-CHOSEN", "pin": chosen},
+    ))
+    assert results[0]["success"] and results[0]["pin"] not in raced
+    assert (results[1]["success"], results[1]["message"]) == (False, "pin already in use")
+    cur.execute("SELECT pin FROM employee WHERE emp_code = 'IMP-DRAWN'")
+    assert cur.fetchone()[0] == results[0]["pin"]
+    cur.execute("SELECT count(*) FROM employee WHERE emp_code = 'IMP-CHOSEN'")
+    assert cur.fetchone()[0] == 0
@@ -0,0 +1,63 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from punch_batch import MAX_BATCH, BatchError, parse_items
+
+NOW = datetime(2026, 1, 5, 9, 0, tzinfo=timezone.utc)
+
+
+def punch(key="k1", **kw):
+    return {"idempotency_key": key, "pin": "1234", "type": "in", **kw}
+
+
+def test_accepts_list_or_object():
+    assert parse_items([punch()], NOW) == parse_items({"punches": [punch()]}, NOW)
+
+
+def test_valid_item():
+    (item,) = parse_items([punch(timestamp="2026-01-05T08:30:00Z",
+                                 location={"latitude": 12.5, "longitude": 77.6})], NOW)
+    assert item["error"] is None
+    assert item["ts"] == datetime(2026, 1, 5, 8, 30, tzinfo=timezone.utc)
+    assert item["location"] == {"latitude": 12.5, "longitude": 77.6, "address": "Unknown"}
+
+
+def test_missing_timestamp_means_now():
+    (item,) = parse_items([punch()], NOW)
+    assert item["ts"] == NOW
+
+
+def test_naive_timestamp_takes_server_zone():
+    (item,) = parse_items([punch(timestamp="2026-01-05T08:30:00")], NOW)
+    assert item["ts"] == datetime(2026, 1, 5, 8, 30, tzinfo=timezone.utc)
+
+
+@pytest.mark.parametrize("raw, error", [
+    (punch(key=""), "idempotency_key required"),
+    (punch(type="sideways"), "type?"),
+    (punch(timestamp="yesterday"), "bad timestamp"),
+    (punch(timestamp=(NOW + timedelta(hours=1)).isoformat()), "timestamp out of range"),
+    (punch(timestamp=(NOW - timedelta(days=8)).isoformat()), "timestamp out of range"),
+    (punch(location="here"), "location must be an object"),
+    ("not an object", "idempotency_key required"),
+])
+def test_bad_items_carry_an_error(raw, error):
+    (item,) = parse_items([raw], NOW)
+    assert item["error"] == error
+
+
+def test_duplicate_key_in_batch():
+    items = parse_items([punch(), punch(type="out")], NOW)
+    assert items[0]["error"] is None
+    assert items[1]["error"] == "duplicate idempotency_key in batch"
+
+
+def test_batch_must_be_a_list():
+    with pytest.raises(BatchError):
+        parse_items({"punches": "nope"}, NOW)
+
+
+def test_batch_size_limit():
+    with pytest.raises(BatchError):
+        parse_items([punch(key=str(i)) for i in range(MAX_BATCH + 1)], NOW)
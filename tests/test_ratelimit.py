@@ -0,0 +1,69 @@
+import pytest
+
+import ratelimit
+from ratelimit import LocalBackend, RateLimiter, client_ip, parse_limit
+
+
+def test_parse_limit():
+    assert parse_limit("20/900") == (20, 900.0)
+    assert parse_limit("5") == (5, 60.0)
+
+
+def test_window_carries_previous_bucket_weighted():
+    backend = LocalBackend()
+    for _ in range(10):
+        backend.add("k", 60, now=30)
+    assert backend.add("k", 60, 0, now=30) == 10
+    # a quarter into the next bucket: 3/4 of the previous bucket still counts
+    assert backend.add("k", 60, 0, now=75) == pytest.approx(7.5)
+    assert backend.add("k", 60, now=75) == pytest.approx(8.5)
+    # two buckets on, the old counts are gone
+    assert backend.add("k", 60, 0, now=185) == 0
+
+
+def test_read_does_not_store():
+    backend = LocalBackend()
+    backend.add("k", 60, 0, now=0)
+    assert len(backend) == 0
+
+
+def test_full_backend_sweeps_idle_keys():
+    backend = LocalBackend(max_keys=2)
+    backend.add("old", 60, now=0)
+    backend.add("older", 60, now=0)
+    backend.add("new", 60, now=500)
+    assert len(backend) == 1
+
+
+@pytest.fixture
+def limiter(monkeypatch):
+    monkeypatch.setattr(ratelimit, "RATE_REQUESTS_IP", (100, 60.0))
+    monkeypatch.setattr(ratelimit, "RATE_REQUESTS_DEVICE", (3, 60.0))
+    monkeypatch.setattr(ratelimit, "RATE_PIN_FAILURES_IP", (10, 900.0))
+    monkeypatch.setattr(ratelimit, "RATE_PIN_FAILURES_DEVICE", (2, 900.0))
+    return RateLimiter(LocalBackend())
+
+
+def test_request_limit_per_device(limiter):
+    for _ in range(3):
+        assert limiter.check("10.0.0.1", "phone", now=0) is None
+    assert limiter.check("10.0.0.1", "phone", now=0) == 60
+    assert limiter.check("10.0.0.1", "other phone", now=0) is None
+    assert limiter.rejected == 1
+
+
+def test_wrong_pins_lock_out_until_the_window_slides(limiter):
+    assert limiter.failure_budget("10.0.0.1", "phone", now=0) == 2
+    limiter.failed("10.0.0.1", "phone", n=2, now=0)
+    assert limiter.failure_budget("10.0.0.1", "phone", now=0) == 0
+    assert limiter.check("10.0.0.1", "phone", now=0) == 900
+    # a bearer token cannot try a PIN, so the lockout does not apply
+    assert limiter.check("10.0.0.1", "phone", now=0, pins=False) is None
+    assert limiter.check("10.0.0.1", "phone", now=1800) is None
+
+
+def test_client_ip_behind_proxies():
+    assert client_ip("10.0.0.9", "1.2.3.4, 5.6.7.8", trusted=0) == "10.0.0.9"
+    assert client_ip("10.0.0.9", "1.2.3.4, 5.6.7.8", trusted=1) == "5.6.7.8"
+    assert client_ip("10.0.0.9", "1.2.3.4, 5.6.7.8", trusted=2) == "1.2.3.4"
+    assert client_ip("10.0.0.9", "1.2.3.4", trusted=2) == "10.0.0.9"
@@ -0,0 +1,62 @@
+import pytest
+
+import tokens
+from tokens import TokenError
+
+
+@pytest.fixture(autouse=True)
+def signing_key(monkeypatch):
+    monkeypatch.setenv("SECRET_KEY", "test-secret")
+    tokens.secret_key.cache_clear()
+    tokens._access.cache_clear()
+    yield
+    tokens.secret_key.cache_clear()
+    tokens._access.cache_clear()
+
+
+EMPLOYEE = tokens.claims_for("employee", (7, "Asha", "E7"))
+
+
+def test_round_trip():
+    assert tokens.verify(tokens.access_token(EMPLOYEE)) == EMPLOYEE
+    header = "Bearer " + tokens.access_token(EMPLOYEE)
+    assert tokens.employee_claims(header) == (7, "Asha", "E7")
+
+
+def test_expired(monkeypatch):
+    token = tokens.access_token(EMPLOYEE)
+    monkeypatch.setattr(tokens, "ACCESS_TOKEN_TTL", -1)
+    with pytest.raises(TokenError, match="expired"):
+        tokens.verify(token)
+
+
+def test_tampered_or_other_key(monkeypatch):
+    token = tokens.access_token(EMPLOYEE)
+    with pytest.raises(TokenError, match="invalid"):
+        tokens.verify(token[:-2] + ("A" if token[-2] != "A" else "B") + token[-1])
+    monkeypatch.setenv("SECRET_KEY", "another-secret")
+    tokens.secret_key.cache_clear()
+    tokens._access.cache_clear()
+    with pytest.raises(TokenError, match="invalid"):
+        tokens.verify(token)
+
+
+def test_headers():
+    assert tokens.from_header(None) is None
+    assert tokens.from_header("Basic abc") is None
+    admin = tokens.access_token(tokens.claims_for("admin", (1, "root")))
+    with pytest.raises(TokenError, match="employee token required"):
+        tokens.employee_claims("Bearer " + admin)
+
+
+def test_token_pair():
+    pair = tokens.token_pair(EMPLOYEE, "refresh")
+    assert pair["token_type"] == "Bearer"
+    assert pair["refresh_token"] == "refresh"
+    assert tokens.verify(pair["access_token"]) == EMPLOYEE
+
+
+def test_session_stores_only_a_digest():
+    refresh, params = tokens.new_session("employee", 7)
+    assert refresh.encode() not in params[0] and len(params[0]) == 32
+    assert params[1:] == ("employee", 7, tokens.REFRESH_TOKEN_TTL)
@@ -0,0 +1,198 @@
+"""Bearer tokens for the mobile API, and the app's signing key.
+
+/login_pin hands out a pair:
+
+    access_token   signed (HMAC-SHA256, itsdangerous) {role, id, name, emp_code},
+                   valid ACCESS_TOKEN_TTL seconds. verify() is a signature
+                   check – no query, no shared state – so /mobile/punch,
+                   /mobile/whoami and /mobile/history authenticate for free.
+    refresh_token  32 random bytes, valid REFRESH_TOKEN_TTL. Only its SHA-256
+                   is stored (auth_session, one narrow row per device).
+                   POST /auth/refresh rotates it – the old one stops working –
+                   and re-reads the user, so a deleted employee gets no new
+                   access tokens; /auth/logout deletes the row.
+
+Expired sessions are swept at most every SESSION_SWEEP_SECONDS, piggybacking
+on a login. An access token cannot be revoked: it lapses within
+ACCESS_TOKEN_TTL.
+
+The signing key (Flask's session cookies too) is SECRET_KEY; without it, one
+random key is generated and kept in auth_secret so every worker shares it.
+If neither can be had the app refuses to start: a key of its own would sign
+tokens and cookies no other worker accepts, and lose them on restart.
+"""
+import hashlib
+import os
+import secrets
+import time
+from functools import lru_cache
+
+from itsdangerous import BadSignature, SignatureExpired, URLSafeTimedSerializer
+
+from db import open_connection
+
+ACCESS_TOKEN_TTL = int(os.getenv("ACCESS_TOKEN_TTL", "900"))
+REFRESH_TOKEN_TTL = int(os.getenv("REFRESH_TOKEN_TTL", str(30 * 86400)))
+SESSION_SWEEP_SECONDS = float(os.getenv("SESSION_SWEEP_SECONDS", "3600"))
+
+# auth_secret and auth_session: migrations.py 010
+
+SESSION_INSERT = """
+    INSERT INTO auth_session (token_hash, role, user_id, expires_at)
+    VALUES (%s, %s, %s, now() + %s * interval '1 second')
+"""
+SESSION_SWEEP = "DELETE FROM auth_session WHERE expires_at < now()"
+
+_USER_SQL = {
+    "employee": "SELECT id, name, emp_code FROM employee WHERE id = %s",
+    "admin": "SELECT id, username FROM admin WHERE id = %s",
+}
+
+
+class TokenError(ValueError):
+    """A presented token is malformed, forged or expired."""
+
+
+# ─────────────── signing key ───────────────
+@lru_cache(maxsize=None)
+def secret_key():
+    """SECRET_KEY, else the shared random key in auth_secret (made on first use).
+
+    Raises RuntimeError if auth_secret cannot be read; failures are not
+    cached, so a later call tries again.
+    """
+    key = os.getenv("SECRET_KEY")
+    if key:
+        return key
+    try:
+        conn = open_connection()
+        try:
+            cur = conn.cursor()
+            cur.execute("""
+                INSERT INTO auth_secret (id, secret) VALUES (1, %s)
+                ON CONFLICT (id) DO NOTHING
+            """, (secrets.token_bytes(32),))
+            cur.execute("SELECT secret FROM auth_secret WHERE id = 1")
+            key = bytes(cur.fetchone()[0])
+            conn.commit()
+        finally:
+            conn.close()
+        return key
+    except Exception as e:
+        raise RuntimeError("SECRET_KEY is unset and auth_secret is unavailable "
+                           f"(database down, or migration 010 pending?): {e}") from e
+
+
+@lru_cache(maxsize=None)
+def _access():
+    return URLSafeTimedSerializer(secret_key(), salt="mobile-access",
+                                  signer_kwargs={"digest_method": hashlib.sha256})
+
+
+# ─────────────── access tokens ───────────────
+def claims_for(role, user):
+    """Token claims from an identity row (see identity.lookup_pin)."""
+    if role == "employee":
+        return {"role": role, "id": user[0], "name": user[1], "emp_code": user[2]}
+    return {"role": role, "id": user[0], "name": user[1]}
+
+
+def access_token(claims):
+    return _access().dumps(claims)
+
+
+def verify(token):
+    """Claims of a valid access token; TokenError otherwise. No I/O."""
+    try:
+        return _access().loads(token, max_age=ACCESS_TOKEN_TTL)
+    except SignatureExpired:
+        raise TokenError("token expired") from None
+    except BadSignature:
+        raise TokenError("invalid token") from None
+
+
+def from_header(authorization):
+    """Claims from an `Authorization: Bearer` value; None if there is none."""
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer":
+        return None
+    return verify(token.strip())
+
+
+def employee_claims(authorization):
+    """(id, name, emp_code) of a bearer employee token, or None without one."""
+    claims = from_header(authorization)
+    if claims is None:
+        return None
+    if claims.get("role") != "employee":
+        raise TokenError("employee token required")
+    return claims["id"], claims["name"], claims.get("emp_code")
+
+
+# ─────────────── refresh tokens ───────────────
+def _digest(token):
+    return hashlib.sha256(token.encode()).digest()
+
+
+_next_sweep = 0.0
+
+
+def sweep_due():
+    """True at most once per SESSION_SWEEP_SECONDS in this process."""
+    global _next_sweep
+    now = time.monotonic()
+    if now < _next_sweep:
+        return False
+    _next_sweep = now + SESSION_SWEEP_SECONDS
+    return True
+
+
+def new_session(role, user_id):
+    """(refresh_token, SESSION_INSERT params) – run the insert to make it live."""
+    token = secrets.token_urlsafe(32)
+    return token, (_digest(token), role, user_id, REFRESH_TOKEN_TTL)
+
+
+def token_pair(claims, refresh_token):
+    return {
+        "access_token": access_token(claims),
+        "token_type": "Bearer",
+        "expires_in": ACCESS_TOKEN_TTL,
+        "refresh_token": refresh_token,
+        "refresh_expires_in": REFRESH_TOKEN_TTL,
+    }
+
+
+def issue(cur, role, user):
+    """Start a session for an identity row; returns the token pair."""
+    if sweep_due():
+        cur.execute(SESSION_SWEEP)
+    refresh, params = new_session(role, user[0])
+    cur.execute(SESSION_INSERT, params)
+    return token_pair(claims_for(role, user), refresh)
+
+
+def refresh(cur, refresh_token):
+    """Rotate a refresh token; a new pair, or TokenError."""
+    new = secrets.token_urlsafe(32)
+    cur.execute("""
+        UPDATE auth_session
+           SET token_hash = %s, expires_at = now() + %s * interval '1 second'
+         WHERE token_hash = %s AND expires_at > now()
+     RETURNING role, user_id
+    """, (_digest(new), REFRESH_TOKEN_TTL, _digest(str(refresh_token))))
+    row = cur.fetchone()
+    if row is None:
+        raise TokenError("invalid or expired refresh token")
+    role, user_id = row
+    cur.execute(_USER_SQL[role], (user_id,))
+    user = cur.fetchone()
+    if user is None:
+        raise TokenError("account no longer exists")     # row lapses with the sweep
+    return token_pair(claims_for(role, user), new)
+
+
+def revoke(cur, refresh_token):
+    cur.execute("DELETE FROM auth_session WHERE token_hash = %s",
+                (_digest(str(refresh_token)),))
+    return cur.rowcount > 0